@@ -0,0 +1,198 @@
+"""
+Structured access logs and non-blocking log output.
+
+All log records are put on a bounded in-memory queue. A background thread
+drains it and does the actual writing, so a slow terminal, pipe or journald
+never stalls the event loop. When the queue is full, records are dropped and
+counted instead of blocking.
+
+AccessLogMiddleware emits one JSON line per API request. Each line holds the
+route template, status, latency, the number of database commands the request
+issued, and hashed user and baby ids. Successful requests are sampled with
+ACCESS_LOG_SAMPLE_RATE. Errors (status >= 400) and requests slower than
+ACCESS_LOG_SLOW_MS are always logged. Every line carries the rate it was
+sampled at, so counts can be scaled back up.
+
+Database commands are counted through a context variable. For MongoDB a
+pymongo CommandListener does the counting (Motor copies the request's
+context into its executor threads), and SQLiteClient takes the same
+listener.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import monitoring
+
+ACCESS_LOGGER = "access"
+QUEUE_SIZE = 10000
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Ids in paths of requests that never reached a route (e.g. rate limited)
+_ID_SEGMENT = re.compile(r"/[a-z]+_[0-9a-f]{8,}(?=/|$)")
+
+
+class _RequestContext:
+    __slots__ = ("db_commands", "user_id")
+
+    def __init__(self):
+        self.db_commands = 0
+        self.user_id: Optional[str] = None
+
+
+_request: ContextVar[Optional[_RequestContext]] = ContextVar("access_log_request", default=None)
+_count_lock = threading.Lock()
+
+
+def note_user(user_id: str):
+    """Attach the authenticated user to the current request's log line"""
+    context = _request.get()
+    if context is not None:
+        context.user_id = user_id
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts database commands per request; pass to the client as an event listener"""
+
+    def started(self, event):
+        context = _request.get()
+        if context is not None:
+            # Motor may run commands of one request in several threads at once
+            with _count_lock:
+                context.db_commands += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# ==================== Output ====================
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: records that don't fit in the queue are dropped"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Formatter(logging.Formatter):
+    """Access records as JSON lines, everything else in the usual text format"""
+
+    def format(self, record):
+        fields = getattr(record, "access", None)
+        if fields is None:
+            return super().format(record)
+        return json.dumps({"ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(), **fields},
+                          separators=(",", ":"))
+
+
+def configure_logging(level=logging.INFO) -> logging.handlers.QueueListener:
+    """Route the root logger (and uvicorn's) through a queue drained by a background thread"""
+    log_queue = queue.Queue(QUEUE_SIZE)
+    stream = logging.StreamHandler()
+    stream.setFormatter(_Formatter(TEXT_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, stream)
+
+    root = logging.getLogger()
+    root.handlers = [_DroppingQueueHandler(log_queue)]
+    root.setLevel(level)
+    for name in ("uvicorn", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        # Loggers without handlers were switched off (uvicorn --no-access-log)
+        if uvicorn_logger.handlers:
+            uvicorn_logger.handlers = []
+            uvicorn_logger.propagate = True
+
+    listener.start()
+    return listener
+
+
+def dropped_records() -> int:
+    return sum(getattr(handler, "dropped", 0) for handler in logging.getLogger().handlers)
+
+
+# ==================== Middleware ====================
+
+class AccessLogMiddleware:
+    """ASGI middleware writing a sampled JSON access log line per API request"""
+
+    def __init__(self, app, sample_rate: float = 1.0, slow_ms: float = 1000, hash_key: Optional[str] = None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.hash_key = hash_key.encode() if hash_key else None
+        self.logger = logging.getLogger(ACCESS_LOGGER)
+
+    def _hash(self, value: Optional[str]) -> Optional[str]:
+        if not value:
+            return None
+        if self.hash_key:
+            return hmac.new(self.hash_key, value.encode(), hashlib.sha256).hexdigest()[:16]
+        return hashlib.sha256(value.encode()).hexdigest()[:16]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope.get("path", "").startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        context = _RequestContext()
+        token = _request.set(context)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
+            latency_ms = (time.perf_counter() - started) * 1000
+            self._log(scope, status, latency_ms, context)
+
+    def _log(self, scope, status: int, latency_ms: float, context: _RequestContext):
+        if status >= 400:
+            reason = "error"
+        elif latency_ms >= self.slow_ms:
+            reason = "slow"
+        elif self.sample_rate >= 1 or random.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            return
+
+        # Routing fills in the matched route and path parameters on the shared scope
+        route = scope.get("route")
+        baby_id = (scope.get("path_params") or {}).get("baby_id")
+        self.logger.info("access", extra={"access": {
+            "method": scope["method"],
+            "route": getattr(route, "path", None) or _ID_SEGMENT.sub("/{id}", scope["path"]),
+            "status": status,
+            "latency_ms": round(latency_ms, 1),
+            "db_commands": context.db_commands,
+            "user": self._hash(context.user_id),
+            "baby": self._hash(baby_id),
+            "reason": reason,
+            "sample_rate": 1.0 if reason != "sampled" else self.sample_rate,
+        }})
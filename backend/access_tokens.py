@@ -0,0 +1,182 @@
+"""
+Stateless access tokens.
+
+After a login the backend issues its own short-lived token next to the
+long-lived session token. The token carries the user's id, email and
+profile plus an expiry, signed with HMAC-SHA256:
+
+    v1.<base64url JSON claims>.<base64url signature>
+
+Verifying one is a hash computation and a set lookup, with no database
+round trip. Clients trade their session token for a fresh access token at
+POST /auth/refresh, which is the only place sessions are read from MongoDB.
+
+Logging out revokes the session. Its id goes into `revoked_sessions` until
+every access token issued for it has expired. Each worker polls that
+collection every REVOCATION_POLL_SECONDS, and the worker handling the
+logout applies it at once.
+
+Without ACCESS_TOKEN_SECRET a random key is created once in `auth_keys`,
+so all workers sign with the same key.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "v1."
+DEFAULT_TTL_SECONDS = 15 * 60
+REVOCATION_POLL_SECONDS = 10
+# Re-read revocations this far before the previous poll, for writes that land out of order
+POLL_OVERLAP_SECONDS = 5
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def session_id(session_token: str) -> str:
+    """Short, non-reversible id of a session token, stored on sessions and in tokens"""
+    return hashlib.sha256(session_token.encode()).hexdigest()[:32]
+
+
+def is_access_token(token: str) -> bool:
+    return token.startswith(PREFIX)
+
+
+class AccessTokens:
+    """Issues and verifies signed access tokens and tracks revoked sessions"""
+
+    def __init__(self, secret: Optional[str] = None, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 poll_seconds: float = REVOCATION_POLL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        self._key = secret.encode() if secret else None
+        # session id -> unix time after which no token for it can still be valid
+        self._revoked: Dict[str, float] = {}
+        self._polled_at: Optional[datetime] = None
+        self._poller: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._key is not None
+
+    def derived_key(self, purpose: str) -> bytes:
+        """A key for another signing purpose, shared by all workers like the token key"""
+        return hmac.new(self._key, b"derive:" + purpose.encode(), hashlib.sha256).digest()
+
+    async def setup(self, db):
+        """Load the shared signing key if none was configured and start polling revocations"""
+        self._revocations = db.revoked_sessions
+        await self._revocations.create_index("expires_at", expireAfterSeconds=0)
+        await self._revocations.create_index("revoked_at")
+        await db.user_sessions.create_index("session_id", sparse=True)
+
+        if self._key is None:
+            try:
+                await db.auth_keys.insert_one({"_id": "access_token", "key": secrets.token_urlsafe(48)})
+            except DuplicateKeyError:
+                pass
+            doc = await db.auth_keys.find_one({"_id": "access_token"})
+            self._key = doc["key"].encode()
+
+        await self.poll()
+        self._poller = asyncio.ensure_future(self._poll_forever())
+
+    async def close(self):
+        if self._poller:
+            self._poller.cancel()
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, (PREFIX + payload).encode(), hashlib.sha256).digest())
+
+    def issue(self, user: dict, session_token: str):
+        """Return (token, expires_at) for a user document and the session it belongs to"""
+        expires_at = int(time.time()) + self.ttl_seconds
+        created_at = user["created_at"]
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        claims = {
+            "sub": user["user_id"],
+            "email": user["email"],
+            "name": user["name"],
+            "picture": user.get("picture"),
+            "created": int(created_at.timestamp()),
+            "sid": session_id(session_token),
+            "exp": expires_at,
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return PREFIX + payload + "." + self._sign(payload), datetime.fromtimestamp(expires_at, timezone.utc)
+
+    def verify(self, token: str) -> Optional[dict]:
+        """Return the user fields of a valid, unexpired, unrevoked token, else None"""
+        if not self.enabled or not is_access_token(token):
+            return None
+        payload, _, signature = token[len(PREFIX):].partition(".")
+        # As bytes: compare_digest rejects str with non-ASCII characters
+        if not hmac.compare_digest(signature.encode(), self._sign(payload).encode()):
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        if claims["exp"] < time.time() or claims["sid"] in self._revoked:
+            return None
+        return {
+            "user_id": claims["sub"],
+            "email": claims["email"],
+            "name": claims["name"],
+            "picture": claims["picture"],
+            "created_at": datetime.fromtimestamp(claims["created"], timezone.utc),
+            "session_id": claims["sid"],
+        }
+
+    async def revoke(self, sid: str):
+        """Reject every token of a session from now on, in all workers"""
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        self._revoked[sid] = expires_at.timestamp()
+        await self._revocations.update_one(
+            {"_id": sid},
+            {"$set": {"revoked_at": now, "expires_at": expires_at}},
+            upsert=True
+        )
+
+    async def poll(self):
+        now = datetime.now(timezone.utc)
+        query = {}
+        if self._polled_at is not None:
+            query = {"revoked_at": {"$gte": self._polled_at - timedelta(seconds=POLL_OVERLAP_SECONDS)}}
+        async for doc in self._revocations.find(query, {"expires_at": 1}):
+            expires_at = doc["expires_at"]
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._revoked[doc["_id"]] = expires_at.timestamp()
+        self._polled_at = now
+
+        # Tokens of these sessions have expired on their own by now
+        cutoff = now.timestamp()
+        for sid in [sid for sid, expiry in self._revoked.items() if expiry < cutoff]:
+            del self._revoked[sid]
+
+    async def _poll_forever(self):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Polling revoked sessions failed")
@@ -0,0 +1,213 @@
+"""
+Caregiver alerts: "no feed in 4 h", "no wet diaper in 8 h", "asleep for over 3 h".
+
+Each rule of a baby is one document in `alert_rules`. It holds the threshold
+and the time the rule measures from (`since`: the last feed, the last wet
+diaper or the start of the ongoing sleep), and `due_at = since + threshold`.
+Nothing is ever polled per baby. Record routes already keep the baby's
+state document up to date, and every state change is passed to
+`state_changed`, which reads the baby's rules from their index and moves
+the deadlines of the ones whose `since` changed. The check loop only reads rules whose `due_at` has passed,
+oldest first, from the `due_at` index.
+
+A due rule is claimed by clearing its `due_at` in the same update that
+matches it, so with several workers each alert fires once. It fires again
+only after a new feed, wet diaper or sleep moves `since`. Firing goes
+through notifiers: anything with an async `send(alert)`. InboxNotifier
+keeps alerts for the app to show, and WebhookNotifier posts them to a URL.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# rule -> (baby state field, time field in its summary, message)
+RULES = {
+    "no_feed": ("last_feeding", "start_time", "No feed logged for {duration}"),
+    "no_wet_diaper": ("last_wet_diaper", "time", "No wet diaper for {duration}"),
+    "long_sleep": ("ongoing_sleep", "start_time", "Asleep for over {duration}"),
+}
+WET_DIAPER_TYPES = ["wet", "mixed"]
+MIN_THRESHOLD_MINUTES = 15
+MAX_THRESHOLD_MINUTES = 48 * 60
+CHECK_INTERVAL_SECONDS = 30
+CHECK_BATCH = 100
+INBOX_TTL = timedelta(days=30)
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _since(rule: str, state: dict) -> Optional[datetime]:
+    field, time_field, _ = RULES[rule]
+    return _naive_utc((state.get(field) or {}).get(time_field))
+
+
+def _duration(minutes: int) -> str:
+    hours, minutes = divmod(minutes, 60)
+    if not hours:
+        return f"{minutes} min"
+    return f"{hours} h {minutes} min" if minutes else f"{hours} h"
+
+
+# ==================== Notifiers ====================
+
+class InboxNotifier:
+    """Stores fired alerts for the app to list (kept for INBOX_TTL)"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def setup(self):
+        await self.collection.create_index([("baby_id", 1), ("fired_at", -1)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def send(self, alert: dict):
+        await self.collection.insert_one({**alert, "expires_at": alert["fired_at"] + INBOX_TTL})
+
+
+class WebhookNotifier:
+    """POSTs each alert as JSON, e.g. to a push gateway or a chat webhook"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    async def send(self, alert: dict):
+        payload = {**alert, **{k: alert[k].isoformat() for k in ("since", "due_at", "fired_at") if alert.get(k)}}
+        async with httpx.AsyncClient(timeout=self.timeout) as client_http:
+            response = await client_http.post(self.url, json=payload)
+            response.raise_for_status()
+
+
+# ==================== Engine ====================
+
+class AlertEngine:
+    """Keeps rule deadlines in step with baby state and fires the ones that pass"""
+
+    def __init__(self, db, notifiers: List):
+        self.rules = db.alert_rules
+        self.notifiers = notifiers
+        self._task: Optional[asyncio.Task] = None
+
+    async def setup(self):
+        await self.rules.create_index("due_at")
+        await self.rules.create_index([("baby_id", 1), ("rule", 1)], unique=True)
+        for notifier in self.notifiers:
+            if hasattr(notifier, "setup"):
+                await notifier.setup()
+
+    # ==================== Rules ====================
+
+    async def list_rules(self, baby_id: str) -> List[dict]:
+        return await self.rules.find({"baby_id": baby_id}, {"_id": 0}).sort("rule", 1).to_list(None)
+
+    async def set_rule(self, baby_id: str, rule: str, threshold_minutes: int, state: dict, user_id: str) -> dict:
+        """Create or change a rule, measuring from the baby's current state"""
+        since = _since(rule, state)
+        due_at = since + timedelta(minutes=threshold_minutes) if since else None
+        return await self.rules.find_one_and_update(
+            {"baby_id": baby_id, "rule": rule},
+            {"$set": {
+                "threshold_minutes": threshold_minutes,
+                "since": since,
+                "due_at": due_at,
+                "fired_at": None,
+                "updated_by": user_id,
+                "updated_at": datetime.now(timezone.utc),
+            }, "$setOnInsert": {"_id": f"alertrule_{uuid.uuid4().hex[:12]}"}},
+            {"_id": 0},
+            upsert=True,
+            return_document=True
+        )
+
+    async def delete_rule(self, baby_id: str, rule: str) -> bool:
+        return (await self.rules.delete_one({"baby_id": baby_id, "rule": rule})).deleted_count > 0
+
+    async def delete_baby(self, baby_id: str):
+        await self.rules.delete_many({"baby_id": baby_id})
+
+    async def state_changed(self, baby_id: str, state: dict, fields: Optional[Iterable[str]] = None):
+        """Move the deadlines of rules measuring from the changed state fields (all when None)"""
+        # Most babies have no rules: one read from the (baby_id, rule) index and no writes
+        current = {
+            entry["rule"]: entry.get("since")
+            for entry in await self.rules.find({"baby_id": baby_id}, {"_id": 0, "rule": 1, "since": 1}).to_list(None)
+        }
+        for rule, since_before in current.items():
+            if rule not in RULES or (fields is not None and RULES[rule][0] not in fields):
+                continue
+            since = _since(rule, state)
+            # Unchanged `since` (e.g. an older record was edited) leaves a fired alert alone
+            if since == since_before:
+                continue
+            due_at = {"$add": [{"$literal": since}, {"$multiply": ["$threshold_minutes", 60 * 1000]}]} \
+                if since else None
+            # Checked again in the filter, in case another request moved it first
+            await self.rules.update_one(
+                {"baby_id": baby_id, "rule": rule, "since": {"$ne": since}},
+                [{"$set": {"since": {"$literal": since}, "due_at": due_at, "fired_at": None}}]
+            )
+
+    # ==================== Firing ====================
+
+    async def fire_due(self, now: Optional[datetime] = None) -> int:
+        """Fire every rule whose deadline has passed; returns how many this worker fired"""
+        now = _naive_utc(now or datetime.now(timezone.utc))
+        fired = 0
+        while True:
+            due = await self.rules.find(
+                {"due_at": {"$lte": now}}, {"_id": 1, "due_at": 1}
+            ).sort("due_at", 1).to_list(CHECK_BATCH)
+            for entry in due:
+                rule = await self.rules.find_one_and_update(
+                    {"_id": entry["_id"], "due_at": entry["due_at"]},
+                    {"$set": {"due_at": None, "fired_at": now}}
+                )
+                if rule:
+                    await self._notify(rule, now)
+                    fired += 1
+            if len(due) < CHECK_BATCH:
+                return fired
+
+    async def _notify(self, rule: dict, now: datetime):
+        alert = {
+            "alert_id": f"alert_{uuid.uuid4().hex[:12]}",
+            "baby_id": rule["baby_id"],
+            "rule": rule["rule"],
+            "threshold_minutes": rule["threshold_minutes"],
+            "message": RULES[rule["rule"]][2].format(duration=_duration(rule["threshold_minutes"])),
+            "since": rule["since"],
+            "due_at": rule["due_at"],
+            "fired_at": now,
+        }
+        for notifier in self.notifiers:
+            try:
+                await notifier.send(alert)
+            except Exception:
+                logger.exception("%s failed to send alert %s", type(notifier).__name__, alert["alert_id"])
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await self.fire_due()
+            except Exception:
+                logger.exception("Alert check failed")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = CHECK_INTERVAL_SECONDS):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,400 @@
+"""
+Cold-history archive for feeding, sleep and diaper records.
+
+Records older than ARCHIVE_AFTER_DAYS are moved out of the hot collections
+into `event_archive`. There is one document per (baby_id, event type, UTC
+month), holding the month's records as zlib-compressed BSON. Years of
+history then cost a few dozen small documents per baby instead of tens of
+thousands of records and index entries.
+
+The archive horizon is stored in `migrations`. Records before it may live
+in buckets. EventStore reads whose range starts after the horizon, which is
+almost all of them, never touch the archive. Older ranges read the matching
+buckets, filter the records in memory and merge them with whatever is still
+hot. Editing or deleting an archived record first restores it to its hot
+collection. The next run archives it again. Text searches decode and score
+the buckets of the babies searched, since buckets have no text index.
+
+Run the job from cron, e.g. nightly:
+
+    python archive.py run [older_than_days]
+
+It first moves the horizon forward. Then it waits until every worker has
+picked up the new horizon, and only then moves records. Each month is
+written to its bucket before it is deleted from the hot collection, and
+buckets are merged by record id. An interrupted run can therefore just be
+started again. Records are deleted only in the version that was written to
+the bucket (matched on `updated_at`), so an edit landing mid-run stays hot.
+Buckets carry a version and are rewritten optimistically.
+"""
+import asyncio
+import logging
+import os
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+import bson
+from pymongo.errors import DuplicateKeyError
+
+from query import match, project, run_pipeline, sort_key, text_score
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = "event_archive"
+HORIZON_ID = "event_archive"
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+# Workers re-read the horizon this often. The job waits that long, plus a margin for
+# requests that were already running with the old horizon, before moving records.
+HORIZON_REFRESH_SECONDS = 60
+HORIZON_MARGIN_SECONDS = 30
+
+# event_type -> (legacy collection, id field, time field); mirrors event_store.EVENT_TYPES
+ARCHIVED_TYPES = {
+    "feeding": ("feeding_records", "feeding_id", "start_time"),
+    "sleep": ("sleep_records", "sleep_id", "start_time"),
+    "diaper": ("diaper_records", "diaper_id", "time"),
+}
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def month_start(value: datetime) -> datetime:
+    return _naive_utc(value).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month: datetime) -> datetime:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def encode_records(records: List[dict]) -> bytes:
+    return zlib.compress(bson.encode({"records": records}))
+
+
+def decode_records(data: bytes) -> List[dict]:
+    return bson.decode(zlib.decompress(data))["records"]
+
+
+class EventArchive:
+    """Reads and writes the monthly buckets of one database"""
+
+    def __init__(self, db):
+        self.db = db
+        self.buckets = db[ARCHIVE_COLLECTION]
+        self._horizon: Optional[datetime] = None
+        self._horizon_read_at = float("-inf")
+
+    async def setup(self):
+        await self.buckets.create_index([("baby_id", 1), ("event_type", 1), ("month", 1)])
+        await self.buckets.create_index([("event_type", 1), ("ids", 1)])
+
+    async def horizon(self) -> Optional[datetime]:
+        """Records before this instant may be archived (None if nothing ever was)"""
+        if time.monotonic() - self._horizon_read_at > HORIZON_REFRESH_SECONDS:
+            doc = await self.db.migrations.find_one({"_id": HORIZON_ID}, {"horizon": 1})
+            self._horizon = _naive_utc(doc["horizon"]) if doc else None
+            self._horizon_read_at = time.monotonic()
+        return self._horizon
+
+    async def find(self, event_type: str, baby_ids: List[str], start: Optional[datetime],
+                   end: Optional[datetime], extra: Optional[dict] = None, newest_limit: int = 0) -> List[dict]:
+        """Archived records of [start, end), matching `extra`, in legacy record shape.
+
+        With `newest_limit`, months are read newest first and reading stops once
+        that many records were found.
+        """
+        _, _, time_field = ARCHIVED_TYPES[event_type]
+        months = {}
+        if start is not None:
+            months["$gte"] = month_start(start)
+        if end is not None:
+            months["$lt"] = _naive_utc(end)
+        query = {"baby_id": {"$in": baby_ids}, "event_type": event_type}
+        if months:
+            query["month"] = months
+
+        time_range = {}
+        if start is not None:
+            time_range["$gte"] = start
+        if end is not None:
+            time_range["$lt"] = end
+        record_filter = {"baby_id": {"$in": baby_ids}, **(extra or {})}
+        if time_range:
+            record_filter[time_field] = time_range
+
+        cursor = self.buckets.find(query, {"data": 1})
+        if newest_limit:
+            cursor = cursor.sort("month", -1)
+        records = []
+        async for bucket in cursor:
+            records.extend(r for r in decode_records(bucket["data"]) if match(r, record_filter))
+            if newest_limit and len(records) >= newest_limit:
+                break
+        return records
+
+    async def search(self, event_type: str, baby_ids: List[str], fields: List[str], search: str,
+                     end: Optional[datetime] = None) -> List[dict]:
+        """Archived records matching a $text search on `fields`, with their "score".
+
+        Buckets have no text index, so every bucket of the babies (up to the
+        month of `end`) is decoded and scored in memory like MongoDB's $text.
+        """
+        query = {"baby_id": {"$in": baby_ids}, "event_type": event_type}
+        if end is not None:
+            query["month"] = {"$lte": month_start(end)}
+        records = []
+        async for bucket in self.buckets.find(query, {"data": 1}):
+            for record in decode_records(bucket["data"]):
+                score = text_score(record, fields, search)
+                if score and record.get("baby_id") in baby_ids:
+                    record.pop("_id", None)
+                    record["score"] = score
+                    records.append(record)
+        return records
+
+    async def delete_baby(self, baby_id: str):
+        await self.buckets.delete_many({"baby_id": baby_id})
+
+    # ==================== Archival job ====================
+
+    async def set_horizon(self, horizon: datetime) -> bool:
+        """Move the horizon forward (never back); returns whether it moved"""
+        current = await self.horizon()
+        if current is not None and current >= horizon:
+            return False
+        await self.db.migrations.update_one(
+            {"_id": HORIZON_ID}, {"$set": {"horizon": horizon}}, upsert=True
+        )
+        self._horizon, self._horizon_read_at = horizon, time.monotonic()
+        return True
+
+    async def _update_bucket(self, event_type: str, baby_id: str, month: datetime,
+                             change: Callable[[dict], None]):
+        """Apply `change` to a bucket's records (a dict by record id), retrying if another write got in first"""
+        _, id_field, time_field = ARCHIVED_TYPES[event_type]
+        bucket_id = f"{baby_id}:{event_type}:{month:%Y-%m}"
+        while True:
+            bucket = await self.buckets.find_one({"_id": bucket_id}, {"data": 1, "version": 1})
+            records = {r[id_field]: r for r in decode_records(bucket["data"])} if bucket else {}
+            change(records)
+            ordered = sorted(records.values(), key=lambda r: r[time_field])
+            version = bucket.get("version") if bucket else None
+            document = {
+                "baby_id": baby_id,
+                "event_type": event_type,
+                "month": month,
+                "count": len(ordered),
+                "ids": [r[id_field] for r in ordered],
+                "data": encode_records(ordered),
+                "version": (version or 0) + 1,
+                "updated_at": datetime.now(timezone.utc),
+            }
+
+            if bucket is None:
+                if not ordered:
+                    return
+                try:
+                    await self.buckets.insert_one({"_id": bucket_id, **document})
+                    return
+                except DuplicateKeyError:
+                    continue
+            current = {"_id": bucket_id, "version": version}
+            if not ordered:
+                if (await self.buckets.delete_one(current)).deleted_count:
+                    return
+            elif (await self.buckets.replace_one(current, document)).matched_count:
+                return
+
+    async def archive_month(self, event_type: str, baby_id: str, month: datetime, mirror=None) -> int:
+        """Move one baby's records of one month into its bucket; returns how many moved"""
+        collection_name, id_field, time_field = ARCHIVED_TYPES[event_type]
+        collection = self.db[collection_name]
+        records = await collection.find(
+            {"baby_id": baby_id, time_field: {"$gte": month, "$lt": next_month(month)}}, {"_id": 0}
+        ).to_list(None)
+        if not records:
+            return 0
+
+        await self._update_bucket(event_type, baby_id, month,
+                                  lambda merged: merged.update((r[id_field], r) for r in records))
+
+        # Delete only the versions now in the bucket; a record edited since the read stays hot
+        await collection.delete_many({"$or": [
+            {id_field: r[id_field], "updated_at": r.get("updated_at")} for r in records
+        ]})
+        record_ids = [r[id_field] for r in records]
+        kept = {doc[id_field] for doc in await collection.find(
+            {id_field: {"$in": record_ids}}, {"_id": 0, id_field: 1}
+        ).to_list(None)}
+        if kept:
+            # Their bucket copies are stale (run() comes back for the new versions)
+            await self._update_bucket(event_type, baby_id, month,
+                                      lambda merged: [merged.pop(record_id, None) for record_id in kept])
+
+        moved = [record_id for record_id in record_ids if record_id not in kept]
+        if mirror is not None and moved:
+            await mirror.delete_many({"event_type": event_type, id_field: {"$in": moved}})
+        return len(moved)
+
+    async def restore(self, event_type: str, record_id: str, baby_ids: List[str]) -> Optional[dict]:
+        """Move an archived record of one of `baby_ids` back to its hot collection; returns it, or None"""
+        collection_name, id_field, _ = ARCHIVED_TYPES[event_type]
+        collection = self.db[collection_name]
+        bucket = await self.buckets.find_one(
+            {"event_type": event_type, "ids": record_id, "baby_id": {"$in": baby_ids}},
+            {"baby_id": 1, "month": 1, "data": 1}
+        )
+        if not bucket:
+            return None
+        record = next((r for r in decode_records(bucket["data"]) if r[id_field] == record_id), None)
+        if record is None:
+            return None
+
+        # Hot copy first, so the record is never in neither place. Its new updated_at
+        # keeps a running job from deleting it on the strength of an earlier read.
+        fields = {k: v for k, v in record.items() if k != "updated_at"}
+        await collection.update_one(
+            {id_field: record_id},
+            {"$set": {"updated_at": datetime.now(timezone.utc)}, "$setOnInsert": fields},
+            upsert=True
+        )
+        await self._update_bucket(event_type, bucket["baby_id"], bucket["month"],
+                                  lambda merged: merged.pop(record_id, None))
+        return await collection.find_one({id_field: record_id}, {"_id": 0})
+
+    async def run(self, older_than_days: int = DEFAULT_ARCHIVE_AFTER_DAYS, mirror=None,
+                  refresh_seconds: float = HORIZON_REFRESH_SECONDS + HORIZON_MARGIN_SECONDS,
+                  pause_seconds: float = 0.0) -> dict:
+        """Archive every whole month older than `older_than_days`.
+
+        `mirror` is the time-series `events` collection when it is being dual-written.
+        """
+        horizon = month_start(datetime.now(timezone.utc) - timedelta(days=older_than_days))
+        await self.setup()
+        if await self.set_horizon(horizon):
+            logger.info("Archive horizon moved to %s; waiting %ss for workers", horizon, refresh_seconds)
+            await asyncio.sleep(refresh_seconds)
+        horizon = await self.horizon()
+
+        moved = {}
+        for event_type, (collection_name, _, time_field) in ARCHIVED_TYPES.items():
+            collection = self.db[collection_name]
+            moved[event_type] = 0
+            for baby_id in await collection.distinct("baby_id", {time_field: {"$lt": horizon}}):
+                while True:
+                    oldest = await collection.find_one(
+                        {"baby_id": baby_id, time_field: {"$lt": horizon}},
+                        {"_id": 0, time_field: 1},
+                        sort=[(time_field, 1)]
+                    )
+                    if not oldest:
+                        break
+                    month = month_start(oldest[time_field])
+                    moved[event_type] += await self.archive_month(event_type, baby_id, month, mirror)
+                    if pause_seconds:
+                        await asyncio.sleep(pause_seconds)
+            logger.info("Archived %d %s records", moved[event_type], event_type)
+        return moved
+
+
+class ArchiveCursor:
+    """Cursor over a range of records that may reach back into the archive.
+
+    `hot` returns the cursor the hot collections would serve on their own. For
+    aggregations, `hot_records` returns the raw hot records instead, and
+    `stages` then run in memory over hot and archived records together.
+    """
+
+    def __init__(self, archive: EventArchive, event_type: str, baby_ids: List[str],
+                 start: Optional[datetime], end: Optional[datetime], hot: Callable,
+                 projection: Optional[dict] = None, newest_first: bool = False, extra: Optional[dict] = None,
+                 hot_records: Optional[Callable] = None, stages: Optional[List[dict]] = None):
+        self.archive = archive
+        self.event_type = event_type
+        self.baby_ids = baby_ids
+        self.start = start
+        self.end = end
+        self.hot = hot
+        self.projection = projection
+        self.newest_first = newest_first
+        self.extra = extra
+        self.hot_records = hot_records
+        self.stages = stages
+
+    async def to_list(self, length: Optional[int] = None) -> list:
+        horizon = await self.archive.horizon()
+        if horizon is None or (self.start is not None and _naive_utc(self.start) >= horizon):
+            return await self.hot().to_list(length)
+
+        _, id_field, time_field = ARCHIVED_TYPES[self.event_type]
+        if self.stages is not None:
+            records = await self.hot_records().to_list(None)
+        else:
+            records = await self.hot().to_list(length)
+            # A full page of newest records after the horizon can't include archived ones
+            if self.newest_first and length and len(records) >= length and \
+                    time_field in records[-1] and _naive_utc(records[-1][time_field]) >= horizon:
+                return records
+
+        end = min(_naive_utc(self.end), horizon) if self.end is not None else horizon
+        archived = await self.archive.find(
+            self.event_type, self.baby_ids, self.start, end, self.extra,
+            newest_limit=length if self.newest_first and length and len(self.baby_ids) == 1 else 0
+        )
+        # A record is in both places only while the job is between writing its bucket and deleting it
+        hot_ids = {r[id_field] for r in records if id_field in r}
+        records.extend(r for r in archived if r[id_field] not in hot_ids)
+
+        if self.stages is not None:
+            docs = run_pipeline(records, self.stages)
+            return docs[:length] if length else docs
+
+        records = [project(r, self.projection) for r in records]
+        if self.newest_first and records and all(time_field in r for r in records):
+            records.sort(key=lambda r: sort_key(r[time_field]), reverse=True)
+        return records[:length] if length else records
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list(None):
+            yield doc
+
+
+async def _main(argv: List[str]):
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    if len(argv) < 2 or argv[1] != "run":
+        print("Usage: python archive.py run [older_than_days]")
+        return
+
+    if os.environ.get("STORAGE_BACKEND", "mongo").lower() == "sqlite":
+        from sqlite_store import SQLiteClient
+        client = SQLiteClient(os.environ.get("SQLITE_PATH", str(Path(__file__).parent / "baby_day_book.db")))
+        db = client[os.environ.get("DB_NAME", "baby_day_book")]
+        mirror = None
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+        dual_write = os.environ.get("EVENT_STORE_MODE", "legacy") in ("dual", "unified")
+        mirror = db.events if dual_write else None
+
+    days = int(argv[2]) if len(argv) > 2 else int(os.environ.get("ARCHIVE_AFTER_DAYS", DEFAULT_ARCHIVE_AFTER_DAYS))
+    moved = await EventArchive(db).run(days, mirror)
+    print(f"Archived: {moved}")
+    client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(sys.argv))
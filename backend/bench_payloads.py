@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Measure bytes-on-wire and encode CPU for typical API payloads.
+
+Builds realistic timeline, list and export payloads (already passed through
+jsonable_encoder, as FastAPI does) and reports the size and encode time of
+each encoding the server can negotiate. Needs no database.
+
+Usage: python bench_payloads.py [days_of_history]
+"""
+import json
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def feeding(baby_id, user_id, t):
+    return {
+        "feeding_id": f"feed_{uuid.uuid4().hex[:12]}", "baby_id": baby_id, "user_id": user_id,
+        "feeding_type": random.choice(["breast_left", "breast_right", "bottle"]),
+        "start_time": t.isoformat(), "end_time": (t + timedelta(minutes=15)).isoformat(),
+        "duration_minutes": 15, "amount_ml": random.choice([None, 90, 120]),
+        "notes": None, "food_type": None, "created_at": t.isoformat()
+    }
+
+
+def sleep(baby_id, user_id, t):
+    return {
+        "sleep_id": f"sleep_{uuid.uuid4().hex[:12]}", "baby_id": baby_id, "user_id": user_id,
+        "sleep_type": random.choice(["nap", "night"]), "start_time": t.isoformat(),
+        "end_time": (t + timedelta(minutes=70)).isoformat(), "duration_minutes": 70,
+        "quality": "good", "notes": None, "created_at": t.isoformat()
+    }
+
+
+def diaper(baby_id, user_id, t):
+    return {
+        "diaper_id": f"diaper_{uuid.uuid4().hex[:12]}", "baby_id": baby_id, "user_id": user_id,
+        "diaper_type": random.choice(["wet", "dirty", "mixed"]), "time": t.isoformat(),
+        "notes": None, "created_at": t.isoformat()
+    }
+
+
+def build_payloads(days: int):
+    baby_id, user_id = "baby_0123456789ab", "user_0123456789ab"
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    records = {"feeding": [], "sleep": [], "diaper": []}
+    for day in range(days):
+        base = start + timedelta(days=day)
+        for hour in range(0, 24, 3):
+            records["feeding"].append(feeding(baby_id, user_id, base + timedelta(hours=hour)))
+            records["diaper"].append(diaper(baby_id, user_id, base + timedelta(hours=hour, minutes=20)))
+        for hour in (1, 9, 13, 19):
+            records["sleep"].append(sleep(baby_id, user_id, base + timedelta(hours=hour)))
+
+    id_fields = {"feeding": "feeding_id", "sleep": "sleep_id", "diaper": "diaper_id"}
+    time_fields = {"feeding": "start_time", "sleep": "start_time", "diaper": "time"}
+    day_records = [(t, r) for t, rs in records.items() for r in rs if r[time_fields[t]].startswith("2025-01-01")]
+    timeline = [
+        {"entry_id": r[id_fields[t]], "entry_type": t, "time": r[time_fields[t]], "data": r, "created_by": user_id}
+        for t, r in day_records
+    ]
+    return {
+        "timeline (1 day)": timeline,
+        "feeding list (100)": records["feeding"][-100:],
+        f"export ({days} days)": records,
+    }
+
+
+def measure(encode, payload, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = encode(payload)
+    return data, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+    random.seed(1)
+    encoders = {
+        "json": lambda p: json.dumps(p, separators=(",", ":")).encode(),
+        "json+gzip": lambda p: zlib.compress(json.dumps(p, separators=(",", ":")).encode(), 6),
+    }
+    if brotli:
+        encoders["json+br"] = lambda p: brotli.compress(json.dumps(p, separators=(",", ":")).encode(), quality=4)
+    if msgpack:
+        encoders["msgpack"] = lambda p: msgpack.packb(p, use_bin_type=True)
+        encoders["msgpack+gzip"] = lambda p: zlib.compress(msgpack.packb(p, use_bin_type=True), 6)
+        if brotli:
+            encoders["msgpack+br"] = lambda p: brotli.compress(msgpack.packb(p, use_bin_type=True), quality=4)
+
+    for name, payload in build_payloads(days).items():
+        print(name)
+        for encoding, encode in encoders.items():
+            data, ms = measure(encode, payload)
+            print(f"  {encoding:<14}{len(data):>10,} bytes {ms:>8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Compare startup time and memory of the storage backends.
+
+Starts the API once per backend with uvicorn, waits until /api/health
+answers, then creates and reads back records for one baby and reports the
+server's resident memory. For MongoDB the resident memory of the local
+mongod process is reported as well, since it is part of what a self-hoster
+has to run. Linux only (reads /proc).
+
+Usage: python bench_storage.py [sqlite|mongo ...]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+PORT = 8765
+BASE_URL = f"http://127.0.0.1:{PORT}/api"
+RECORDS = 200
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def mongod_pids():
+    pids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/comm") as f:
+                    if f.read().strip() == "mongod":
+                        pids.append(int(entry))
+            except OSError:
+                pass
+    return pids
+
+
+async def create_session(env) -> str:
+    """Insert a test user and session directly into the selected store"""
+    if env["STORAGE_BACKEND"] == "sqlite":
+        from sqlite_store import SQLiteClient
+        client = SQLiteClient(env["SQLITE_PATH"])
+        db = client[env.get("DB_NAME", "baby_day_book")]
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(env["MONGO_URL"])
+        db = client[env["DB_NAME"]]
+
+    now = datetime.now(timezone.utc)
+    user_id, token = f"user_{uuid.uuid4().hex[:12]}", f"bench_{uuid.uuid4().hex}"
+    await db.users.insert_one({"user_id": user_id, "email": f"{user_id}@example.com", "name": "Bench",
+                               "picture": None, "created_at": now})
+    await db.user_sessions.insert_one({"user_id": user_id, "session_token": token,
+                                       "expires_at": now + timedelta(days=1), "created_at": now})
+    client.close()
+    return token
+
+
+def run(backend: str):
+    env = dict(os.environ, STORAGE_BACKEND=backend, RATE_LIMIT_USER_PER_MINUTE="0",
+               RATE_LIMIT_BABY_PER_MINUTE="0")
+    if backend == "sqlite":
+        env["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    elif "MONGO_URL" not in env:
+        print(f"{backend}: MONGO_URL not set, skipped")
+        return
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(PORT)],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                if requests.get(f"{BASE_URL}/health", timeout=1).ok:
+                    break
+            except requests.ConnectionError:
+                pass
+            if server.poll() is not None or time.perf_counter() - started > 60:
+                print(f"{backend}: server did not start")
+                return
+            time.sleep(0.05)
+        startup_ms = (time.perf_counter() - started) * 1000
+        idle_rss = rss_mb(server.pid)
+
+        headers = {"Authorization": f"Bearer {asyncio.run(create_session(env))}"}
+        baby = requests.post(f"{BASE_URL}/baby", headers=headers,
+                             json={"name": "Bench", "birth_date": "2025-01-01"}).json()
+        work_started = time.perf_counter()
+        day = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        for i in range(RECORDS):
+            requests.post(f"{BASE_URL}/feeding", headers=headers, json={
+                "baby_id": baby["baby_id"], "feeding_type": "bottle", "amount_ml": 120,
+                "start_time": (day + timedelta(minutes=7 * i)).isoformat()
+            })
+        for _ in range(20):
+            requests.get(f"{BASE_URL}/timeline/{baby['baby_id']}?date=2025-03-01", headers=headers)
+            requests.get(f"{BASE_URL}/stats/{baby['baby_id']}?date=2025-03-01", headers=headers)
+        work_ms = (time.perf_counter() - work_started) * 1000
+
+        print(f"{backend}:")
+        print(f"  startup            {startup_ms:>8.0f} ms")
+        print(f"  server RSS idle    {idle_rss:>8.1f} MB")
+        print(f"  server RSS loaded  {rss_mb(server.pid):>8.1f} MB")
+        print(f"  {RECORDS} inserts + 40 reads {work_ms:>6.0f} ms")
+        if backend == "mongo":
+            for pid in mongod_pids():
+                print(f"  mongod RSS         {rss_mb(pid):>8.1f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    for backend in sys.argv[1:] or ["sqlite", "mongo"]:
+        run(backend)
+
+
+if __name__ == "__main__":
+    main()
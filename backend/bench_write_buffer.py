@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-request insert_one against the group-commit WriteBuffer.
+
+Simulates N concurrent clients each logging records into a scratch
+collection and reports throughput and latency percentiles per path.
+
+Usage: python bench_write_buffer.py [clients] [inserts_per_client] [window_ms]
+
+Runs against MONGO_URL, or the SQLite file at SQLITE_PATH with
+STORAGE_BACKEND=sqlite.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from write_buffer import WriteBuffer
+
+load_dotenv(Path(__file__).parent / '.env')
+
+
+def make_doc():
+    return {
+        "feeding_id": f"feed_{uuid.uuid4().hex[:12]}",
+        "baby_id": "baby_benchmark",
+        "user_id": "user_benchmark",
+        "feeding_type": "bottle",
+        "start_time": datetime.now(timezone.utc),
+        "amount_ml": 120,
+        "created_at": datetime.now(timezone.utc)
+    }
+
+
+async def run(insert, clients: int, per_client: int):
+    latencies = []
+
+    async def worker():
+        for _ in range(per_client):
+            start = time.perf_counter()
+            await insert(make_doc())
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "inserts/s": round(len(latencies) / elapsed),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 2),
+    }
+
+
+async def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    window_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    if os.environ.get("STORAGE_BACKEND", "mongo").lower() == "sqlite":
+        from sqlite_store import SQLiteClient
+        client = SQLiteClient(os.environ.get("SQLITE_PATH", str(Path(__file__).parent / "baby_day_book.db")))
+        db = client[os.environ.get("DB_NAME", "baby_day_book")]
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+    collection = db["benchmark_feeding_records"]
+    await collection.drop()
+
+    print(f"{clients} clients x {per_client} inserts")
+    print("insert_one:     ", await run(collection.insert_one, clients, per_client))
+
+    buffer = WriteBuffer(window_ms=window_ms)
+    print(f"WriteBuffer {window_ms}ms:", await run(lambda doc: buffer.insert(collection, doc), clients, per_client))
+    await buffer.close()
+
+    await collection.drop()
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,273 @@
+"""
+Age-normalized cohort benchmarks ("is 11 hours of sleep typical at 4 months?").
+
+    python cohort.py run
+
+The job reads every baby's history once and turns it into daily metrics:
+sleep minutes, feeds, bottle ml, and diaper, wet and dirty counts. A day
+only counts for a metric if that kind of record was logged on it, so a
+family that never logs diapers doesn't pull the diaper percentiles to zero.
+Each baby contributes at most one value per metric and age week: the mean
+of its logged days that week, and only if at least MIN_DAYS_PER_WEEK days
+were logged.
+
+Percentiles per age week are then computed over NumPy arrays in a process
+pool, one task per metric. The result is a single small document in
+`cohort_tables` holding, per metric, a row [babies, p10, p25, p50, p75, p90]
+per age week. Weeks with fewer than MIN_BABIES contributing babies are left
+out. No baby or user ids are stored, so the table can't be traced back to a
+family.
+
+The comparison endpoint keeps the table in memory (CohortTables) and looks
+up a baby's age week by index, so serving costs nothing per request beyond
+the baby's own last seven days. Run the job from cron, e.g. weekly. Reads
+prefer secondaries, and the table is replaced in one write.
+"""
+import array
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from migrations import read_date
+from sleep_accounting import CONTEXT as SLEEP_CONTEXT, MAX_SLEEP_DURATION, SLEEP_PROJECTION, account_sleep
+
+logger = logging.getLogger(__name__)
+
+COHORT_COLLECTION = "cohort_tables"
+COHORT_ID = "age_weeks"
+METRICS = ("sleep_minutes", "feeds", "bottle_ml", "diapers", "wet_diapers", "dirty_diapers")
+PERCENTILES = (10, 25, 50, 75, 90)
+MAX_AGE_WEEKS = 104
+MIN_BABIES = 10
+MIN_DAYS_PER_WEEK = 3
+BABY_CONCURRENCY = 8
+COMPARE_DAYS = 7
+REFRESH_SECONDS = 600
+
+
+def birth_day(baby: dict) -> Optional[date]:
+    return read_date(baby.get("birth_date"))
+
+
+def age_in_weeks(baby: dict, day: date) -> Optional[int]:
+    born = birth_day(baby)
+    if born is None or day < born:
+        return None
+    return (day - born).days // 7
+
+
+async def daily_metrics(store, baby_id: str, window_start: datetime, days: int,
+                        tz_offset_minutes: int = 0) -> Dict[str, Dict[str, float]]:
+    """{metric: {local date: value}} over [window_start, +days), only for days the metric was logged on"""
+    offset = timedelta(minutes=tz_offset_minutes)
+    window_end = window_start + timedelta(days=days)
+    local_day = lambda field: {"$dateToString": {
+        "format": "%Y-%m-%d", "date": {"$add": [f"${field}", tz_offset_minutes * 60 * 1000]}
+    }}
+    count_in = lambda field, values: {"$sum": {"$cond": [{"$in": [f"${field}", values]}, 1, 0]}}
+    feeding_stages = [{"$group": {
+        "_id": local_day("start_time"),
+        "feeds": {"$sum": 1},
+        "bottle_ml": {"$sum": {"$cond": [
+            {"$eq": ["$feeding_type", "bottle"]}, {"$ifNull": ["$amount_ml", 0]}, 0
+        ]}},
+    }}]
+    # Mixed diapers count as both wet and dirty
+    diaper_stages = [{"$group": {
+        "_id": local_day("time"),
+        "diapers": {"$sum": 1},
+        "wet_diapers": count_in("diaper_type", ["wet", "mixed"]),
+        "dirty_diapers": count_in("diaper_type", ["dirty", "mixed"]),
+    }}]
+
+    feeding_rows, sleep_records, diaper_rows = await asyncio.gather(
+        store.aggregate("feeding", [baby_id], window_start - offset, window_end - offset, feeding_stages).to_list(None),
+        store.find_overlapping(
+            "sleep", [baby_id], window_start - offset - SLEEP_CONTEXT, window_end - offset,
+            MAX_SLEEP_DURATION, SLEEP_PROJECTION
+        ).to_list(None),
+        store.aggregate("diaper", [baby_id], window_start - offset, window_end - offset, diaper_stages).to_list(None),
+    )
+
+    metrics: Dict[str, Dict[str, float]] = {metric: {} for metric in METRICS}
+    for row in feeding_rows + diaper_rows:
+        for metric, value in row.items():
+            if metric != "_id":
+                metrics[metric][row["_id"]] = value
+    for day in account_sleep(sleep_records, window_start, days, utc_offset_minutes=tz_offset_minutes):
+        # Days on which no sleep started only hold the tail of the previous night
+        if day["sleep_count"]:
+            metrics["sleep_minutes"][day["date"]] = day["total_minutes"]
+    return metrics
+
+
+# ==================== Batch job ====================
+
+class _Samples:
+    """(age week, value) pairs of one metric, stored compactly until the percentiles are computed"""
+
+    def __init__(self):
+        self.weeks = array.array("H")
+        self.values = array.array("d")
+
+
+async def _collect_baby(store, baby: dict, today: date, samples: Dict[str, _Samples]) -> bool:
+    born = birth_day(baby)
+    if born is None or born >= today:
+        return False
+    days = min((today - born).days, MAX_AGE_WEEKS * 7)
+    window_start = datetime(born.year, born.month, born.day)
+    metrics = await daily_metrics(store, baby["baby_id"], window_start, days)
+
+    contributed = False
+    for metric, by_day in metrics.items():
+        weekly: Dict[int, List[float]] = {}
+        for day, value in by_day.items():
+            weekly.setdefault((date.fromisoformat(day) - born).days // 7, []).append(value)
+        for week, values in weekly.items():
+            if len(values) >= MIN_DAYS_PER_WEEK:
+                samples[metric].weeks.append(week)
+                samples[metric].values.append(sum(values) / len(values))
+                contributed = True
+    return contributed
+
+
+def percentile_table(weeks: np.ndarray, values: np.ndarray, min_babies: int = MIN_BABIES) -> List[Optional[list]]:
+    """[babies, p10, ..., p90] per age week, None where too few babies; runs in the process pool"""
+    order = np.argsort(weeks, kind="stable")
+    weeks, values = weeks[order], values[order]
+    bounds = np.searchsorted(weeks, np.arange(MAX_AGE_WEEKS + 1))
+    table: List[Optional[list]] = []
+    for week in range(MAX_AGE_WEEKS):
+        sample = values[bounds[week]:bounds[week + 1]]
+        if len(sample) < min_babies:
+            table.append(None)
+        else:
+            table.append([int(len(sample))] + np.round(np.percentile(sample, PERCENTILES), 1).tolist())
+    return table
+
+
+async def build_cohort_tables(source, store, max_workers: int = 2, min_babies: int = MIN_BABIES) -> dict:
+    """Read every baby's history, compute the percentile tables and replace the stored document"""
+    today = datetime.now(timezone.utc).date()
+    samples = {metric: _Samples() for metric in METRICS}
+    semaphore = asyncio.Semaphore(BABY_CONCURRENCY)
+    babies = 0
+
+    async def collect(baby: dict):
+        nonlocal babies
+        async with semaphore:
+            if await _collect_baby(store, baby, today, samples):
+                babies += 1
+
+    pending = set()
+    async for baby in source.babies.find({}, {"_id": 0, "baby_id": 1, "birth_date": 1}):
+        pending.add(asyncio.ensure_future(collect(baby)))
+        if len(pending) >= BABY_CONCURRENCY * 4:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+    if pending:
+        await asyncio.gather(*pending)
+    logger.info("Collected daily metrics of %d babies", babies)
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        tables = await asyncio.gather(*(
+            loop.run_in_executor(
+                pool, percentile_table,
+                np.frombuffer(samples[metric].weeks, dtype=np.uint16),
+                np.frombuffer(samples[metric].values, dtype=np.float64),
+                min_babies
+            )
+            for metric in METRICS
+        ))
+
+    document = {
+        "_id": COHORT_ID,
+        "generated_at": datetime.now(timezone.utc),
+        "babies": babies,
+        "min_babies": min_babies,
+        "percentiles": list(PERCENTILES),
+        "metrics": dict(zip(METRICS, tables)),
+    }
+    # Writes go to the primary whatever the database's read preference
+    await source[COHORT_COLLECTION].replace_one({"_id": COHORT_ID}, document, upsert=True)
+    return document
+
+
+# ==================== Serving ====================
+
+class CohortTables:
+    """In-memory copy of the cohort table, reloaded every REFRESH_SECONDS"""
+
+    def __init__(self, collection, refresh_seconds: float = REFRESH_SECONDS):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self._table: Optional[dict] = None
+        self._loaded_at: Optional[float] = None
+
+    async def get(self) -> Optional[dict]:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self._table = await self.collection.find_one({"_id": COHORT_ID})
+            self._loaded_at = time.monotonic()
+        return self._table
+
+
+def compare(table: dict, week: int, metric: str, value: float) -> Optional[dict]:
+    """Where `value` falls in the cohort of age `week`, or None when there is no cohort for it"""
+    rows = table["metrics"].get(metric) or []
+    row = rows[week] if 0 <= week < len(rows) else None
+    if row is None:
+        return None
+    babies, cuts = row[0], np.array(row[1:])
+    ranks = np.array(table["percentiles"])
+    # Interpolated between the stored cuts (so clamped to the outermost ones); equal
+    # cuts are searched from both sides, which puts a tied value in the middle of them
+    rank = (np.interp(value, cuts, ranks) + np.interp(-value, -cuts[::-1], ranks[::-1])) / 2
+    return {
+        "babies": babies,
+        "percentiles": {f"p{p}": cut for p, cut in zip(table["percentiles"], row[1:])},
+        "percentile": round(float(rank)),
+    }
+
+
+async def _main(argv: List[str]):
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    from event_store import EventStore
+
+    load_dotenv(Path(__file__).parent / '.env')
+    if len(argv) < 2 or argv[1] != "run":
+        print("Usage: python cohort.py run")
+        return
+
+    if os.environ.get("STORAGE_BACKEND", "mongo").lower() == "sqlite":
+        from sqlite_store import SQLiteClient
+        client = SQLiteClient(os.environ.get("SQLITE_PATH", str(Path(__file__).parent / "baby_day_book.db")))
+        db = client[os.environ.get("DB_NAME", "baby_day_book")]
+        store = EventStore(db)
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from pymongo import ReadPreference
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client.get_database(os.environ['DB_NAME'], read_preference=ReadPreference.SECONDARY_PREFERRED)
+        store = EventStore(db, os.environ.get("EVENT_STORE_MODE", "legacy"))
+
+    document = await build_cohort_tables(db, store)
+    print(f"Cohort tables built from {document['babies']} babies")
+    client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(sys.argv))
@@ -0,0 +1,198 @@
+"""
+Response compression and binary content negotiation.
+
+Responses above a size threshold are compressed with brotli or gzip,
+whichever the client prefers and the server supports, including streamed
+responses. Clients sending `Accept: application/msgpack` receive the same
+payloads encoded as MessagePack instead of JSON.
+
+brotli and msgpack are optional: without them the server falls back to
+gzip and JSON.
+"""
+import zlib
+from contextvars import ContextVar
+from typing import Dict
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+_wants_msgpack: ContextVar[bool] = ContextVar("wants_msgpack", default=False)
+
+
+class NegotiatedJSONResponse(JSONResponse):
+    """JSON response that switches to MessagePack when the client asked for it"""
+
+    def render(self, content) -> bytes:
+        if msgpack is not None and _wants_msgpack.get():
+            self.media_type = MSGPACK_MEDIA_TYPES[0]
+            return msgpack.packb(content, use_bin_type=True)
+        return super().render(content)
+
+
+class _GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware for Accept-based encoding and Accept-Encoding compression"""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        accept = headers.get("accept", "")
+        accepted = _qvalues(accept)
+        token = _wants_msgpack.set(msgpack is not None and any(accepted.get(t, 0) > 0 for t in MSGPACK_MEDIA_TYPES))
+        try:
+            encoding = self._choose_encoding(headers.get("accept-encoding", ""))
+            if encoding is None:
+                await self.app(scope, receive, _vary(send))
+            else:
+                await self.app(scope, receive, _CompressingSender(send, self._encoder(encoding), self.minimum_size))
+        finally:
+            _wants_msgpack.reset(token)
+
+    def _choose_encoding(self, accept_encoding: str):
+        """Highest-weighted supported coding (brotli on ties); never one the client gave q=0"""
+        weights = _qvalues(accept_encoding)
+        supported = ("br", "gzip") if brotli is not None else ("gzip",)
+        best, best_weight = None, 0.0
+        for coding in supported:
+            weight = weights.get(coding, weights.get("*", 0.0))
+            if weight > best_weight:
+                best, best_weight = coding, weight
+        return best
+
+    def _encoder(self, encoding: str):
+        if encoding == "br":
+            return _BrotliEncoder(self.brotli_quality)
+        return _GzipEncoder(self.gzip_level)
+
+
+def _qvalues(header: str) -> Dict[str, float]:
+    """{value: weight} of an Accept-style header; a missing q means 1, a malformed one 0"""
+    weights = {}
+    for part in header.split(","):
+        value, *params = [p.strip() for p in part.split(";")]
+        if not value:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, q = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(q)
+                except ValueError:
+                    weight = 0.0
+        weights[value.lower()] = weight
+    return weights
+
+
+def _vary(send):
+    async def send_with_vary(message):
+        if message["type"] == "http.response.start":
+            MutableHeaders(raw=message["headers"]).add_vary_header("Accept")
+        await send(message)
+    return send_with_vary
+
+
+class _CompressingSender:
+    """Wraps `send`, compressing the body once it is known to be worth it"""
+
+    def __init__(self, send, encoder, minimum_size: int):
+        self.send = send
+        self.encoder = encoder
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first body chunk shows whether to compress
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            headers.add_vary_header("Accept")
+
+            if "content-encoding" in headers or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self._send_start()
+                await self.send(message)
+                return
+
+            headers["Content-Encoding"] = self.encoder.name
+            if more_body:
+                # Streamed response: length unknown, compress chunk by chunk
+                del headers["Content-Length"]
+            else:
+                body = self.encoder.finish(body)
+                headers["Content-Length"] = str(len(body))
+                await self._send_start()
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            await self._send_start()
+
+        if more_body:
+            await self.send({"type": "http.response.body", "body": self.encoder.chunk(body), "more_body": True})
+        else:
+            await self.send({"type": "http.response.body", "body": self.encoder.finish(body)})
+
+    async def _send_start(self):
+        await self.send(self.start_message)
+        self.start_message = None
@@ -0,0 +1,326 @@
+"""
+CSV import from other baby trackers.
+
+The upload is parsed as it arrives. Bytes are decoded incrementally, split
+into lines, and lines are joined back only while a quoted field is still
+open. Memory therefore stays at one network chunk plus one record, no
+matter how large the file is.
+
+Column headers are matched loosely. Case, spaces and units in parentheses
+are ignored, and common names used by other apps are accepted ("Start",
+"Amount (oz)", "Side", "Contents", ...). Every row maps onto the fields of
+FeedingCreate, SleepCreate, DiaperCreate or GrowthCreate. The record type
+is either given for the whole file or read per row from a type/activity
+column.
+
+Record ids are derived from the baby and the row's content, so importing
+the same rows twice finds them already present instead of duplicating
+them.
+"""
+import codecs
+import csv
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+RECORD_TYPES = ("feeding", "sleep", "diaper", "growth")
+ID_PREFIXES = {"feeding": "feed", "sleep": "sleep", "diaper": "diaper", "growth": "growth"}
+
+# A record still open after this many characters is an unterminated quote, not data
+MAX_RECORD_CHARS = 64 * 1024
+
+# field -> normalized header names other trackers use for it
+FIELD_ALIASES = {
+    "record_type": ("record_type", "activity", "category", "event", "kind", "entry_type", "type"),
+    "subtype": ("type", "feeding_type", "feed_type", "method", "sleep_type", "diaper_type", "contents", "status"),
+    "side": ("side", "breast", "breast_side"),
+    "start_time": ("start_time", "start", "started", "started_at", "begin", "from", "start_date"),
+    "end_time": ("end_time", "end", "ended", "ended_at", "finish", "to", "end_date"),
+    "time": ("time", "datetime", "date_time", "timestamp", "logged_at"),
+    "date": ("date", "day", "measured_on"),
+    "duration_minutes": ("duration_minutes", "duration", "duration_min", "minutes", "length_min"),
+    "amount_ml": ("amount_ml", "amount", "volume", "volume_ml", "ml", "quantity"),
+    "amount_oz": ("amount_oz", "volume_oz", "oz", "ounces"),
+    "food_type": ("food_type", "food", "foods"),
+    "quality": ("quality", "sleep_quality"),
+    "weight_kg": ("weight_kg", "weight"),
+    "weight_g": ("weight_g", "weight_grams"),
+    "height_cm": ("height_cm", "height", "length", "length_cm"),
+    "head_circumference_cm": ("head_circumference_cm", "head_circumference", "head", "head_cm"),
+    "notes": ("notes", "note", "comment", "comments", "description"),
+}
+
+RECORD_TYPE_VALUES = {
+    "feeding": ("feeding", "feed", "nursing", "breastfeeding", "breast", "bottle", "formula", "solid", "solids",
+                "food", "meal"),
+    "sleep": ("sleep", "nap", "night", "night_sleep"),
+    "diaper": ("diaper", "nappy", "pee", "poo", "poop", "wet", "dirty", "mixed", "both"),
+    "growth": ("growth", "measurement", "weight", "height"),
+}
+
+FEEDING_TYPES = {
+    "breast_left": ("breast_left", "left", "l", "left_breast"),
+    "breast_right": ("breast_right", "right", "r", "right_breast"),
+    "bottle": ("bottle", "formula", "pumped", "expressed", "bottle_feeding", "breast_milk_bottle"),
+    "solid": ("solid", "solids", "food", "meal"),
+}
+BREAST_VALUES = ("breast", "nursing", "breastfeeding", "breast_feeding")
+SLEEP_TYPES = {"nap": ("nap", "day", "daytime"), "night": ("night", "night_sleep", "overnight", "nighttime")}
+DIAPER_TYPES = {
+    "wet": ("wet", "pee", "urine"),
+    "dirty": ("dirty", "poo", "poop", "bm", "stool", "soiled"),
+    "mixed": ("mixed", "both", "wet_and_dirty", "pee_and_poo"),
+}
+QUALITIES = ("good", "fair", "poor")
+# Type values that only name the record type, e.g. a "Type" column holding "Feed" or "Sleep"
+GENERIC_VALUES = ("feeding", "feed", "sleep", "diaper", "nappy", "growth", "measurement")
+
+ML_PER_OZ = 29.5735
+
+_TIME_FORMATS = (
+    "%m/%d/%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%m/%d/%Y %I:%M %p", "%m/%d/%Y %I:%M:%S %p",
+    "%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%Y/%m/%d %H:%M", "%Y/%m/%d %H:%M:%S",
+)
+_DATE_FORMATS = ("%m/%d/%Y", "%d.%m.%Y", "%Y/%m/%d")
+_DURATION = re.compile(r"^\s*(?:(\d+(?:\.\d+)?)\s*h(?:ours?|rs?)?)?\s*(?:(\d+(?:\.\d+)?)\s*m(?:in(?:utes?|s)?)?)?\s*$")
+
+
+def normalize(value: str) -> str:
+    """'Amount (oz)' -> 'amount_oz', 'Wet & dirty' -> 'wet_and_dirty'"""
+    value = value.strip().lower().replace("&", " and ")
+    value = re.sub(r"[()\[\]]", " ", value)
+    return re.sub(r"[^a-z0-9]+", "_", value).strip("_")
+
+
+def _lookup(table: Dict[str, Tuple[str, ...]], value: str) -> Optional[str]:
+    key = normalize(value)
+    for name, aliases in table.items():
+        if key in aliases:
+            return name
+    return None
+
+
+def map_columns(header: List[str]) -> Tuple[Dict[str, int], List[str]]:
+    """Return ({field: column index}, unmapped header names).
+
+    A header matching several fields ("Type") takes the first one still free,
+    so "Type" next to "Activity" holds the subtype.
+    """
+    columns: Dict[str, int] = {}
+    unmapped = []
+    for index, name in enumerate(header):
+        key = normalize(name)
+        field = next((f for f, aliases in FIELD_ALIASES.items() if key in aliases and f not in columns), None)
+        if field is None:
+            unmapped.append(name)
+        else:
+            columns[field] = index
+    return columns, unmapped
+
+
+# ==================== Streaming parser ====================
+
+async def read_rows(chunks: AsyncIterator[bytes], encoding: str = "utf-8-sig") -> AsyncIterator[List[str]]:
+    """Parse CSV rows from a stream of byte chunks, one chunk at a time"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""  # text after the last newline
+    record = ""   # lines of a record whose quoted field is still open
+
+    def complete_records(text: str) -> List[str]:
+        nonlocal record
+        records = []
+        # Only "\n" ends a line; "\r" and other separators stay inside fields
+        for line in re.findall(r"[^\n]*\n|[^\n]+$", text):
+            record += line
+            if record.count('"') % 2 == 0:
+                records.append(record)
+                record = ""
+            elif len(record) > MAX_RECORD_CHARS:
+                raise ValueError("Unterminated quoted field")
+        return records
+
+    async for chunk in chunks:
+        text = pending + decoder.decode(chunk)
+        cut = text.rfind("\n") + 1
+        pending = text[cut:]
+        for row in csv.reader(complete_records(text[:cut])):
+            yield row
+
+    rest = complete_records(pending + decoder.decode(b"", final=True))
+    if record:
+        rest.append(record)
+    for row in csv.reader(rest):
+        yield row
+
+
+# ==================== Row mapping ====================
+
+def parse_time(value: str, tz_offset_minutes: int = 0) -> datetime:
+    """Parse an ISO or common spreadsheet timestamp; naive times are local at the given offset"""
+    value = value.strip()
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        for fmt in _TIME_FORMATS + _DATE_FORMATS:
+            try:
+                moment = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"Unrecognized time '{value}'")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone(timedelta(minutes=tz_offset_minutes)))
+    return moment.astimezone(timezone.utc)
+
+
+def parse_date(value: str) -> str:
+    value = value.strip()
+    try:
+        return datetime.fromisoformat(value).date().isoformat()
+    except ValueError:
+        for fmt in _DATE_FORMATS + _TIME_FORMATS:
+            try:
+                return datetime.strptime(value, fmt).date().isoformat()
+            except ValueError:
+                continue
+    raise ValueError(f"Unrecognized date '{value}'")
+
+
+def parse_duration(value: str) -> int:
+    """Minutes from '45', '0:45', '1:05:00', '1h 5m' or '45 min'"""
+    value = value.strip().lower()
+    if ":" in value:
+        parts = [float(p) for p in value.split(":")]
+        if len(parts) == 2:
+            return round(parts[0] * 60 + parts[1])
+        if len(parts) == 3:
+            return round(parts[0] * 60 + parts[1] + parts[2] / 60)
+    try:
+        return round(float(value))
+    except ValueError:
+        pass
+    match = _DURATION.match(value)
+    if not match or not any(match.groups()):
+        raise ValueError(f"Unrecognized duration '{value}'")
+    hours, minutes = match.groups()
+    return round(float(hours or 0) * 60 + float(minutes or 0))
+
+
+def _number(value: str, field: str) -> float:
+    try:
+        return float(re.sub(r"[^0-9.\-]", "", value.replace(",", ".")))
+    except ValueError:
+        raise ValueError(f"Invalid {field} '{value}'")
+
+
+def record_type_of(values: Dict[str, str]) -> Optional[str]:
+    """Record type of a row from its type/activity column, else from its subtype column"""
+    for field in ("record_type", "subtype"):
+        value = (values.get(field) or "").strip()
+        if value and _lookup(RECORD_TYPE_VALUES, value):
+            return _lookup(RECORD_TYPE_VALUES, value)
+    return None
+
+
+def map_row(record_type: str, values: Dict[str, str], tz_offset_minutes: int = 0) -> dict:
+    """Turn one row ({field: raw text}) into keyword arguments of the record type's Create model.
+
+    Raises ValueError with a message meant for the import report.
+    """
+    get = lambda field: (values.get(field) or "").strip()
+    subtype = get("subtype") or get("record_type")
+    if normalize(subtype) in GENERIC_VALUES:
+        subtype = ""
+    fields: dict = {}
+    if get("notes"):
+        fields["notes"] = get("notes")
+
+    if record_type == "growth":
+        when = get("date") or get("time") or get("start_time")
+        if not when:
+            raise ValueError("Missing date")
+        fields["date"] = parse_date(when)
+        if get("weight_kg"):
+            fields["weight_kg"] = _number(get("weight_kg"), "weight")
+        elif get("weight_g"):
+            fields["weight_kg"] = _number(get("weight_g"), "weight") / 1000
+        if get("height_cm"):
+            fields["height_cm"] = _number(get("height_cm"), "height")
+        if get("head_circumference_cm"):
+            fields["head_circumference_cm"] = _number(get("head_circumference_cm"), "head circumference")
+        if not any(k in fields for k in ("weight_kg", "height_cm", "head_circumference_cm")):
+            raise ValueError("No weight, height or head circumference")
+        return fields
+
+    if record_type == "diaper":
+        when = get("time") or get("start_time") or get("date")
+        if not when:
+            raise ValueError("Missing time")
+        diaper_type = _lookup(DIAPER_TYPES, subtype) if subtype else None
+        if diaper_type is None:
+            raise ValueError(f"Unknown diaper type '{subtype}'")
+        fields.update(diaper_type=diaper_type, time=parse_time(when, tz_offset_minutes).isoformat())
+        return fields
+
+    when = get("start_time") or get("time") or get("date")
+    if not when:
+        raise ValueError("Missing start time")
+    start = parse_time(when, tz_offset_minutes)
+    end = parse_time(get("end_time"), tz_offset_minutes) if get("end_time") else None
+    duration = parse_duration(get("duration_minutes")) if get("duration_minutes") else None
+    if end is not None and end < start:
+        raise ValueError("End time is before start time")
+    if duration is None and end is not None:
+        duration = round((end - start).total_seconds() / 60)
+    if end is None and duration is not None:
+        end = start + timedelta(minutes=duration)
+    fields.update(start_time=start.isoformat(), end_time=end.isoformat() if end else None,
+                  duration_minutes=duration)
+
+    if record_type == "sleep":
+        if end is None:
+            # An open-ended imported sleep would show up as an ongoing one
+            raise ValueError("Sleep needs an end time or duration")
+        sleep_type = _lookup(SLEEP_TYPES, subtype) if subtype else None
+        if sleep_type is None:
+            local_hour = (start + timedelta(minutes=tz_offset_minutes)).hour
+            sleep_type = "night" if local_hour >= 19 or local_hour < 7 else "nap"
+        fields["sleep_type"] = sleep_type
+        if get("quality"):
+            quality = normalize(get("quality"))
+            if quality not in QUALITIES:
+                raise ValueError(f"Unknown sleep quality '{get('quality')}'")
+            fields["quality"] = quality
+        return fields
+
+    feeding_type = _lookup(FEEDING_TYPES, subtype) if subtype else None
+    if feeding_type is None and (normalize(subtype) in BREAST_VALUES or not subtype) and get("side"):
+        feeding_type = _lookup(FEEDING_TYPES, get("side"))
+    if feeding_type is None and not subtype and (get("amount_ml") or get("amount_oz")):
+        feeding_type = "bottle"
+    if feeding_type is None:
+        if normalize(subtype) in BREAST_VALUES:
+            raise ValueError("Breastfeeding needs a side")
+        raise ValueError(f"Unknown feeding type '{subtype}'" if subtype else "Missing feeding type")
+    fields["feeding_type"] = feeding_type
+    if get("amount_ml"):
+        fields["amount_ml"] = round(_number(get("amount_ml"), "amount"))
+    elif get("amount_oz"):
+        fields["amount_ml"] = round(_number(get("amount_oz"), "amount") * ML_PER_OZ)
+    if get("food_type"):
+        fields["food_type"] = get("food_type")
+    return fields
+
+
+def record_id(record_type: str, baby_id: str, fields: dict, ordinal: int = 0) -> str:
+    """Stable id of an imported record, so re-importing a row finds it instead of copying it.
+
+    `ordinal` numbers identical rows of a file (two diapers logged in the same
+    minute), which are separate records; the first keeps the plain content id.
+    """
+    content = [baby_id, record_type, fields] + ([ordinal] if ordinal else [])
+    digest = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{ID_PREFIXES[record_type]}_{digest[:12]}"
@@ -0,0 +1,359 @@
+"""
+Unified event store for feeding, sleep and diaper records.
+
+The legacy layout keeps each event type in its own collection with its own
+time field (`start_time` for feedings and sleeps, `time` for diapers). The
+unified layout mirrors every event into a single MongoDB time-series
+collection (`events`) with `time` as timeField and `baby_id` as metaField,
+which gives range scans columnar compression and a single
+(baby_id, time) index.
+
+Rollout is controlled by the EVENT_STORE_MODE environment variable:
+- "legacy"  (default) read and write the per-type collections only
+- "dual"    additionally mirror every write into `events`
+- "unified" keep dual-writing but serve reads from `events`
+
+Switch to "dual", then run the backfill (`python event_store.py backfill`)
+and a reconcile pass (`python event_store.py reconcile`), and only then
+switch to "unified". Reconcile can be re-run at any time to repair events
+that a failed or racing dual write left missing, stale or duplicated.
+Deleting or updating single events in a time-series collection requires
+MongoDB 7.0+.
+
+In every layout, ranges reaching back before the archive horizon also read
+the monthly buckets of archive.py.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo.errors import CollectionInvalid
+
+from archive import ArchiveCursor, EventArchive
+
+logger = logging.getLogger(__name__)
+
+EVENTS_COLLECTION = "events"
+BACKFILL_CHECKPOINT_ID = "events_backfill"
+
+# event_type -> (legacy collection, id field, time field)
+EVENT_TYPES = {
+    "feeding": ("feeding_records", "feeding_id", "start_time"),
+    "sleep": ("sleep_records", "sleep_id", "start_time"),
+    "diaper": ("diaper_records", "diaper_id", "time"),
+}
+
+MODES = ("legacy", "dual", "unified")
+
+
+def to_event(event_type: str, record: dict) -> dict:
+    """Convert a legacy record into a time-series event document"""
+    _, _, time_field = EVENT_TYPES[event_type]
+    event = {k: v for k, v in record.items() if k != "_id"}
+    event["event_type"] = event_type
+    event["time"] = record[time_field]
+    return event
+
+
+class EventStore:
+    """Storage adapter that lets routes read and write either layout"""
+
+    def __init__(self, db, mode: str = "legacy"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown EVENT_STORE_MODE: {mode}")
+        self.db = db
+        self.mode = mode
+        self.events = db[EVENTS_COLLECTION]
+        self.archive = EventArchive(db)
+
+    @property
+    def dual_write(self) -> bool:
+        return self.mode in ("dual", "unified")
+
+    @property
+    def read_unified(self) -> bool:
+        return self.mode == "unified"
+
+    async def setup(self):
+        """Create the range-scan indexes and, when dual-writing, the time-series collection"""
+        for collection_name, _, time_field in EVENT_TYPES.values():
+            await self.db[collection_name].create_index([("baby_id", 1), (time_field, 1)])
+        await self.archive.setup()
+        if not self.dual_write:
+            return
+        try:
+            await self.db.create_collection(
+                EVENTS_COLLECTION,
+                timeseries={"timeField": "time", "metaField": "baby_id", "granularity": "minutes"}
+            )
+            logger.info("Created time-series collection %s", EVENTS_COLLECTION)
+        except CollectionInvalid:
+            pass
+        await self.events.create_index([("baby_id", 1), ("time", -1)])
+
+    # ==================== Reads ====================
+
+    def _source(self, event_type: str, baby_ids: List[str], start: Optional[datetime], end: Optional[datetime]):
+        """Return (collection, filter, time field) for a range query in the active layout"""
+        collection_name, _, time_field = EVENT_TYPES[event_type]
+        if self.read_unified:
+            collection = self.events
+            query = {"baby_id": {"$in": baby_ids}, "event_type": event_type}
+            time_field = "time"
+        else:
+            collection = self.db[collection_name]
+            query = {"baby_id": {"$in": baby_ids}}
+
+        time_range = {}
+        if start is not None:
+            time_range["$gte"] = start
+        if end is not None:
+            time_range["$lt"] = end
+        if time_range:
+            query[time_field] = time_range
+
+        return collection, query, time_field
+
+    def find(self, event_type: str, baby_ids: List[str], start: Optional[datetime] = None,
+             end: Optional[datetime] = None, projection: Optional[dict] = None, newest_first: bool = False):
+        """Find records of one type in [start, end), returned in the legacy record shape"""
+        collection, query, time_field = self._source(event_type, baby_ids, start, end)
+        projection = projection or self._default_projection(event_type)
+
+        def hot():
+            cursor = collection.find(query, projection)
+            return cursor.sort(time_field, -1) if newest_first else cursor
+
+        return ArchiveCursor(self.archive, event_type, baby_ids, start, end, hot,
+                             projection=projection, newest_first=newest_first)
+
+    def find_overlapping(self, event_type: str, baby_ids: List[str], start: datetime, end: datetime,
+                         max_duration: timedelta, projection: Optional[dict] = None):
+        """Find records whose [start_time, end_time) overlaps [start, end), unfinished ones included.
+
+        Bounding the start time by the longest possible duration keeps the scan on
+        the (baby_id, time) index instead of every earlier record of the baby.
+        """
+        collection, query, _ = self._source(event_type, baby_ids, start - max_duration, end)
+        overlaps = {"$or": [{"end_time": {"$gt": start}}, {"end_time": None}]}
+        query.update(overlaps)
+        projection = projection or self._default_projection(event_type)
+        return ArchiveCursor(self.archive, event_type, baby_ids, start - max_duration, end,
+                             lambda: collection.find(query, projection), projection=projection, extra=overlaps)
+
+    def _default_projection(self, event_type: str) -> dict:
+        projection = {"_id": 0}
+        if self.read_unified:
+            projection["event_type"] = 0
+            # Diapers already carry their own `time` field
+            if EVENT_TYPES[event_type][2] != "time":
+                projection["time"] = 0
+        return projection
+
+    def aggregate(self, event_type: str, baby_ids: List[str], start: Optional[datetime],
+                  end: Optional[datetime], stages: List[dict]):
+        """Run aggregation stages over records of one type in [start, end)"""
+        collection, query, _ = self._source(event_type, baby_ids, start, end)
+        return ArchiveCursor(
+            self.archive, event_type, baby_ids, start, end,
+            lambda: collection.aggregate([{"$match": query}] + stages),
+            hot_records=lambda: collection.find(query, self._default_projection(event_type)),
+            stages=stages
+        )
+
+    # ==================== Dual writes ====================
+
+    async def insert(self, event_type: str, record: dict):
+        if self.dual_write:
+            await self.events.insert_one(to_event(event_type, record))
+
+    async def insert_many(self, event_type: str, records: List[dict]):
+        if self.dual_write and records:
+            await self.events.insert_many([to_event(event_type, r) for r in records], ordered=False)
+
+    async def insert_missing(self, event_type: str, records: List[dict]):
+        """Mirror the records that have no event yet, e.g. after a crash between the two writes"""
+        if not self.dual_write or not records:
+            return
+        id_field = EVENT_TYPES[event_type][1]
+        mirrored = await self.events.find(
+            {"event_type": event_type, id_field: {"$in": [r[id_field] for r in records]}}, {"_id": 0, id_field: 1}
+        ).to_list(None)
+        mirrored_ids = {event[id_field] for event in mirrored}
+        await self.insert_many(event_type, [r for r in records if r[id_field] not in mirrored_ids])
+
+    async def replace(self, event_type: str, record: dict):
+        """Mirror an updated record (time-series documents are replaced, not patched)"""
+        if self.dual_write:
+            await self.delete(event_type, record[EVENT_TYPES[event_type][1]])
+            await self.insert(event_type, record)
+
+    async def delete(self, event_type: str, record_id: str):
+        if self.dual_write:
+            id_field = EVENT_TYPES[event_type][1]
+            await self.events.delete_many({"event_type": event_type, id_field: record_id})
+
+    async def restore(self, event_type: str, record_id: str, baby_ids: List[str]) -> bool:
+        """Bring an archived record back to the hot layout before it is edited or deleted"""
+        record = await self.archive.restore(event_type, record_id, baby_ids)
+        if record is None:
+            return False
+        await self.replace(event_type, record)
+        return True
+
+    async def delete_baby(self, baby_id: str):
+        await self.archive.delete_baby(baby_id)
+        if self.dual_write:
+            await self.events.delete_many({"baby_id": baby_id})
+
+    # ==================== Backfill ====================
+
+    async def backfill(self, batch_size: int = 1000, pause_seconds: float = 0.0):
+        """Mirror legacy records into `events` in `_id` order, resuming from the last checkpoint.
+
+        Only records that existed when the backfill started are walked; later ones
+        are covered by dual writes. Each batch goes through `_reconcile`, so records
+        already mirrored are left alone and the backfill can be interrupted and re-run.
+        """
+        checkpoints = self.db.migrations
+        state = await checkpoints.find_one({"_id": BACKFILL_CHECKPOINT_ID}) or {}
+
+        for event_type, (collection_name, id_field, _) in EVENT_TYPES.items():
+            collection = self.db[collection_name]
+            progress = state.get(event_type, {})
+            if progress.get("done"):
+                continue
+
+            # High-water mark: stop at the newest record present at start
+            high_water = progress.get("high_water")
+            if high_water is None:
+                newest = await collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+                if not newest:
+                    await self._save_checkpoint(event_type, {"done": True})
+                    continue
+                high_water = newest["_id"]
+
+            last_id = progress.get("last_id")
+            copied = progress.get("copied", 0)
+
+            while True:
+                id_range = {"$lte": high_water}
+                if last_id is not None:
+                    id_range["$gt"] = last_id
+                batch = await collection.find(
+                    {"_id": id_range}, {"_id": 1, id_field: 1}
+                ).sort("_id", 1).to_list(batch_size)
+                if not batch:
+                    break
+
+                copied += await self._reconcile(event_type, [record[id_field] for record in batch])
+                last_id = batch[-1]["_id"]
+                await self._save_checkpoint(event_type, {
+                    "high_water": high_water, "last_id": last_id, "copied": copied
+                })
+                logger.info("Backfilled %d %s events", copied, event_type)
+
+                if pause_seconds:
+                    await asyncio.sleep(pause_seconds)
+
+            await self._save_checkpoint(event_type, {
+                "high_water": high_water, "last_id": last_id, "copied": copied, "done": True
+            })
+
+    async def reconcile(self, batch_size: int = 1000) -> int:
+        """Repair `events` against the legacy collections; returns how many records were fixed.
+
+        Dual writes are two separate writes, so a crash between them, or a mirror
+        racing the backfill, can leave an event missing, stale, duplicated or
+        orphaned. Run this after the backfill and before switching to "unified".
+        """
+        fixed = 0
+        for event_type, (collection_name, id_field, _) in EVENT_TYPES.items():
+            collection = self.db[collection_name]
+            async for record_ids in _id_batches(collection, {}, id_field, batch_size):
+                fixed += await self._reconcile(event_type, record_ids)
+            # Events whose record no longer exists
+            async for record_ids in _id_batches(self.events, {"event_type": event_type}, id_field, batch_size):
+                present = await collection.find({id_field: {"$in": record_ids}}, {"_id": 0, id_field: 1}).to_list(None)
+                orphans = list(set(record_ids) - {doc[id_field] for doc in present})
+                if orphans:
+                    fixed += await self._reconcile(event_type, orphans)
+            logger.info("Reconciled %s events (%d fixed so far)", event_type, fixed)
+        return fixed
+
+    async def _reconcile(self, event_type: str, record_ids: List[str]) -> int:
+        """Leave exactly one current event per record id (none for deleted records); returns how many changed"""
+        collection_name, id_field, _ = EVENT_TYPES[event_type]
+        mirrored = {}
+        for event in await self.events.find(
+            {"event_type": event_type, id_field: {"$in": record_ids}}, {"_id": 0}
+        ).to_list(None):
+            mirrored.setdefault(event[id_field], []).append(event)
+        # Records are read after their events: a mirror racing this pass is at worst
+        # seen as stale here and re-written from the record's newest state
+        records = {
+            record[id_field]: record
+            for record in await self.db[collection_name].find({id_field: {"$in": record_ids}}).to_list(None)
+        }
+
+        changed = 0
+        for record_id in record_ids:
+            record = records.get(record_id)
+            expected = [to_event(event_type, record)] if record else []
+            if mirrored.get(record_id, []) == expected:
+                continue
+            await self.events.delete_many({"event_type": event_type, id_field: record_id})
+            if record:
+                await self.events.insert_one(expected[0])
+            changed += 1
+        return changed
+
+    async def _save_checkpoint(self, event_type: str, progress: dict):
+        await self.db.migrations.update_one(
+            {"_id": BACKFILL_CHECKPOINT_ID},
+            {"$set": {event_type: progress}},
+            upsert=True
+        )
+
+
+async def _id_batches(collection, query: dict, id_field: str, batch_size: int):
+    """Yield the record ids of matching documents in `_id` order, batch_size documents at a time"""
+    last_id = None
+    while True:
+        batch_query = {**query, "_id": {"$gt": last_id}} if last_id is not None else query
+        batch = await collection.find(batch_query, {"_id": 1, id_field: 1}).sort("_id", 1).to_list(batch_size)
+        if not batch:
+            return
+        last_id = batch[-1]["_id"]
+        yield list({doc[id_field] for doc in batch})
+
+
+async def _main(argv: List[str]):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    if len(argv) < 2 or argv[1] not in ("setup", "backfill", "reconcile"):
+        print("Usage: python event_store.py setup|backfill|reconcile [batch_size]")
+        return
+
+    store = EventStore(db, "dual")
+    await store.setup()
+    batch_size = int(argv[2]) if len(argv) > 2 else 1000
+    if argv[1] == "backfill":
+        await store.backfill(batch_size=batch_size)
+    elif argv[1] == "reconcile":
+        print(f"Fixed {await store.reconcile(batch_size=batch_size)} events")
+    client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(sys.argv))
@@ -0,0 +1,295 @@
+"""
+Columnar export of the record collections for offline analytics.
+
+    python export_parquet.py OUTPUT_DIR [--full]
+
+Feeding, sleep, diaper and growth records are streamed from the database
+in batches. Each batch becomes an Arrow record batch with typed columns:
+UTC timestamps, dictionary-encoded categoricals for the type fields, and
+int32/float64 measures. Output is Parquet, partitioned by record type and
+by the month of the record's own time:
+
+    OUTPUT_DIR/feeding/month=2024-03/part-20241019T031500.parquet
+
+Exports are incremental. `_watermarks.json` in OUTPUT_DIR holds, per
+collection, the `created_at` up to which records were exported. Each run
+only reads records created after it. The upper bound is SAFETY_LAG in
+the past, so inserts still in flight are picked up by the next run. Edits
+and deletions are not tracked by `created_at`; re-run with --full (into a
+fresh directory) to capture them. Records moved to the cold archive
+(archive.py) are exported from their buckets.
+
+Reads prefer secondaries, and nothing is written to the database apart
+from `created_at` indexes the first time. Analysts query the Parquet files
+instead of the API or the primary.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pq = None
+
+from archive import ARCHIVE_COLLECTION, decode_records
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_FILE = "_watermarks.json"
+DEFAULT_BATCH_SIZE = 5000
+# Records created within this window may still be committing; they go into the next run
+SAFETY_LAG = timedelta(seconds=30)
+
+_CATEGORY = "category"
+_TIMESTAMP = "timestamp"
+
+# name -> (collection, time field used for partitioning, [(column, kind)])
+EXPORTS = {
+    "feeding": ("feeding_records", "start_time", [
+        ("feeding_id", "string"), ("baby_id", "string"), ("user_id", "string"),
+        ("feeding_type", _CATEGORY), ("start_time", _TIMESTAMP), ("end_time", _TIMESTAMP),
+        ("duration_minutes", "int32"), ("amount_ml", "int32"), ("food_type", _CATEGORY),
+        ("notes", "string"), ("created_at", _TIMESTAMP),
+    ]),
+    "sleep": ("sleep_records", "start_time", [
+        ("sleep_id", "string"), ("baby_id", "string"), ("user_id", "string"),
+        ("sleep_type", _CATEGORY), ("start_time", _TIMESTAMP), ("end_time", _TIMESTAMP),
+        ("duration_minutes", "int32"), ("quality", _CATEGORY), ("notes", "string"),
+        ("created_at", _TIMESTAMP),
+    ]),
+    "diaper": ("diaper_records", "time", [
+        ("diaper_id", "string"), ("baby_id", "string"), ("user_id", "string"),
+        ("diaper_type", _CATEGORY), ("time", _TIMESTAMP), ("notes", "string"),
+        ("created_at", _TIMESTAMP),
+    ]),
+    "growth": ("growth_records", "date", [
+        ("growth_id", "string"), ("baby_id", "string"), ("user_id", "string"),
+        ("date", "date"), ("weight_kg", "float64"), ("height_cm", "float64"),
+        ("head_circumference_cm", "float64"), ("notes", "string"), ("created_at", _TIMESTAMP),
+    ]),
+}
+
+
+def _arrow_type(kind: str):
+    return {
+        "string": pa.string(),
+        _CATEGORY: pa.dictionary(pa.int32(), pa.string()),
+        _TIMESTAMP: pa.timestamp("ms", tz="UTC"),
+        "int32": pa.int32(),
+        "float64": pa.float64(),
+        "date": pa.date32(),
+    }[kind]
+
+
+def schema_for(name: str):
+    _, _, columns = EXPORTS[name]
+    return pa.schema([(column, _arrow_type(kind)) for column, kind in columns])
+
+
+def _as_utc(value) -> Optional[datetime]:
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _as_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def _as_number(value, cast):
+    # Legacy records sometimes hold numbers as strings
+    try:
+        return cast(value) if value is not None and value != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+_CONVERTERS = {
+    "string": lambda v: v if v is None or isinstance(v, str) else str(v),
+    _CATEGORY: lambda v: v if v is None or isinstance(v, str) else str(v),
+    _TIMESTAMP: _as_utc,
+    "int32": lambda v: _as_number(v, lambda x: int(float(x))),
+    "float64": lambda v: _as_number(v, float),
+    "date": _as_date,
+}
+
+
+def to_record_batch(name: str, records: List[dict]):
+    """Convert raw documents into a typed Arrow record batch"""
+    _, _, columns = EXPORTS[name]
+    schema = schema_for(name)
+    arrays = []
+    for (column, kind), field in zip(columns, schema):
+        convert = _CONVERTERS[kind]
+        arrays.append(pa.array([convert(r.get(column)) for r in records], type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def partition_of(name: str, record: dict) -> str:
+    _, time_field, _ = EXPORTS[name]
+    value = record.get(time_field)
+    day = _as_date(value) if not isinstance(value, datetime) else _as_utc(value).date()
+    return f"month={day:%Y-%m}" if day else "month=unknown"
+
+
+class PartitionedWriter:
+    """One Parquet file per partition for the current run, renamed into place on commit"""
+
+    def __init__(self, root: Path, name: str, run_id: str):
+        self.directory = root / name
+        self.name = name
+        self.run_id = run_id
+        self.schema = schema_for(name)
+        self._writers: Dict[str, "pq.ParquetWriter"] = {}
+        self.rows = 0
+
+    def write(self, records: List[dict]):
+        by_partition: Dict[str, List[dict]] = {}
+        for record in records:
+            by_partition.setdefault(partition_of(self.name, record), []).append(record)
+        for partition, rows in by_partition.items():
+            writer = self._writers.get(partition)
+            if writer is None:
+                path = self.directory / partition
+                path.mkdir(parents=True, exist_ok=True)
+                writer = pq.ParquetWriter(str(path / f"part-{self.run_id}.parquet.tmp"), self.schema,
+                                          compression="zstd")
+                self._writers[partition] = writer
+            writer.write_batch(to_record_batch(self.name, rows))
+            self.rows += len(rows)
+
+    def commit(self):
+        for partition, writer in self._writers.items():
+            writer.close()
+            path = self.directory / partition / f"part-{self.run_id}.parquet"
+            path.with_name(path.name + ".tmp").rename(path)
+        self._writers.clear()
+
+    def abort(self):
+        for partition, writer in self._writers.items():
+            writer.close()
+            (self.directory / partition / f"part-{self.run_id}.parquet.tmp").unlink(missing_ok=True)
+        self._writers.clear()
+
+
+def load_watermarks(root: Path) -> Dict[str, datetime]:
+    path = root / WATERMARK_FILE
+    if not path.exists():
+        return {}
+    return {name: datetime.fromisoformat(value) for name, value in json.loads(path.read_text()).items()}
+
+
+def save_watermarks(root: Path, watermarks: Dict[str, datetime]):
+    path = root / WATERMARK_FILE
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({name: value.isoformat() for name, value in watermarks.items()}, indent=2))
+    tmp.replace(path)
+
+
+async def _stream(cursor, batch_size: int):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def export_collection(db, root: Path, name: str, run_id: str, since: Optional[datetime],
+                            until: datetime, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Export records of one collection created in (since, until]; returns the row count"""
+    collection_name, _, _ = EXPORTS[name]
+    created = {"$lte": until}
+    if since is not None:
+        created["$gt"] = since
+
+    writer = PartitionedWriter(root, name, run_id)
+    try:
+        cursor = db[collection_name].find({"created_at": created}, {"_id": 0})
+        async for batch in _stream(cursor, batch_size):
+            writer.write(batch)
+
+        # Archived months: buckets touched since the last run may hold records created in the window
+        if name in ("feeding", "sleep", "diaper"):
+            buckets = {"event_type": name}
+            if since is not None:
+                buckets["updated_at"] = {"$gt": since}
+            async for bucket in db[ARCHIVE_COLLECTION].find(buckets, {"data": 1}):
+                records = [
+                    r for r in decode_records(bucket["data"])
+                    if _as_utc(r.get("created_at")) and (since is None or _as_utc(r["created_at"]) > since)
+                    and _as_utc(r["created_at"]) <= until
+                ]
+                for start in range(0, len(records), batch_size):
+                    writer.write(records[start:start + batch_size])
+    except BaseException:
+        writer.abort()
+        raise
+
+    writer.commit()
+    return writer.rows
+
+
+async def run_export(db, root: Path, full: bool = False, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    if pa is None:
+        raise RuntimeError("pyarrow is required for Parquet exports (pip install pyarrow)")
+    root.mkdir(parents=True, exist_ok=True)
+    watermarks = {} if full else load_watermarks(root)
+    now = datetime.now(timezone.utc)
+    until = now - SAFETY_LAG
+    run_id = now.strftime("%Y%m%dT%H%M%S")
+
+    exported = {}
+    for name, (collection_name, _, _) in EXPORTS.items():
+        await db[collection_name].create_index("created_at")
+        exported[name] = await export_collection(db, root, name, run_id, watermarks.get(name), until, batch_size)
+        # Saved per collection, so an interrupted run resumes where it stopped
+        watermarks[name] = until
+        save_watermarks(root, watermarks)
+        logger.info("Exported %d %s records", exported[name], name)
+    return exported
+
+
+async def _main(argv: List[str]):
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    args = [a for a in argv[1:] if not a.startswith("--")]
+    if not args:
+        print("Usage: python export_parquet.py OUTPUT_DIR [--full]")
+        return
+
+    if os.environ.get("STORAGE_BACKEND", "mongo").lower() == "sqlite":
+        from sqlite_store import SQLiteClient
+        client = SQLiteClient(os.environ.get("SQLITE_PATH", str(Path(__file__).parent / "baby_day_book.db")))
+        db = client[os.environ.get("DB_NAME", "baby_day_book")]
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from pymongo import ReadPreference
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client.get_database(os.environ['DB_NAME'], read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    exported = await run_export(db, Path(args[0]), full="--full" in argv)
+    print(f"Exported: {exported}")
+    client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(sys.argv))
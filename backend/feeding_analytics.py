@@ -0,0 +1,214 @@
+"""
+Feeding analytics over long histories.
+
+Feeding records of a window are loaded with a narrow projection into NumPy
+columns. Everything else is computed in vectorized passes over those
+columns:
+
+- rolling inter-feed intervals
+- left/right breast balance
+- daily bottle volume and its trend
+- cluster-feeding episodes
+
+Records logged within SESSION_GAP_MINUTES of the previous one (typically
+switching sides) count as one feeding session for interval purposes.
+
+Results are cached per baby and window end day. Feeding writes in this
+worker invalidate the windows they fall into; CACHE_TTL_SECONDS bounds how
+stale another worker's cache can be.
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+FEEDING_PROJECTION = {"_id": 0, "start_time": 1, "duration_minutes": 1, "feeding_type": 1, "amount_ml": 1}
+
+SESSION_GAP_MINUTES = 30
+ROLLING_WINDOW = 8  # sessions
+CLUSTER_MAX_INTERVAL_MINUTES = 90
+CLUSTER_MIN_SESSIONS = 3
+
+CACHE_SIZE = 1000
+CACHE_TTL_SECONDS = 300
+
+DAY_SECONDS = 86400
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _round(value, digits: int = 1):
+    if value is None or np.isnan(value):
+        return None
+    return round(float(value), digits)
+
+
+def _columns(records: List[dict]) -> Dict[str, np.ndarray]:
+    """Turn projected records into columns sorted by start time (seconds since epoch)"""
+    starts = np.array([_naive_utc(r["start_time"]) for r in records], dtype="datetime64[s]").astype(np.int64)
+    order = np.argsort(starts, kind="stable")
+    types = np.array([r.get("feeding_type") or "" for r in records], dtype=object)
+    amounts = np.array([r.get("amount_ml") if r.get("amount_ml") is not None else np.nan for r in records],
+                       dtype=float)
+    durations = np.array([r.get("duration_minutes") if r.get("duration_minutes") is not None else np.nan
+                          for r in records], dtype=float)
+    return {
+        "start": starts[order],
+        "type": types[order],
+        "amount": amounts[order],
+        "duration": durations[order],
+    }
+
+
+def _cluster_episodes(session_starts: np.ndarray, intervals: np.ndarray) -> List[dict]:
+    """Runs of at least CLUSTER_MIN_SESSIONS sessions spaced no more than the cluster interval"""
+    close = (intervals <= CLUSTER_MAX_INTERVAL_MINUTES).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], close, [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)  # exclusive, in interval indices
+
+    episodes = []
+    for first, last in zip(run_starts, run_ends):
+        sessions = last - first + 1
+        if sessions < CLUSTER_MIN_SESSIONS:
+            continue
+        episodes.append({
+            "start": datetime.fromtimestamp(int(session_starts[first]), timezone.utc),
+            "end": datetime.fromtimestamp(int(session_starts[last]), timezone.utc),
+            "feed_count": int(sessions),
+            "mean_interval_minutes": _round(intervals[first:last].mean()),
+        })
+    return episodes
+
+
+def analyze_feedings(records: List[dict], window_start: datetime, days: int) -> dict:
+    """Compute feeding analytics for the records of [window_start, window_start + days)"""
+    window_start = _naive_utc(window_start)
+    origin = int(np.datetime64(window_start, "s").astype(np.int64))
+    dates = [(window_start + timedelta(days=i)).date().isoformat() for i in range(days)]
+
+    if not records:
+        return {
+            "feed_count": 0,
+            "session_count": 0,
+            "intervals": {"last_minutes": None, "mean_minutes": None, "median_minutes": None,
+                          "recent_mean_minutes": None},
+            "side_balance": {"left_count": 0, "right_count": 0, "left_minutes": 0, "right_minutes": 0,
+                             "left_share": None, "last_side": None},
+            "bottle": {"total_ml": 0, "trend_ml_per_day": None},
+            "cluster_feeding": [],
+            "daily": [{"date": d, "feed_count": 0, "mean_interval_minutes": None, "bottle_ml": 0} for d in dates],
+        }
+
+    cols = _columns(records)
+    start = cols["start"]
+    day_index = np.clip((start - origin) // DAY_SECONDS, 0, days - 1)
+
+    # Sessions: a record more than SESSION_GAP_MINUTES after the previous one starts a new session
+    new_session = np.concatenate(([True], np.diff(start) > SESSION_GAP_MINUTES * 60))
+    session_starts = start[new_session]
+    session_days = day_index[new_session]
+    intervals = np.diff(session_starts) / 60.0
+
+    # Intervals belong to the day of the later session
+    interval_days = session_days[1:]
+    interval_sums = np.bincount(interval_days, weights=intervals, minlength=days)
+    interval_counts = np.bincount(interval_days, minlength=days)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        daily_interval = interval_sums / interval_counts
+
+    # Side balance
+    left = cols["type"] == "breast_left"
+    right = cols["type"] == "breast_right"
+    durations = np.nan_to_num(cols["duration"])
+    breast = np.flatnonzero(left | right)
+    left_count, right_count = int(left.sum()), int(right.sum())
+
+    # Bottle volume per day and its least-squares trend over days with bottle feeds
+    bottle = (cols["type"] == "bottle") & ~np.isnan(cols["amount"])
+    daily_ml = np.bincount(day_index[bottle], weights=cols["amount"][bottle], minlength=days)
+    bottle_days = np.flatnonzero(np.bincount(day_index[bottle], minlength=days))
+    trend = None
+    if len(bottle_days) >= 2:
+        trend = np.polyfit(bottle_days, daily_ml[bottle_days], 1)[0]
+
+    daily_counts = np.bincount(day_index, minlength=days)
+
+    return {
+        "feed_count": int(len(start)),
+        "session_count": int(len(session_starts)),
+        "intervals": {
+            "last_minutes": _round(intervals[-1]) if len(intervals) else None,
+            "mean_minutes": _round(intervals.mean()) if len(intervals) else None,
+            "median_minutes": _round(np.median(intervals)) if len(intervals) else None,
+            "recent_mean_minutes": _round(intervals[-ROLLING_WINDOW:].mean()) if len(intervals) else None,
+        },
+        "side_balance": {
+            "left_count": left_count,
+            "right_count": right_count,
+            "left_minutes": int(durations[left].sum()),
+            "right_minutes": int(durations[right].sum()),
+            "left_share": _round(left_count / (left_count + right_count), 2) if len(breast) else None,
+            "last_side": ("left" if left[breast[-1]] else "right") if len(breast) else None,
+        },
+        "bottle": {
+            "total_ml": int(daily_ml.sum()),
+            "trend_ml_per_day": _round(trend),
+        },
+        "cluster_feeding": _cluster_episodes(session_starts, intervals),
+        "daily": [
+            {
+                "date": dates[i],
+                "feed_count": int(daily_counts[i]),
+                "mean_interval_minutes": _round(daily_interval[i]),
+                "bottle_ml": int(daily_ml[i]),
+            }
+            for i in range(days)
+        ],
+    }
+
+
+class FeedingAnalyticsCache:
+    """LRU of analytics results keyed by (baby, window end day, days)"""
+
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (window start, window end, expires at, result)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, baby_id: str, window_end: datetime, days: int) -> Optional[dict]:
+        key = (baby_id, _naive_utc(window_end), days)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[3]
+
+    def put(self, baby_id: str, window_end: datetime, days: int, result: dict):
+        window_end = _naive_utc(window_end)
+        key = (baby_id, window_end, days)
+        self._entries[key] = (window_end - timedelta(days=days), window_end,
+                              time.monotonic() + self.ttl_seconds, result)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, baby_id: str, at: Optional[datetime] = None):
+        """Drop cached windows of a baby containing `at` (all of them if None)"""
+        at = _naive_utc(at) if at is not None else None
+        stale = [
+            key for key, (start, end, _, _) in self._entries.items()
+            if key[0] == baby_id and (at is None or start <= at < end)
+        ]
+        for key in stale:
+            del self._entries[key]
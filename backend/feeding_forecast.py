@@ -0,0 +1,316 @@
+"""
+Next-feeding forecast.
+
+Each baby has a small model document in `feeding_models`. It keeps
+recency-weighted sums of inter-feed intervals per time-of-day bucket, and
+the same for bottle amounts. Weights use forward decay:
+w(t) = exp((t - landmark) / DECAY_DAYS). Newer feeds weigh exponentially
+more, and a feed's contribution never changes once added. Adding or
+removing a feed is therefore an exact `$inc` of a few fields, plus two
+indexed neighbour lookups to find the intervals it splits or joins. The
+forecast reads this document and the baby's last feed; it never scans
+history. A missing model (a new baby, an import, a model past its decay
+limit) is rebuilt from history in a background task; until it is ready,
+forecasts fall back to the age-based priors.
+
+Estimates are shrunk towards the baby's overall pattern and then towards
+age-based priors, in proportion to how much recent data there is.
+Concurrent writes can leave small errors in the sums. Their weight stays
+fixed while new feeds weigh more and more, so such errors fade out.
+"""
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+BUCKET_HOURS = 4
+DECAY_DAYS = 3.0
+# Weight of the prior, in feeds
+PRIOR_WEIGHT = 3.0
+# Shorter gaps are side switches within one feed, longer ones missed logs
+MIN_INTERVAL_MINUTES = 30
+MAX_INTERVAL_MINUTES = 12 * 60
+# Rebuild (with a new landmark) long before the squared weights in `ww` would
+# overflow a float at exp(2 * 354): 300 is ~2.5 years after the landmark
+MAX_DECAY_EXPONENT = 300
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _bucket(moment: datetime) -> str:
+    return f"h{moment.hour // BUCKET_HOURS * BUCKET_HOURS:02d}"
+
+
+def feeding_prior_for_age(age_months: float):
+    """Return (typical interval in minutes, typical bottle amount in ml) for an age"""
+    if age_months < 1:
+        return 150, 90  # 2.5 hours
+    elif age_months < 3:
+        return 180, 120  # 3 hours
+    elif age_months < 6:
+        return 210, 150  # 3.5 hours
+    elif age_months < 9:
+        return 240, 180  # 4 hours
+    return 270, 200  # 4.5 hours
+
+
+class _Moments:
+    """Weighted count, mean and variance of one bucket (or a pool of buckets)"""
+
+    def __init__(self, stats: Optional[dict] = None):
+        stats = stats or {}
+        self.w = stats.get("w", 0.0)
+        self.wx = stats.get("wx", 0.0)
+        self.wxx = stats.get("wxx", 0.0)
+        self.ww = stats.get("ww", 0.0)
+
+    def add(self, other: "_Moments"):
+        self.w += other.w
+        self.wx += other.wx
+        self.wxx += other.wxx
+        self.ww += other.ww
+
+    @property
+    def effective_count(self) -> float:
+        # Kish's effective sample size; guards against residue left by add/remove pairs
+        return self.w * self.w / self.ww if self.w > 1e-12 and self.ww > 1e-24 else 0.0
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.wx / self.w if self.effective_count >= 0.5 else None
+
+    @property
+    def std(self) -> Optional[float]:
+        mean = self.mean
+        if mean is None:
+            return None
+        return math.sqrt(max(self.wxx / self.w - mean * mean, 0.0))
+
+
+def _shrink(moments: _Moments, prior: float) -> float:
+    n = moments.effective_count
+    mean = moments.mean
+    if mean is None:
+        return prior
+    return (n * mean + PRIOR_WEIGHT * prior) / (n + PRIOR_WEIGHT)
+
+
+def forecast(model: Optional[dict], last_feeding: Optional[dict], age_months: float, now: datetime) -> dict:
+    """Predict the next feed from a model document and the baby's last feed"""
+    now = _naive_utc(now)
+    prior_interval, prior_amount = feeding_prior_for_age(age_months)
+    model = model or {}
+    intervals = {k: _Moments(v) for k, v in model.get("intervals", {}).items()}
+    amounts = {k: _Moments(v) for k, v in model.get("amounts", {}).items()}
+
+    pooled_intervals, pooled_amounts = _Moments(), _Moments()
+    for moments in intervals.values():
+        pooled_intervals.add(moments)
+    for moments in amounts.values():
+        pooled_amounts.add(moments)
+
+    if last_feeding:
+        last_time = _naive_utc(last_feeding["start_time"])
+        bucket = intervals.get(_bucket(last_time), _Moments())
+        interval = _shrink(bucket, _shrink(pooled_intervals, prior_interval))
+        next_time = last_time + timedelta(minutes=interval)
+        confidence = 0.3 + 0.6 * bucket.effective_count / (bucket.effective_count + PRIOR_WEIGHT)
+    else:
+        last_time, bucket = None, _Moments()
+        interval = prior_interval
+        next_time = now + timedelta(minutes=interval)
+        confidence = 0.3
+
+    # If prediction is in the past, the feed is due now
+    next_time = max(next_time, now)
+
+    std = bucket.std if bucket.std is not None else pooled_intervals.std
+    window = max(15, round(std)) if std is not None else 30
+
+    expected_amount = None
+    if pooled_amounts.mean is not None or (last_feeding and last_feeding.get("feeding_type") == "bottle"):
+        amount_bucket = amounts.get(_bucket(next_time), _Moments())
+        expected_amount = round(_shrink(amount_bucket, _shrink(pooled_amounts, prior_amount)))
+
+    return {
+        "next_feed_time": next_time.replace(tzinfo=timezone.utc),
+        "expected_amount_ml": expected_amount,
+        "confidence": round(confidence, 2),
+        "interval_minutes": round(interval),
+        "window_minutes": window,
+        "last_feed_time": last_time.replace(tzinfo=timezone.utc) if last_time else None,
+    }
+
+
+class FeedingForecaster:
+    """Maintains `feeding_models` as feedings are added and removed"""
+
+    def __init__(self, db):
+        self.models = db.feeding_models
+        self.records = db.feeding_records
+        self._rebuilds: Dict[str, asyncio.Task] = {}
+
+    def _weight(self, landmark: datetime, moment: datetime) -> float:
+        return math.exp((moment - landmark).total_seconds() / 86400 / DECAY_DAYS)
+
+    def _interval_inc(self, landmark: datetime, earlier: datetime, later: datetime, sign: int) -> dict:
+        minutes = (later - earlier).total_seconds() / 60
+        if not MIN_INTERVAL_MINUTES <= minutes <= MAX_INTERVAL_MINUTES:
+            return {}
+        w = self._weight(landmark, later)
+        prefix = f"intervals.{_bucket(earlier)}"
+        return {
+            f"{prefix}.w": sign * w,
+            f"{prefix}.wx": sign * w * minutes,
+            f"{prefix}.wxx": sign * w * minutes * minutes,
+            f"{prefix}.ww": sign * w * w,
+        }
+
+    def _amount_inc(self, landmark: datetime, record: dict, sign: int) -> dict:
+        if record.get("feeding_type") != "bottle" or not record.get("amount_ml"):
+            return {}
+        moment = _naive_utc(record["start_time"])
+        w = self._weight(landmark, moment)
+        amount = record["amount_ml"]
+        prefix = f"amounts.{_bucket(moment)}"
+        return {
+            f"{prefix}.w": sign * w,
+            f"{prefix}.wx": sign * w * amount,
+            f"{prefix}.wxx": sign * w * amount * amount,
+            f"{prefix}.ww": sign * w * w,
+        }
+
+    async def _neighbours(self, record: dict, moment: datetime):
+        """Closest other feedings before and after `moment`"""
+        projection = {"_id": 0, "start_time": 1}
+        # Excluding the record itself also makes edits work: retract the old version, add the new
+        others = {"baby_id": record["baby_id"], "feeding_id": {"$ne": record["feeding_id"]}}
+        previous = await self.records.find_one(
+            {**others, "start_time": {"$lt": moment}}, projection, sort=[("start_time", -1)]
+        )
+        following = await self.records.find_one(
+            {**others, "start_time": {"$gt": moment}}, projection, sort=[("start_time", 1)]
+        )
+        return (
+            _naive_utc(previous["start_time"]) if previous else None,
+            _naive_utc(following["start_time"]) if following else None,
+        )
+
+    async def _apply(self, record: dict, sign: int):
+        """Add (sign=1) or remove (sign=-1) a feeding and the intervals around it"""
+        baby_id = record["baby_id"]
+        model = await self.models.find_one({"_id": baby_id}, {"landmark": 1})
+        if not model:
+            # The rebuild reads this feeding from history
+            self.schedule_rebuild(baby_id)
+            return
+
+        landmark = model["landmark"]
+        moment = _naive_utc(record["start_time"])
+        if (moment - landmark).total_seconds() / 86400 / DECAY_DAYS > MAX_DECAY_EXPONENT:
+            await self.invalidate(baby_id)
+            return
+
+        previous, following = await self._neighbours(record, moment)
+        inc = {}
+        # Adding a feed splits previous->following into two intervals; removing joins them again
+        for key, value in self._amount_inc(landmark, record, sign).items():
+            inc[key] = inc.get(key, 0) + value
+        changes = []
+        if previous and following:
+            changes.append((previous, following, -sign))
+        if previous:
+            changes.append((previous, moment, sign))
+        if following:
+            changes.append((moment, following, sign))
+        for earlier, later, change in changes:
+            for key, value in self._interval_inc(landmark, earlier, later, change).items():
+                inc[key] = inc.get(key, 0) + value
+
+        if inc:
+            await self.models.update_one(
+                {"_id": baby_id},
+                {"$inc": inc, "$set": {"updated_at": datetime.now(timezone.utc)}}
+            )
+
+    async def record_added(self, record: dict):
+        await self._apply(record, 1)
+
+    async def record_removed(self, record: dict):
+        await self._apply(record, -1)
+
+    async def delete_baby(self, baby_id: str):
+        rebuild = self._rebuilds.get(baby_id)
+        if rebuild:
+            rebuild.cancel()
+        await self.models.delete_one({"_id": baby_id})
+
+    async def invalidate(self, baby_id: str):
+        """Drop a baby's model after bulk changes to its history and rebuild it in the background"""
+        await self.models.delete_one({"_id": baby_id})
+        self.schedule_rebuild(baby_id)
+
+    def schedule_rebuild(self, baby_id: str):
+        """Rebuild a missing model in the background, once per baby at a time"""
+        if baby_id in self._rebuilds:
+            return
+        task = asyncio.get_running_loop().create_task(self._rebuild_in_background(baby_id))
+        self._rebuilds[baby_id] = task
+        task.add_done_callback(lambda _: self._rebuilds.pop(baby_id, None))
+
+    async def _rebuild_in_background(self, baby_id: str):
+        try:
+            await self.rebuild(baby_id)
+        except Exception:
+            # Forecasts keep using the priors; the next write or forecast retries
+            logger.exception("Rebuilding the feeding model of %s failed", baby_id)
+
+    async def close(self):
+        """Wait for rebuilds still running"""
+        if self._rebuilds:
+            await asyncio.gather(*self._rebuilds.values(), return_exceptions=True)
+
+    async def rebuild(self, baby_id: str) -> dict:
+        """Build a baby's model from its full feeding history (only when it is missing)"""
+        landmark = datetime.now(timezone.utc).replace(tzinfo=None)
+        records = await self.records.find(
+            {"baby_id": baby_id}, {"_id": 0, "start_time": 1, "feeding_type": 1, "amount_ml": 1}
+        ).sort("start_time", 1).to_list(None)
+
+        model = {"_id": baby_id, "landmark": landmark, "intervals": {}, "amounts": {}}
+        previous = None
+        for record in records:
+            moment = _naive_utc(record["start_time"])
+            incs = self._amount_inc(landmark, record, 1)
+            if previous is not None:
+                incs.update(self._interval_inc(landmark, previous, moment, 1))
+            for path, value in incs.items():
+                section, bucket, field = path.split(".")
+                stats = model[section].setdefault(bucket, {"w": 0.0, "wx": 0.0, "wxx": 0.0, "ww": 0.0})
+                stats[field] += value
+            previous = moment
+
+        model["updated_at"] = datetime.now(timezone.utc)
+        try:
+            await self.models.insert_one(model)
+        except DuplicateKeyError:
+            # Another request rebuilt it first
+            return await self.models.find_one({"_id": baby_id}) or model
+        return model
+
+    async def load(self, baby_id: str, source=None) -> Optional[dict]:
+        """Return a baby's model, or None (forecast from the priors) while it is being rebuilt"""
+        models = source.feeding_models if source is not None else self.models
+        model = await models.find_one({"_id": baby_id})
+        if model is None:
+            self.schedule_rebuild(baby_id)
+        return model
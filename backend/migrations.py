@@ -0,0 +1,312 @@
+"""
+Online schema migrations.
+
+    python migrations.py status
+    python migrations.py run [up_to_version]
+
+A migration rewrites one stored shape into another. Examples are a calendar
+date kept as an ISO string becoming a BSON date, or a timestamp kept as a
+string becoming a UTC date. Migrations have increasing versions and run in
+order. Each walks its collections in `_id` order in bounded batches, up to
+a high-water mark taken when it starts. Documents created after that are
+already written in the new shape by the app. A document is only rewritten
+while it still holds the value the batch read, so edits made by the app in
+the meantime win.
+
+Progress is checkpointed in `migrations` after every batch, so an
+interrupted run just continues where it stopped. Batches are throttled on
+the latency the runner itself observes: slow reads or writes shrink the
+batch and lengthen the pause, fast ones do the opposite. After every batch
+it also rests in proportion to how long the batch took. A migration
+therefore backs off by itself while the database is busy serving the app.
+
+The app reads both shapes (read_date, iso_date) and writes the new one
+(stored_date), so migrations can run while it serves traffic, before or
+after a deploy.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = "schema_v"
+WRITE_CONCURRENCY = 8
+
+
+# ==================== Shapes ====================
+
+def read_date(value) -> Optional[date]:
+    """A calendar date from either stored shape: ISO string (old) or BSON date (new)"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def stored_date(value) -> Optional[datetime]:
+    """The stored shape of a calendar date: midnight UTC as a BSON date"""
+    day = read_date(value)
+    return datetime(day.year, day.month, day.day) if day else None
+
+
+def iso_date(value):
+    """API shape of a calendar date ("YYYY-MM-DD"); unparseable old values are passed through"""
+    day = read_date(value) if not isinstance(value, str) else None
+    return day.isoformat() if day else value
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _date_from_string(value) -> Optional[datetime]:
+    return stored_date(value) if isinstance(value, str) else None
+
+
+def _timestamp_from_string(value) -> Optional[datetime]:
+    # Strings without an offset were written by clients that meant UTC, as the API reads them
+    if not isinstance(value, str):
+        return None
+    try:
+        return _naive_utc(datetime.fromisoformat(value.replace('Z', '+00:00')))
+    except ValueError:
+        return None
+
+
+# ==================== Migrations ====================
+
+class Migration:
+    """Rewrites fields of some collections with `convert`, which returns None to leave a value alone"""
+
+    def __init__(self, version: int, name: str, targets: Dict[str, List[str]], convert: Callable):
+        self.version = version
+        self.name = name
+        self.targets = targets
+        self.convert = convert
+
+    @property
+    def checkpoint_id(self) -> str:
+        return f"{CHECKPOINT_PREFIX}{self.version}"
+
+
+MIGRATIONS = [
+    Migration(1, "birth_date_as_date", {"babies": ["birth_date"]}, _date_from_string),
+    Migration(2, "growth_date_as_date", {"growth_records": ["date"]}, _date_from_string),
+    Migration(3, "string_timestamps_as_utc_dates", {
+        "feeding_records": ["start_time", "end_time", "created_at"],
+        "sleep_records": ["start_time", "end_time", "created_at"],
+        "diaper_records": ["time", "created_at"],
+        "growth_records": ["created_at"],
+        "reminders": ["time", "created_at"],
+        "babies": ["created_at", "updated_at"],
+        "users": ["created_at"],
+        "user_sessions": ["expires_at", "created_at"],
+        "share_invites": ["created_at"],
+    }, _timestamp_from_string),
+]
+
+
+class Throttle:
+    """Sizes batches and the pauses between them from the database latency batches observe"""
+
+    def __init__(self, target_ms: float = 50, batch_size: int = 200, min_batch: int = 10,
+                 max_batch: int = 2000, rest_ratio: float = 1.0, max_pause: float = 30.0):
+        self.target_ms = target_ms
+        self.batch_size = batch_size
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.rest_ratio = rest_ratio
+        self.max_pause = max_pause
+        self.backoff = 0.0
+
+    def observe(self, latency_ms: float, elapsed: float) -> float:
+        """Adapt to a batch's worst per-command latency; returns the seconds to rest before the next"""
+        if latency_ms > self.target_ms:
+            self.batch_size = max(self.min_batch, self.batch_size // 2)
+            self.backoff = min(self.max_pause, max(self.backoff * 2, 0.1))
+        else:
+            self.batch_size = min(self.max_batch, self.batch_size + max(1, self.batch_size // 4))
+            self.backoff /= 2
+        return self.backoff + elapsed * self.rest_ratio
+
+
+class MigrationRunner:
+    """Applies MIGRATIONS in version order, in throttled and checkpointed `_id`-range batches"""
+
+    def __init__(self, db, migrations: List[Migration] = MIGRATIONS, throttle: Optional[Throttle] = None):
+        self.db = db
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.throttle = throttle or Throttle()
+
+    async def status(self) -> List[dict]:
+        states = {
+            state["_id"]: state
+            for state in await self.db.migrations.find(
+                {"_id": {"$in": [m.checkpoint_id for m in self.migrations]}}
+            ).to_list(None)
+        }
+        result = []
+        for migration in self.migrations:
+            state = states.get(migration.checkpoint_id, {})
+            progress = [state.get(name, {}) for name in migration.targets]
+            result.append({
+                "version": migration.version,
+                "name": migration.name,
+                "status": "done" if state.get("done") else "running" if state else "pending",
+                "scanned": sum(p.get("scanned", 0) for p in progress),
+                "converted": sum(p.get("converted", 0) for p in progress),
+                "unconvertible": sum(p.get("unconvertible", 0) for p in progress),
+            })
+        return result
+
+    async def run(self, up_to_version: Optional[int] = None) -> Dict[int, int]:
+        """Apply pending migrations, resuming a started one; returns documents converted per version so far"""
+        converted = {}
+        for migration in self.migrations:
+            if up_to_version is not None and migration.version > up_to_version:
+                break
+            state = await self.db.migrations.find_one({"_id": migration.checkpoint_id}) or {}
+            if state.get("done"):
+                continue
+            logger.info("Applying migration %d (%s)", migration.version, migration.name)
+            converted[migration.version] = 0
+            for collection_name, fields in migration.targets.items():
+                progress = await self._migrate(migration, collection_name, fields, state.get(collection_name, {}))
+                converted[migration.version] += progress["converted"]
+            await self.db.migrations.update_one(
+                {"_id": migration.checkpoint_id},
+                {"$set": {"name": migration.name, "done": True, "finished_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        return converted
+
+    async def _migrate(self, migration: Migration, collection_name: str, fields: List[str], progress: dict) -> dict:
+        collection = self.db[collection_name]
+        if progress.get("done"):
+            return progress
+
+        # High-water mark: later documents are written in the new shape by the app
+        high_water = progress.get("high_water")
+        if high_water is None:
+            newest = await collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if not newest:
+                progress = {"done": True, "scanned": 0, "converted": 0, "unconvertible": 0}
+                await self._save(migration, collection_name, progress)
+                return progress
+            high_water = newest["_id"]
+        progress = {"scanned": 0, "converted": 0, "unconvertible": 0, **progress, "high_water": high_water}
+
+        while True:
+            id_range = {"$lte": high_water}
+            if progress.get("last_id") is not None:
+                id_range["$gt"] = progress["last_id"]
+            started = time.perf_counter()
+            batch = await collection.find(
+                {"_id": id_range}, {field: 1 for field in fields}
+            ).sort("_id", 1).to_list(self.throttle.batch_size)
+            read_ms = (time.perf_counter() - started) * 1000
+            if not batch:
+                break
+
+            write_ms = await self._convert_batch(migration, collection, fields, batch, progress)
+            progress["last_id"] = batch[-1]["_id"]
+            progress["scanned"] += len(batch)
+            await self._save(migration, collection_name, progress)
+
+            rest = self.throttle.observe(max(read_ms, write_ms), time.perf_counter() - started)
+            logger.info("Migration %d: %s scanned %d, converted %d (batch %d, rest %.2fs)", migration.version,
+                        collection_name, progress["scanned"], progress["converted"], self.throttle.batch_size, rest)
+            await asyncio.sleep(rest)
+
+        progress["done"] = True
+        await self._save(migration, collection_name, progress)
+        return progress
+
+    async def _convert_batch(self, migration: Migration, collection, fields: List[str], batch: List[dict],
+                             progress: dict) -> float:
+        """Rewrite the batch's old-shape values; returns the slowest write's latency in ms"""
+        updates: List[Tuple[dict, dict]] = []
+        for doc in batch:
+            changes = {}
+            for field in fields:
+                value = doc.get(field)
+                new_value = migration.convert(value)
+                if new_value is not None:
+                    changes[field] = new_value
+                elif isinstance(value, str):
+                    progress["unconvertible"] += 1
+                    logger.warning("Migration %d: cannot convert %s=%r of %s", migration.version, field, value,
+                                   doc["_id"])
+            if changes:
+                # Only while the document still holds what was read; the app's own edits win
+                updates.append(({"_id": doc["_id"], **{field: doc[field] for field in changes}}, {"$set": changes}))
+
+        slowest = 0.0
+        semaphore = asyncio.Semaphore(WRITE_CONCURRENCY)
+
+        async def write(query: dict, update: dict):
+            nonlocal slowest
+            async with semaphore:
+                started = time.perf_counter()
+                result = await collection.update_one(query, update)
+                slowest = max(slowest, (time.perf_counter() - started) * 1000)
+                progress["converted"] += result.modified_count
+
+        await asyncio.gather(*(write(query, update) for query, update in updates))
+        return slowest
+
+    async def _save(self, migration: Migration, collection_name: str, progress: dict):
+        await self.db.migrations.update_one(
+            {"_id": migration.checkpoint_id},
+            {"$set": {"name": migration.name, collection_name: progress}},
+            upsert=True
+        )
+
+
+async def _main(argv: List[str]):
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    if len(argv) < 2 or argv[1] not in ("status", "run"):
+        print("Usage: python migrations.py status|run [up_to_version]")
+        return
+
+    if os.environ.get("STORAGE_BACKEND", "mongo").lower() == "sqlite":
+        from sqlite_store import SQLiteClient
+        client = SQLiteClient(os.environ.get("SQLITE_PATH", str(Path(__file__).parent / "baby_day_book.db")))
+        db = client[os.environ.get("DB_NAME", "baby_day_book")]
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+
+    runner = MigrationRunner(db, throttle=Throttle(
+        target_ms=float(os.environ.get("MIGRATION_TARGET_LATENCY_MS", "50")),
+        rest_ratio=float(os.environ.get("MIGRATION_REST_RATIO", "1"))
+    ))
+    if argv[1] == "run":
+        converted = await runner.run(int(argv[2]) if len(argv) > 2 else None)
+        print(f"Converted: {converted}")
+    for migration in await runner.status():
+        print("v{version} {name}: {status}, {scanned} scanned, {converted} converted, "
+              "{unconvertible} unconvertible".format(**migration))
+    client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(sys.argv))
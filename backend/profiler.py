@@ -0,0 +1,257 @@
+"""
+On-demand sampling profiler for live requests.
+
+Admins can arm profiling in two ways. One profiles the next N requests to a
+route (in the worker that received the command). The other hands out a
+signed X-Profile header value, which profiles any request carrying it in
+any worker until it expires.
+
+While at least one profiled request is in flight, a background thread
+samples it every SAMPLE_INTERVAL. If the request's task is running on the
+event loop, the sample is the loop thread's stack. If the task is
+suspended, the sample is its chain of awaiting coroutines, ending in an
+"[await]" leaf. Samples therefore add up to wall time, and time spent
+waiting on the database shows up under the code that awaited it. Each
+sample is weighted by the time since the previous one.
+
+Finished profiles are stored in `profiles` (kept for a day) as collapsed
+stacks ("outer;inner;leaf weight_ms"), the input format of flamegraph.pl,
+speedscope and similar tools.
+
+When nothing is armed, the middleware costs one dict lookup and a header
+scan per request, and the sampler thread isn't running. A malformed
+X-Profile value is treated like a missing one.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_HEADER = "x-profile"
+SAMPLE_INTERVAL = 0.005
+MAX_CONCURRENT = 8
+MAX_STACKS = 2000
+PROFILE_TTL = timedelta(days=1)
+AWAIT_LEAF = "[await]"
+
+
+def _label(code) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Profile:
+    def __init__(self, root_frame, awaiting, method: str):
+        self.root_frame = root_frame
+        self.awaiting = awaiting
+        self.method = method
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.last_sample = self.started
+
+
+def _running_stack(thread_frame, root_frame) -> Optional[List[str]]:
+    """Frames above root_frame if the loop thread is currently inside it"""
+    labels = []
+    frame = thread_frame
+    while frame is not None:
+        if frame is root_frame:
+            labels.reverse()
+            return labels
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    return None
+
+
+def _suspended_stack(awaitable) -> List[str]:
+    """Follow the await chain of a suspended coroutine down to what it waits on"""
+    labels = []
+    while awaitable is not None:
+        frame = (getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+                 or getattr(awaitable, "ag_frame", None))
+        if frame is None:
+            break
+        labels.append(_label(frame.f_code))
+        awaitable = (getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+                     or getattr(awaitable, "ag_await", None))
+    labels.append(AWAIT_LEAF)
+    return labels
+
+
+class RequestProfiler:
+    """Tracks what is armed, samples profiled requests and collects their stacks"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._armed: Dict[Tuple[str, str], int] = {}  # (method, route template) -> remaining requests
+        self._active: Dict[int, _Profile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread: Optional[int] = None
+        self._key: Optional[bytes] = None
+
+    @property
+    def armed(self) -> Dict[str, int]:
+        return {f"{method} {route}": count for (method, route), count in self._armed.items()}
+
+    def set_key(self, key: bytes):
+        """Key for signing header tokens; must be the same in every worker"""
+        self._key = key
+
+    # ==================== Arming ====================
+
+    def arm(self, method: str, route: str, count: int):
+        if count <= 0:
+            self._armed.pop((method, route), None)
+        else:
+            self._armed[(method, route)] = count
+
+    def disarm(self):
+        self._armed.clear()
+
+    def issue_token(self, ttl_seconds: int) -> Tuple[str, datetime]:
+        expires_at = int(time.time()) + ttl_seconds
+        signature = hmac.new(self._key, str(expires_at).encode(), hashlib.sha256).hexdigest()
+        return f"{expires_at}.{signature}", datetime.fromtimestamp(expires_at, timezone.utc)
+
+    def _valid_token(self, token: bytes) -> bool:
+        # Raw header bytes: any value, however malformed, is just an invalid token
+        expires_at, _, signature = token.partition(b".")
+        if self._key is None or not expires_at.isdigit() or int(expires_at) < time.time():
+            return False
+        expected = hmac.new(self._key, expires_at, hashlib.sha256).hexdigest().encode()
+        return hmac.compare_digest(signature, expected)
+
+    def _armed_route(self, scope) -> Optional[Tuple[str, str]]:
+        method = scope["method"]
+        for route in scope["app"].router.routes:
+            key = (method, getattr(route, "path", None))
+            if key in self._armed and route.path_regex.match(scope["path"]):
+                return key
+        return None
+
+    def wants(self, scope) -> bool:
+        """Whether this request should be profiled (and use up an armed count)"""
+        if len(self._active) >= MAX_CONCURRENT:
+            return False
+        if self._armed:
+            key = self._armed_route(scope)
+            if key is not None:
+                remaining = self._armed.pop(key) - 1
+                if remaining:
+                    self._armed[key] = remaining
+                return True
+        for name, value in scope.get("headers") or ():
+            if name == PROFILE_HEADER.encode():
+                return self._valid_token(value)
+        return False
+
+    # ==================== Sampling ====================
+
+    def start(self, task_id: int, root_frame, awaiting, method: str):
+        with self._lock:
+            self._loop_thread = threading.get_ident()
+            self._active[task_id] = _Profile(root_frame, awaiting, method)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_forever, name="profiler", daemon=True)
+                self._thread.start()
+
+    def finish(self, task_id: int) -> _Profile:
+        with self._lock:
+            return self._active.pop(task_id)
+
+    def _sample_forever(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                thread_frame = sys._current_frames().get(self._loop_thread)
+                now = time.perf_counter()
+                for profile in self._active.values():
+                    stack = _running_stack(thread_frame, profile.root_frame)
+                    if stack is None:
+                        stack = _suspended_stack(profile.awaiting)
+                    profile.stacks[tuple(stack)] += now - profile.last_sample
+                    profile.last_sample = now
+                    profile.samples += 1
+
+
+def collapsed(stacks: List[Tuple[str, float]]) -> str:
+    """Stacks in flamegraph.pl's collapsed format, weights in milliseconds"""
+    return "".join(f"{stack} {max(1, round(weight))}\n" for stack, weight in stacks)
+
+
+def call_tree(stacks: List[Tuple[str, float]]) -> dict:
+    """Nested {name, ms, children} tree of collapsed stacks"""
+    root = {"name": "request", "ms": 0.0, "children": {}}
+    for stack, weight in stacks:
+        root["ms"] += weight
+        node = root
+        for label in stack.split(";"):
+            node = node["children"].setdefault(label, {"name": label, "ms": 0.0, "children": {}})
+            node["ms"] += weight
+
+    def finish(node):
+        children = sorted(node["children"].values(), key=lambda child: child["ms"], reverse=True)
+        return {"name": node["name"], "ms": round(node["ms"], 1), "children": [finish(c) for c in children]}
+
+    return finish(root)
+
+
+class ProfilerMiddleware:
+    """ASGI middleware profiling armed requests and storing the result"""
+
+    def __init__(self, app, profiler: RequestProfiler, store):
+        self.app = app
+        self.profiler = profiler
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wants(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # The sampler reads the loop thread's stack down to this frame while the
+        # request runs, and follows `handler`'s await chain while it is suspended
+        handler = self.app(scope, receive, send_wrapper)
+        task_id = id(asyncio.current_task())
+        self.profiler.start(task_id, sys._getframe(), handler, scope["method"])
+        try:
+            await handler
+        finally:
+            profile = self.profiler.finish(task_id)
+            route = scope.get("route")
+            await self._save(profile, getattr(route, "path", scope["path"]), status)
+
+    async def _save(self, profile: _Profile, route: str, status: int):
+        duration_ms = (time.perf_counter() - profile.started) * 1000
+        stacks = [(";".join(stack), weight * 1000) for stack, weight in profile.stacks.most_common(MAX_STACKS)]
+        now = datetime.now(timezone.utc)
+        await self.store.insert_one({
+            "_id": f"prof_{uuid.uuid4().hex[:12]}",
+            "route": route,
+            "method": profile.method,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "samples": profile.samples,
+            "stacks": [[stack, round(weight, 2)] for stack, weight in stacks],
+            "created_at": now,
+            "expires_at": now + PROFILE_TTL,
+        })
@@ -0,0 +1,606 @@
+"""
+In-memory evaluation of MongoDB filters, updates, projections and
+aggregation pipelines.
+
+The SQLite backend uses it for everything it can't push down to SQL, and
+the event archive uses it to query records decoded from its buckets. Values
+compare in BSON type order and dates as naive UTC, the way MongoDB returns
+them.
+"""
+import base64
+import json
+import math
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Placeholder for a field a document doesn't have
+MISSING = object()
+# Key holding a document's $text score while a query runs; "$" keys can't occur in stored documents
+TEXT_SCORE = "$textScore"
+
+
+# ==================== Encoding ====================
+
+def encode(value):
+    """Convert a document into JSON-compatible values (dates, ObjectIds and bytes tagged)"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return {"$date": value.strftime(DATE_FORMAT)}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, bytes):
+        return {"$binary": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if "$date" in value:
+                return datetime.strptime(value["$date"], DATE_FORMAT)
+            if "$oid" in value:
+                return ObjectId(value["$oid"])
+            if "$binary" in value:
+                return base64.b64decode(value["$binary"])
+        return {k: decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    return value
+
+
+def dumps(value) -> str:
+    return json.dumps(encode(value), separators=(",", ":"))
+
+
+def normalize(value):
+    """Compare dates the way MongoDB returns them: naive UTC"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# ==================== Comparison ====================
+
+def _type_rank(value) -> int:
+    # BSON comparison order
+    if value is None or value is MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value):
+    value = normalize(value)
+    rank = _type_rank(value)
+    if rank in (1,):
+        return (rank, 0)
+    if rank in (4, 5, 10):
+        return (rank, dumps(value))
+    if rank == 7:
+        return (rank, str(value))
+    return (rank, value)
+
+
+def _compare(a, b) -> int:
+    ka, kb = sort_key(a), sort_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def get_path(doc, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit():
+            index = int(part)
+            value = value[index] if index < len(value) else MISSING
+        elif isinstance(value, list):
+            values = [v.get(part, MISSING) for v in value if isinstance(v, dict)]
+            value = [v for v in values if v is not MISSING] or MISSING
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def _set_path(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+# ==================== Query matching ====================
+
+def match(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(match(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(match(doc, q) for q in condition):
+                return False
+        elif key == "$nor":
+            if any(match(doc, q) for q in condition):
+                return False
+        elif key == "$expr":
+            if not _truthy(_eval(condition, doc)):
+                return False
+        elif not _match_value(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def is_operator_dict(condition) -> bool:
+    return isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)
+
+
+def _match_value(value, condition) -> bool:
+    if is_operator_dict(condition):
+        return all(_match_operator(value, op, arg) for op, arg in condition.items())
+    return _equals(value, condition)
+
+
+def _equals(value, target) -> bool:
+    target = normalize(target)
+    if target is None:
+        return value is MISSING or value is None
+    if value is MISSING:
+        return False
+    if isinstance(value, list) and not isinstance(target, list):
+        return any(_equals(v, target) for v in value)
+    return _type_rank(value) == _type_rank(target) and _compare(value, target) == 0
+
+
+def _match_operator(value, op: str, arg) -> bool:
+    if op == "$eq":
+        return _equals(value, arg)
+    if op == "$ne":
+        return not _equals(value, arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        candidates = value if isinstance(value, list) else [value]
+        for candidate in candidates:
+            if candidate is MISSING or _type_rank(candidate) != _type_rank(normalize(arg)):
+                continue
+            c = _compare(candidate, arg)
+            if (op == "$gt" and c > 0) or (op == "$gte" and c >= 0) or \
+                    (op == "$lt" and c < 0) or (op == "$lte" and c <= 0):
+                return True
+        return False
+    if op == "$in":
+        return any(_equals(value, a) for a in arg)
+    if op == "$nin":
+        return not any(_equals(value, a) for a in arg)
+    if op == "$exists":
+        return (value is not MISSING) == bool(arg)
+    if op == "$not":
+        return not _match_value(value, arg)
+    if op == "$regex":
+        if not isinstance(value, str):
+            return False
+        return re.search(arg, value) is not None
+    if op == "$options":
+        return True
+    if op == "$size":
+        return isinstance(value, list) and len(value) == arg
+    if op == "$all":
+        return isinstance(value, list) and all(_equals(value, a) for a in arg)
+    if op == "$elemMatch":
+        return isinstance(value, list) and any(
+            match(v, arg) if isinstance(v, dict) else _match_value(v, arg) for v in value
+        )
+    raise OperationFailure(f"Query operator {op} is not supported")
+
+
+# ==================== Text search ====================
+
+_WORD = re.compile(r"\w+")
+
+
+def _stem(word: str) -> str:
+    """Crude English stemming, so that "rashes" finds "rash" and "spitting" finds "spit"."""
+    word = word.lower()
+    if word.endswith(("ing", "ed")) and len(word) > 5:
+        word = word[:-3] if word.endswith("ing") else word[:-2]
+        if word[-1] == word[-2] and word[-1] not in "aeiouls":
+            word = word[:-1]
+    elif word.endswith(("sses", "shes", "ches", "xes", "zes")):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def text_score(doc: dict, fields: List[str], search: str) -> float:
+    """Score a document like MongoDB's $text: any term, every "phrase", no -term; 0 if no match"""
+    phrases = [p.lower() for p in re.findall(r'"([^"]+)"', search)]
+    unquoted = re.sub(r'"[^"]*"', " ", search)
+    negated = {_stem(w) for w in re.findall(r"-(\w+)", unquoted)}
+    terms = {_stem(w) for w in _WORD.findall(unquoted)} - negated
+    for phrase in phrases:
+        terms.update(_stem(w) for w in _WORD.findall(phrase))
+
+    texts = [v for v in (get_path(doc, f) for f in fields) if isinstance(v, str)]
+    lowered = " ".join(texts).lower()
+    if any(phrase not in lowered for phrase in phrases):
+        return 0.0
+
+    score = 0.0
+    for text in texts:
+        stems = [_stem(w) for w in _WORD.findall(text)]
+        if negated & set(stems):
+            return 0.0
+        matched = sum(1 for stem in stems if stem in terms)
+        if matched:
+            score += matched * (0.5 + 0.5 / len(stems))
+    return score
+
+
+# ==================== Expressions ====================
+
+def _truthy(value) -> bool:
+    return value not in (None, False, 0, MISSING)
+
+
+def _eval(expr, doc):
+    if isinstance(expr, str):
+        if expr == "$$ROOT":
+            return doc
+        if expr == "$$NOW":
+            return datetime.now(timezone.utc).replace(tzinfo=None)
+        if expr.startswith("$$"):
+            raise OperationFailure(f"Variable {expr} is not supported")
+        if expr.startswith("$"):
+            value = get_path(doc, expr[1:])
+            return None if value is MISSING else value
+        return expr
+    if isinstance(expr, list):
+        return [_eval(e, doc) for e in expr]
+    if not isinstance(expr, dict):
+        return normalize(expr)
+    if len(expr) == 1:
+        op, arg = next(iter(expr.items()))
+        if op.startswith("$"):
+            return _eval_operator(op, arg, doc)
+    return {k: _eval(v, doc) for k, v in expr.items()}
+
+
+def _args(arg, doc) -> list:
+    if isinstance(arg, list):
+        return [_eval(a, doc) for a in arg]
+    return [_eval(arg, doc)]
+
+
+def _eval_operator(op: str, arg, doc):
+    if op == "$meta":
+        return doc.get(TEXT_SCORE) if arg == "textScore" else None
+    if op == "$literal":
+        return normalize(arg) if not isinstance(arg, (dict, list)) else decode(encode(arg))
+    if op == "$cond":
+        if isinstance(arg, dict):
+            condition, then, otherwise = arg["if"], arg["then"], arg["else"]
+        else:
+            condition, then, otherwise = arg
+        return _eval(then, doc) if _truthy(_eval(condition, doc)) else _eval(otherwise, doc)
+    if op == "$ifNull":
+        values = _args(arg, doc)
+        for value in values[:-1]:
+            if value is not None:
+                return value
+        return values[-1]
+    if op == "$switch":
+        for branch in arg["branches"]:
+            if _truthy(_eval(branch["case"], doc)):
+                return _eval(branch["then"], doc)
+        return _eval(arg.get("default"), doc)
+
+    values = _args(arg, doc)
+    if op == "$and":
+        return all(_truthy(v) for v in values)
+    if op == "$or":
+        return any(_truthy(v) for v in values)
+    if op == "$not":
+        return not _truthy(values[0])
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$cmp"):
+        c = _compare(values[0], values[1])
+        return {"$eq": c == 0, "$ne": c != 0, "$gt": c > 0, "$gte": c >= 0,
+                "$lt": c < 0, "$lte": c <= 0, "$cmp": c}[op]
+    if op == "$in":
+        return any(_compare(values[0], v) == 0 for v in (values[1] or []))
+    if op == "$add":
+        if any(v is None for v in values):
+            return None
+        dates = [v for v in values if isinstance(v, datetime)]
+        total = sum(v for v in values if not isinstance(v, datetime))
+        return dates[0] + timedelta(milliseconds=total) if dates else total
+    if op == "$subtract":
+        a, b = values
+        if a is None or b is None:
+            return None
+        if isinstance(a, datetime) and isinstance(b, datetime):
+            return int((a - b).total_seconds() * 1000)
+        if isinstance(a, datetime):
+            return a - timedelta(milliseconds=b)
+        return a - b
+    if op == "$multiply":
+        if any(v is None for v in values):
+            return None
+        result = 1
+        for v in values:
+            result *= v
+        return result
+    if op == "$divide":
+        return None if values[0] is None or values[1] is None else values[0] / values[1]
+    if op == "$mod":
+        return None if values[0] is None or values[1] is None else values[0] % values[1]
+    if op == "$abs":
+        return None if values[0] is None else abs(values[0])
+    if op in ("$floor", "$ceil"):
+        return None if values[0] is None else (math.floor if op == "$floor" else math.ceil)(values[0])
+    if op in ("$min", "$max", "$sum", "$avg"):
+        items = values[0] if len(values) == 1 and isinstance(values[0], list) else values
+        numbers = [v for v in items if v is not None]
+        if op == "$sum":
+            return sum(v for v in numbers if isinstance(v, (int, float)) and not isinstance(v, bool))
+        if op == "$avg":
+            numeric = [v for v in numbers if isinstance(v, (int, float))]
+            return sum(numeric) / len(numeric) if numeric else None
+        if not numbers:
+            return None
+        return (min if op == "$min" else max)(numbers, key=sort_key)
+    if op == "$size":
+        return len(values[0] or [])
+    if op == "$slice":
+        array = values[0] or []
+        if len(values) == 2:
+            n = values[1]
+            return array[:n] if n >= 0 else array[n:]
+        return array[values[1]:values[1] + values[2]]
+    if op == "$arrayElemAt":
+        array, index = values
+        try:
+            return array[index]
+        except (IndexError, TypeError):
+            return None
+    if op == "$concatArrays":
+        return [item for array in values for item in (array or [])]
+    if op == "$toString":
+        return None if values[0] is None else str(values[0])
+    if op == "$hour":
+        return values[0].hour
+    if op == "$dayOfWeek":
+        return values[0].isoweekday() % 7 + 1
+    if op == "$dateToString":
+        fmt = arg.get("format", "%Y-%m-%dT%H:%M:%S.%LZ") if isinstance(arg, dict) else "%Y-%m-%d"
+        date = _eval(arg["date"], doc)
+        if date is None:
+            return None
+        return date.strftime(fmt.replace("%L", f"{date.microsecond // 1000:03d}"))
+    raise OperationFailure(f"Expression operator {op} is not supported")
+
+
+# ==================== Updates and projections ====================
+
+def apply_update(doc: dict, update, inserting: bool) -> dict:
+    if isinstance(update, list):
+        for stage in update:
+            (op, spec), = stage.items()
+            if op in ("$set", "$addFields"):
+                computed = {k: _eval(v, doc) for k, v in spec.items()}
+                for k, v in computed.items():
+                    _set_path(doc, k, v)
+            elif op == "$unset":
+                for k in ([spec] if isinstance(spec, str) else spec):
+                    _unset_path(doc, k)
+            else:
+                raise OperationFailure(f"Update stage {op} is not supported")
+        return doc
+
+    for op, spec in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for key, value in spec.items():
+            value = normalize(value)
+            if op in ("$set", "$setOnInsert"):
+                _set_path(doc, key, value)
+            elif op == "$unset":
+                _unset_path(doc, key)
+            elif op == "$inc":
+                current = get_path(doc, key)
+                _set_path(doc, key, (0 if current in (MISSING, None) else current) + value)
+            elif op in ("$max", "$min"):
+                current = get_path(doc, key)
+                c = _compare(value, current) if current is not MISSING else (1 if op == "$max" else -1)
+                if current is MISSING or (op == "$max" and c > 0) or (op == "$min" and c < 0):
+                    _set_path(doc, key, value)
+            elif op in ("$addToSet", "$push"):
+                current = get_path(doc, key)
+                array = [] if current in (MISSING, None) else list(current)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in items:
+                    if op == "$push" or not any(_compare(item, existing) == 0 for existing in array):
+                        array.append(item)
+                _set_path(doc, key, array)
+            elif op == "$pull":
+                current = get_path(doc, key)
+                if isinstance(current, list):
+                    _set_path(doc, key, [
+                        item for item in current
+                        if not (match(item, value) if isinstance(item, dict) and isinstance(value, dict)
+                                else _match_value(item, value))
+                    ])
+            else:
+                raise OperationFailure(f"Update operator {op} is not supported")
+    return doc
+
+
+def upsert_seed(query: dict) -> dict:
+    """Build the initial document of an upsert from the filter's equality clauses"""
+    seed = {}
+    for key, value in query.items():
+        if key == "$and":
+            for clause in value:
+                seed.update(upsert_seed(clause))
+        elif not key.startswith("$") and not is_operator_dict(value):
+            _set_path(seed, key, normalize(value))
+        elif isinstance(value, dict) and "$eq" in value:
+            _set_path(seed, key, normalize(value["$eq"]))
+    return seed
+
+
+def without_score(doc: dict) -> dict:
+    doc.pop(TEXT_SCORE, None)
+    return doc
+
+
+def project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return doc
+    include = {k: v for k, v in projection.items() if k != "_id" and v not in (0, False)}
+    if include:
+        result = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for key, spec in include.items():
+            if spec in (1, True):
+                value = get_path(doc, key)
+                if value is not MISSING:
+                    _set_path(result, key, value)
+            else:
+                _set_path(result, key, _eval(spec, doc))
+        return result
+    result = dict(doc)
+    for key, spec in projection.items():
+        if spec in (0, False):
+            _unset_path(result, key)
+    return result
+
+
+# ==================== Aggregation ====================
+
+_ACCUMULATORS = ("$sum", "$avg", "$min", "$max", "$first", "$last", "$push", "$addToSet", "$count")
+
+
+def _group(docs: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[str, dict] = {}
+    values: Dict[str, Dict[str, list]] = {}
+    for doc in docs:
+        group_id = _eval(spec["_id"], doc)
+        key = dumps(group_id)
+        if key not in groups:
+            groups[key] = {"_id": group_id}
+            values[key] = {name: [] for name in spec if name != "_id"}
+        for name, accumulator in spec.items():
+            if name == "_id":
+                continue
+            (op, arg), = accumulator.items()
+            values[key][name].append(1 if op == "$count" else _eval(arg, doc))
+
+    for key, group in groups.items():
+        for name, accumulator in spec.items():
+            if name == "_id":
+                continue
+            op = next(iter(accumulator))
+            items = values[key][name]
+            present = [v for v in items if v is not None]
+            if op in ("$sum", "$count"):
+                group[name] = sum(v for v in present if isinstance(v, (int, float)) and not isinstance(v, bool))
+            elif op == "$avg":
+                numeric = [v for v in present if isinstance(v, (int, float))]
+                group[name] = sum(numeric) / len(numeric) if numeric else None
+            elif op == "$min":
+                group[name] = min(present, key=sort_key) if present else None
+            elif op == "$max":
+                group[name] = max(present, key=sort_key) if present else None
+            elif op == "$first":
+                group[name] = items[0] if items else None
+            elif op == "$last":
+                group[name] = items[-1] if items else None
+            elif op == "$push":
+                group[name] = items
+            elif op == "$addToSet":
+                unique = {}
+                for v in items:
+                    unique.setdefault(dumps(v), v)
+                group[name] = list(unique.values())
+            else:
+                raise OperationFailure(f"Accumulator {op} is not supported")
+    return list(groups.values())
+
+
+def sort_docs(docs: List[dict], spec) -> List[dict]:
+    items = spec.items() if isinstance(spec, dict) else spec
+    for key, direction in reversed(list(items)):
+        docs.sort(key=lambda d: sort_key(get_path(d, key)), reverse=direction < 0)
+    return docs
+
+
+def run_pipeline(docs: List[dict], pipeline: List[dict]) -> List[dict]:
+    for stage in pipeline:
+        (op, spec), = stage.items()
+        if op == "$match":
+            docs = [d for d in docs if match(d, spec)]
+        elif op == "$group":
+            docs = _group(docs, spec)
+        elif op == "$sort":
+            docs = sort_docs(docs, spec)
+        elif op == "$limit":
+            docs = docs[:spec]
+        elif op == "$skip":
+            docs = docs[spec:]
+        elif op == "$project":
+            docs = [project(d, spec) for d in docs]
+        elif op in ("$set", "$addFields"):
+            docs = [apply_update(dict(d), [{"$set": spec}], False) for d in docs]
+        elif op == "$unset":
+            docs = [apply_update(dict(d), [{"$unset": spec}], False) for d in docs]
+        elif op == "$unwind":
+            path = spec if isinstance(spec, str) else spec["path"]
+            unwound = []
+            for d in docs:
+                for item in get_path(d, path[1:]) or []:
+                    copy = dict(d)
+                    _set_path(copy, path[1:], item)
+                    unwound.append(copy)
+            docs = unwound
+        elif op == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif op == "$facet":
+            docs = [{name: run_pipeline(list(docs), sub) for name, sub in spec.items()}]
+        else:
+            raise OperationFailure(f"Aggregation stage {op} is not supported")
+    return docs
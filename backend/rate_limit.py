@@ -0,0 +1,205 @@
+"""
+Admission control: token-bucket rate limiting and concurrency limits.
+
+Every API request takes a token from the bucket of its caller and from the
+bucket of each baby it addresses in its path or `baby_id` query parameter.
+Routes that take the baby in a JSON body (record creation) are limited per
+caller only, since reading the body here would hold up every request. The
+caller is the user of a valid signed access token, checked without a
+database round trip; anyone else (unauthenticated, opaque session tokens,
+forged tokens) is limited by client IP, so rotating made-up tokens doesn't
+buy fresh buckets. Behind a reverse proxy every connection comes from the
+proxy, so the client IP is read from the header it sets when one is
+configured. An empty bucket answers 429 with a Retry-After header. On top of
+that, expensive routes share a per-worker concurrency limit so one
+client hammering stats or predictions cannot starve everyone else.
+
+Buckets live in memory by default. Multi-worker deployments can set
+RATE_LIMIT_BACKEND=mongo to share them through the `rate_limits` collection.
+"""
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+EXEMPT_PATHS = ("/api/", "/api/health")
+
+
+class MemoryBucketBackend:
+    """Per-process token buckets"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def take(self, key: str, capacity: float, per_second: float) -> float:
+        """Take one token; return 0 if allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * per_second)
+
+        if tokens >= 1:
+            retry_after = 0.0
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / per_second
+
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            self._prune(now, capacity, per_second)
+        self._buckets[key] = (tokens, now)
+        return retry_after
+
+    def _prune(self, now: float, capacity: float, per_second: float):
+        # Buckets idle long enough to be full again carry no state
+        idle = capacity / per_second
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < idle}
+
+
+class MongoBucketBackend:
+    """Token buckets shared by all workers, updated atomically in MongoDB"""
+
+    def __init__(self, db):
+        self.collection = db.rate_limits
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, capacity: float, per_second: float) -> float:
+        now = datetime.now(timezone.utc)
+        refilled = {"$min": [
+            capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", capacity]},
+                {"$multiply": [
+                    {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]},
+                    per_second
+                ]}
+            ]}
+        ]}
+        pipeline = [
+            {"$set": {"tokens": refilled, "updated_at": now}},
+            {"$set": {
+                "allowed": {"$gte": ["$tokens", 1]},
+                "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                "expires_at": now + timedelta(seconds=capacity / per_second)
+            }}
+        ]
+        try:
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent first request created the bucket: update the one it inserted
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / per_second
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware applying per-caller and per-baby rate limits"""
+
+    def __init__(self, app, backend, user_per_minute: int = 600, baby_per_minute: int = 600,
+                 expensive_prefixes: List[str] = (), expensive_concurrency: int = 8,
+                 queue_timeout: float = 2.0, verify_token: Callable[[str], Optional[str]] = lambda token: None,
+                 client_ip_header: Optional[str] = None):
+        self.app = app
+        self.backend = backend
+        self.verify_token = verify_token
+        self.client_ip_header = client_ip_header.lower().encode("latin-1") if client_ip_header else None
+        self.user_per_minute = user_per_minute
+        self.baby_per_minute = baby_per_minute
+        self.expensive_prefixes = tuple(expensive_prefixes)
+        self.expensive_slots = asyncio.Semaphore(expensive_concurrency) if expensive_concurrency else None
+        self.queue_timeout = queue_timeout
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not path.startswith("/api/") or path in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = 0.0
+        if self.user_per_minute:
+            retry_after = await self.backend.take(
+                f"user:{_caller_key(scope, self.verify_token, self.client_ip_header)}",
+                self.user_per_minute, self.user_per_minute / 60
+            )
+        if not retry_after and self.baby_per_minute:
+            for baby_id in _baby_ids(scope):
+                retry_after = await self.backend.take(
+                    f"baby:{baby_id}", self.baby_per_minute, self.baby_per_minute / 60
+                )
+                if retry_after:
+                    break
+
+        if retry_after:
+            await _reject(scope, receive, send, 429, "Too many requests", retry_after)
+            return
+
+        if not self.expensive_slots or not path.startswith(self.expensive_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(self.expensive_slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            await _reject(scope, receive, send, 503, "Server busy, try again shortly", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.expensive_slots.release()
+
+
+def _caller_key(scope, verify_token: Callable[[str], Optional[str]], client_ip_header: Optional[bytes] = None) -> str:
+    """Identify the caller without touching the database: a verified user id, else the client IP"""
+    headers = dict(scope.get("headers") or [])
+    tokens = []
+
+    for cookie in headers.get(b"cookie", b"").decode("latin-1").split(";"):
+        name, _, value = cookie.strip().partition("=")
+        if name in ("access_token", "session_token") and value:
+            tokens.append(value)
+
+    auth_header = headers.get(b"authorization", b"").decode("latin-1")
+    if auth_header.startswith("Bearer "):
+        tokens.append(auth_header[len("Bearer "):])
+
+    for token in tokens:
+        user_id = verify_token(token)
+        if user_id:
+            return user_id
+
+    if client_ip_header:
+        # The trusted proxy appends the address it saw; earlier entries are client-supplied
+        forwarded = headers.get(client_ip_header, b"").decode("latin-1").split(",")[-1].strip()
+        if forwarded:
+            return f"ip:{forwarded}"
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "anonymous"
+
+
+def _baby_ids(scope) -> List[str]:
+    """Babies named by the path or the baby_id query parameter"""
+    baby_ids = [segment for segment in scope.get("path", "").split("/") if segment.startswith("baby_")]
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    baby_ids.extend(baby_id for baby_id in query.get("baby_id", []) if baby_id not in baby_ids)
+    return baby_ids
+
+
+async def _reject(scope, receive, send, status_code: int, detail: str, retry_after: float):
+    response = JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+    await response(scope, receive, send)
@@ -0,0 +1,117 @@
+"""
+Per-route read-preference routing.
+
+Analytics routes (stats, predictions, exports, reports) read through a
+database handle configured with a secondary read preference and bounded
+staleness, so they do not compete with the write path on the primary.
+Everything else keeps the default primary handle.
+
+Read-your-own-writes: a caregiver who has just written is routed to the
+primary for longer than the staleness bound. Successful writes set a
+`last_write` cookie (ReadYourWritesMiddleware) holding the write's time, so
+whichever worker serves the client's next analytics read sees it; the
+worker that took the write also remembers the user, for clients that drop
+cookies. Clients can always force a primary read with the
+`X-Read-Consistency: strong` header. On a single-host
+replica set (or a standalone server) both handles end up on the same node.
+"""
+import time
+from typing import Dict, Mapping
+
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from starlette.datastructures import MutableHeaders
+
+# MongoDB rejects maxStalenessSeconds below 90
+MIN_MAX_STALENESS_SECONDS = 90
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+STRONG_CONSISTENCY_HEADER = "X-Read-Consistency"
+WRITE_COOKIE = "last_write"
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _read_preference(name: str, max_staleness_seconds: int):
+    if name not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {name}")
+    if name == "primary":
+        return Primary()
+    if max_staleness_seconds > 0:
+        max_staleness_seconds = max(max_staleness_seconds, MIN_MAX_STALENESS_SECONDS)
+    else:
+        max_staleness_seconds = -1
+    return READ_PREFERENCES[name](max_staleness=max_staleness_seconds)
+
+
+class ReadRouter:
+    def __init__(self, db, analytics_read_preference: str = "secondaryPreferred",
+                 max_staleness_seconds: int = 90, read_concern: str = "local",
+                 read_your_writes: bool = True, max_tracked_users: int = 10000):
+        self.primary = db
+        self.analytics = db.with_options(
+            read_preference=_read_preference(analytics_read_preference, max_staleness_seconds),
+            read_concern=ReadConcern(read_concern)
+        )
+        self.routes_to_primary = analytics_read_preference == "primary"
+        # Stay on the primary a little longer than a secondary may lag behind
+        staleness = max(max_staleness_seconds, MIN_MAX_STALENESS_SECONDS)
+        self.sticky_seconds = staleness + 10 if read_your_writes else 0
+        self.max_tracked_users = max_tracked_users
+        self._last_writes: Dict[str, float] = {}
+
+    def note_write(self, user_id: str):
+        """Remember that a user just wrote, so their next analytics reads see it"""
+        if not self.sticky_seconds:
+            return
+        now = time.monotonic()
+        if len(self._last_writes) >= self.max_tracked_users:
+            self._last_writes = {
+                k: t for k, t in self._last_writes.items() if now - t < self.sticky_seconds
+            }
+        self._last_writes[user_id] = now
+
+    def wants_primary(self, user_id: str, headers, cookies: Mapping[str, str]) -> bool:
+        if self.routes_to_primary:
+            return True
+        if headers.get(STRONG_CONSISTENCY_HEADER, "").lower() == "strong":
+            return True
+        if not self.sticky_seconds:
+            return False
+        try:
+            if time.time() - int(cookies.get(WRITE_COOKIE, "")) < self.sticky_seconds:
+                return True
+        except ValueError:
+            pass
+        last_write = self._last_writes.get(user_id)
+        return last_write is not None and time.monotonic() - last_write < self.sticky_seconds
+
+
+class ReadYourWritesMiddleware:
+    """ASGI middleware stamping successful writes with the `last_write` cookie"""
+
+    def __init__(self, app, router: ReadRouter):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in READ_METHODS or not self.router.sticky_seconds:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                MutableHeaders(raw=message["headers"]).append(
+                    "set-cookie",
+                    f"{WRITE_COOKIE}={int(time.time())}; Max-Age={self.router.sticky_seconds}; Path=/; "
+                    "HttpOnly; Secure; SameSite=None"
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -1,36 +1,128 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends
 from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import Dict, List, Optional
+from collections import OrderedDict
 import uuid
+import asyncio
+import base64
+import hashlib
+import json
 from datetime import datetime, timezone, timedelta
 import httpx
+from event_store import EVENT_TYPES, EventStore
+from write_buffer import WriteBuffer
+from compression import CompressionMiddleware, NegotiatedJSONResponse
+from read_routing import ReadRouter, ReadYourWritesMiddleware
+from rate_limit import AdmissionControlMiddleware, MemoryBucketBackend, MongoBucketBackend
+from sqlite_store import SQLiteClient
+from feeding_analytics import FEEDING_PROJECTION, FeedingAnalyticsCache, analyze_feedings
+from feeding_forecast import FeedingForecaster, forecast as forecast_feeding
+from sleep_accounting import CONTEXT as SLEEP_CONTEXT, MAX_SLEEP_DURATION, SLEEP_PROJECTION, account_sleep
+from single_flight import SingleFlight
+from access_tokens import AccessTokens, is_access_token, session_id
+from alerts import RULES as ALERT_RULES, WET_DIAPER_TYPES, AlertEngine, InboxNotifier, WebhookNotifier
+from alerts import MAX_THRESHOLD_MINUTES as ALERT_MAX_MINUTES, MIN_THRESHOLD_MINUTES as ALERT_MIN_MINUTES
+import cohort
+import csv_import
+from migrations import iso_date, read_date, stored_date
+from query import match as match_query
+from access_log import AccessLogMiddleware, CommandCounter, configure_logging, dropped_records, note_user
+from profiler import ProfilerMiddleware, RequestProfiler, call_tree, collapsed
+from visit_report import FORMATS as REPORT_FORMATS, RendererBusy, ReportRenderer, data_version
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage: MongoDB, or an embedded SQLite file for small self-hosted setups
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo").lower()
+if STORAGE_BACKEND == "sqlite":
+    client = SQLiteClient(
+        os.environ.get("SQLITE_PATH", str(ROOT_DIR / "baby_day_book.db")), event_listeners=[CommandCounter()]
+    )
+    db = client[os.environ.get("DB_NAME", "baby_day_book")]
+elif STORAGE_BACKEND == "mongo":
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[CommandCounter()])
+    db = client[os.environ['DB_NAME']]
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+# Feeding/sleep/diaper storage layout ("legacy", "dual" or "unified");
+# time-series collections only exist on MongoDB
+event_store = EventStore(
+    db, "legacy" if STORAGE_BACKEND == "sqlite" else os.environ.get("EVENT_STORE_MODE", "legacy")
+)
+
+# Analytics routes read from secondaries when the deployment has them
+read_router = ReadRouter(
+    db,
+    analytics_read_preference=os.environ.get("ANALYTICS_READ_PREFERENCE", "secondaryPreferred"),
+    max_staleness_seconds=int(os.environ.get("ANALYTICS_MAX_STALENESS_SECONDS", "90")),
+    read_concern=os.environ.get("ANALYTICS_READ_CONCERN", "local"),
+    read_your_writes=os.environ.get("READ_YOUR_WRITES", "true").lower() == "true"
+)
+analytics_event_store = EventStore(read_router.analytics, event_store.mode)
+
+# Group-commit window for feeding/sleep/diaper inserts (0 disables batching)
+write_buffer = WriteBuffer(
+    window_ms=float(os.environ.get("WRITE_BUFFER_WINDOW_MS", "0")),
+    max_batch=int(os.environ.get("WRITE_BUFFER_MAX_BATCH", "500"))
+)
+
+# Per-worker cache of feeding analytics windows
+feeding_analytics_cache = FeedingAnalyticsCache()
+
+# Incrementally maintained per-baby feeding models
+feeding_forecaster = FeedingForecaster(db)
+
+# Short-lived signed access tokens, verified without database lookups
+access_tokens = AccessTokens(
+    secret=os.environ.get("ACCESS_TOKEN_SECRET"),
+    ttl_seconds=int(os.environ.get("ACCESS_TOKEN_TTL_SECONDS", "900"))
+)
+
+# Identical concurrent timeline/stats/prediction reads share one computation;
+# a non-zero TTL also reuses the result briefly
+single_flight = SingleFlight(
+    result_ttl_seconds=float(os.environ.get("SINGLE_FLIGHT_RESULT_TTL_MS", "0")) / 1000
+)
+
+# Visit summary reports are rendered in worker processes, off the event loop
+report_renderer = ReportRenderer(
+    max_workers=int(os.environ.get("REPORT_WORKERS", "2")),
+    max_queued=int(os.environ.get("REPORT_MAX_QUEUED", "8"))
+)
+
+# Caregiver alerts; deadlines move with each state change, so checks only read due rules
+alert_notifiers = [InboxNotifier(db.alerts)]
+if os.environ.get("ALERT_WEBHOOK_URL"):
+    alert_notifiers.append(WebhookNotifier(os.environ["ALERT_WEBHOOK_URL"]))
+alert_engine = AlertEngine(db, alert_notifiers)
+
+# Age-normalized cohort percentiles, built by `python cohort.py run`
+cohort_tables = cohort.CohortTables(db[cohort.COHORT_COLLECTION])
+
+# Admin-armed sampling profiler for live requests (idle unless armed)
+request_profiler = RequestProfiler()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=NegotiatedJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging; records are written by a background thread, not on the event loop
+log_listener = configure_logging(logging.INFO)
 logger = logging.getLogger(__name__)
 
 # ==================== Models ====================
@@ -62,12 +154,17 @@ class Baby(BaseModel):
     user_id: str  # Owner
     shared_with: List[str] = []  # List of user_ids who have access
     name: str
-    birth_date: str  # ISO date string
+    birth_date: str  # ISO date string (stored as a date, see migrations.py)
     gender: Optional[str] = None  # "male", "female", "other"
     photo: Optional[str] = None  # Base64 encoded image
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+    @field_validator("birth_date", mode="before")
+    @classmethod
+    def _birth_date_string(cls, value):
+        return iso_date(value)
+
 class BabyCreate(BaseModel):
     name: str
     birth_date: str
@@ -104,6 +201,15 @@ class FeedingCreate(BaseModel):
     notes: Optional[str] = None
     food_type: Optional[str] = None
 
+class FeedingUpdate(BaseModel):
+    feeding_type: Optional[str] = None
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
+    duration_minutes: Optional[int] = None
+    amount_ml: Optional[int] = None
+    notes: Optional[str] = None
+    food_type: Optional[str] = None
+
 # Sleep Models
 class SleepRecord(BaseModel):
     sleep_id: str = Field(default_factory=lambda: f"sleep_{uuid.uuid4().hex[:12]}")
@@ -142,18 +248,28 @@ class DiaperCreate(BaseModel):
     time: str
     notes: Optional[str] = None
 
+class DiaperUpdate(BaseModel):
+    diaper_type: Optional[str] = None
+    time: Optional[str] = None
+    notes: Optional[str] = None
+
 # Growth Models
 class GrowthRecord(BaseModel):
     growth_id: str = Field(default_factory=lambda: f"growth_{uuid.uuid4().hex[:12]}")
     baby_id: str
     user_id: str
-    date: str  # ISO date string
+    date: str  # ISO date string (stored as a date, see migrations.py)
     weight_kg: Optional[float] = None
     height_cm: Optional[float] = None
     head_circumference_cm: Optional[float] = None
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+    @field_validator("date", mode="before")
+    @classmethod
+    def _date_string(cls, value):
+        return iso_date(value)
+
 class GrowthCreate(BaseModel):
     baby_id: str
     date: str
@@ -162,6 +278,13 @@ class GrowthCreate(BaseModel):
     head_circumference_cm: Optional[float] = None
     notes: Optional[str] = None
 
+class GrowthUpdate(BaseModel):
+    date: Optional[str] = None
+    weight_kg: Optional[float] = None
+    height_cm: Optional[float] = None
+    head_circumference_cm: Optional[float] = None
+    notes: Optional[str] = None
+
 # Activity Timeline Model
 class TimelineEntry(BaseModel):
     entry_id: str
@@ -177,6 +300,25 @@ class SleepPrediction(BaseModel):
     recommended_duration_minutes: int
     wake_window_minutes: int
 
+# Feeding Forecast Model
+class FeedingForecast(BaseModel):
+    next_feed_time: datetime
+    expected_amount_ml: Optional[int] = None  # Only for bottle-fed babies
+    confidence: float
+    interval_minutes: int
+    window_minutes: int  # Typical deviation either side of next_feed_time
+    last_feed_time: Optional[datetime] = None
+
+# Current State Model
+class BabyState(BaseModel):
+    baby_id: str
+    ongoing_sleep: Optional[dict] = None  # sleep_id, sleep_type, start_time
+    last_sleep: Optional[dict] = None  # Last completed sleep
+    last_feeding: Optional[dict] = None
+    last_diaper: Optional[dict] = None
+    last_wet_diaper: Optional[dict] = None
+    updated_at: Optional[datetime] = None
+
 # Family Sharing Models
 class ShareInvite(BaseModel):
     invite_id: str = Field(default_factory=lambda: f"invite_{uuid.uuid4().hex[:12]}")
@@ -207,22 +349,34 @@ class ReminderCreate(BaseModel):
     time: str
     message: str
 
+class ReminderUpdate(BaseModel):
+    reminder_type: Optional[str] = None
+    time: Optional[str] = None
+    message: Optional[str] = None
+    is_active: Optional[bool] = None
+
+# Alert Models
+class AlertRule(BaseModel):
+    baby_id: str
+    rule: str  # "no_feed", "no_wet_diaper", "long_sleep"
+    threshold_minutes: int
+    since: Optional[datetime] = None  # Last feed / last wet diaper / start of the ongoing sleep
+    due_at: Optional[datetime] = None  # None once fired or with nothing to measure from
+    fired_at: Optional[datetime] = None
+
+class AlertRuleSet(BaseModel):
+    threshold_minutes: int
+
 # ==================== Auth Helper ====================
 
-async def get_current_user(request: Request) -> Optional[User]:
-    # Check cookies first
-    session_token = request.cookies.get("session_token")
-    
-    # Fallback to Authorization header
-    if not session_token:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            session_token = auth_header.split(" ")[1]
-    
-    if not session_token:
-        return None
-    
-    # Find session
+def _bearer_token(request: Request) -> Optional[str]:
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        return auth_header.split(" ")[1]
+    return None
+
+async def _session_user(session_token: str) -> Optional[dict]:
+    """Look up a session token and return its user document, if the session is still valid"""
     session = await db.user_sessions.find_one(
         {"session_token": session_token},
         {"_id": 0}
@@ -239,12 +393,28 @@ async def get_current_user(request: Request) -> Optional[User]:
     if expires_at < datetime.now(timezone.utc):
         return None
     
-    # Get user
-    user_doc = await db.users.find_one(
+    return await db.users.find_one(
         {"user_id": session["user_id"]},
         {"_id": 0}
     )
+
+async def get_current_user(request: Request) -> Optional[User]:
+    # Signed access tokens (cookie or header) need no database lookup
+    for token in (request.cookies.get("access_token"), _bearer_token(request)):
+        if token and is_access_token(token):
+            claims = access_tokens.verify(token)
+            if claims:
+                return User(**claims)
+    
+    # Otherwise fall back to the session token, cookie first
+    session_token = request.cookies.get("session_token")
+    if not session_token:
+        session_token = _bearer_token(request)
     
+    if not session_token or is_access_token(session_token):
+        return None
+    
+    user_doc = await _session_user(session_token)
     if user_doc:
         return User(**user_doc)
     return None
@@ -253,8 +423,17 @@ async def require_auth(request: Request) -> User:
     user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    note_user(user.user_id)
+    if request.method != "GET":
+        read_router.note_write(user.user_id)
     return user
 
+def _analytics_sources(request: Request, user: User):
+    """Return the (database, event store) pair analytics reads should use for this request"""
+    if read_router.wants_primary(user.user_id, request.headers, request.cookies):
+        return db, event_store
+    return read_router.analytics, analytics_event_store
+
 # Check if user has access to baby
 async def check_baby_access(user_id: str, baby_id: str) -> bool:
     baby = await db.babies.find_one(
@@ -265,6 +444,323 @@ async def check_baby_access(user_id: str, baby_id: str) -> bool:
         return False
     return baby["user_id"] == user_id or user_id in baby.get("shared_with", [])
 
+# Babies each user can access, so record mutations can fold the ACL into their
+# filter. Read fresh on every call: a cached set would let a caregiver whose
+# access was just removed keep writing through other workers.
+def _baby_access_filter(user_id: str) -> dict:
+    return {"$or": [{"user_id": user_id}, {"shared_with": user_id}]}
+
+async def accessible_baby_ids(user_id: str) -> List[str]:
+    babies = await db.babies.find(_baby_access_filter(user_id), {"_id": 0, "baby_id": 1}).to_list(None)
+    return [baby["baby_id"] for baby in babies]
+
+# id field -> event type, for records that may have been moved to the archive
+_EVENT_TYPE_BY_ID_FIELD = {id_field: event_type for event_type, (_, id_field, _) in EVENT_TYPES.items()}
+
+async def _mutate_record(collection, id_field: str, record_id: str, user: User, update=None,
+                         delete: bool = False, return_document=ReturnDocument.AFTER,
+                         not_found: str = "Record not found") -> dict:
+    """Update (or delete, or just read) a record in one write, with the baby ACL in the filter"""
+    baby_ids = await accessible_baby_ids(user.user_id)
+    query = {id_field: record_id, "baby_id": {"$in": baby_ids}}
+    event_type = _EVENT_TYPE_BY_ID_FIELD.get(id_field)
+    for attempt in range(2):
+        if delete:
+            record = await collection.find_one_and_delete(query, {"_id": 0})
+        elif update:
+            record = await collection.find_one_and_update(
+                query, update, {"_id": 0}, return_document=return_document
+            )
+        else:
+            record = await collection.find_one(query, {"_id": 0})
+        if record:
+            return record
+        # Archived records move back to the hot collection to be changed there
+        if attempt or event_type is None or not await event_store.restore(event_type, record_id, baby_ids):
+            break
+    
+    # Only failures pay for telling "missing" from "forbidden"
+    if not await collection.find_one({id_field: record_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail=not_found)
+    raise HTTPException(status_code=403, detail="Access denied")
+
+def _update_fields(data: BaseModel, time_fields=(), required=()) -> dict:
+    """Fields given in a partial-update body, with ISO time strings parsed; null clears a field"""
+    update_data = data.dict(exclude_unset=True)
+    for field in required:
+        if field in update_data and update_data[field] is None:
+            raise HTTPException(status_code=400, detail=f"{field} cannot be cleared")
+    for field in time_fields:
+        if update_data.get(field) is not None:
+            update_data[field] = datetime.fromisoformat(update_data[field].replace('Z', '+00:00'))
+    if update_data:
+        # The archive job only deletes records still in the version it copied
+        update_data["updated_at"] = datetime.now(timezone.utc)
+    return update_data
+
+def _stored_date(value: str, field: str) -> datetime:
+    """Calendar date from a request in its stored shape (see migrations.py)"""
+    day = stored_date(value)
+    if day is None:
+        raise HTTPException(status_code=400, detail=f"{field} must be a date (YYYY-MM-DD)")
+    return day
+
+def _as_utc(value: datetime) -> datetime:
+    """Mongo returns naive datetimes; treat them as UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+# ==================== Baby State Helper ====================
+
+# Small per-baby document answering "asleep now? last feed? last diaper?"
+STATE_SUMMARY_FIELDS = {
+    "last_feeding": ["feeding_id", "feeding_type", "start_time", "amount_ml"],
+    "last_diaper": ["diaper_id", "diaper_type", "time"],
+    "last_wet_diaper": ["diaper_id", "diaper_type", "time"],
+    "last_sleep": ["sleep_id", "sleep_type", "start_time", "end_time"],
+    "ongoing_sleep": ["sleep_id", "sleep_type", "start_time"],
+}
+# Bump when the set of state fields changes; older documents are rebuilt on read
+BABY_STATE_SCHEMA = 2
+
+def _state_summary(field: str, record: dict) -> dict:
+    return {k: record.get(k) for k in STATE_SUMMARY_FIELDS[field]}
+
+def _state_projection(field: str) -> dict:
+    return {"_id": 0, **{k: 1 for k in STATE_SUMMARY_FIELDS[field]}}
+
+def _newer_state(field: str, record: dict) -> dict:
+    """Pipeline expression keeping whichever of the stored and given record is newer"""
+    # Summaries list the id first and the ordering time third
+    id_key, time_key = STATE_SUMMARY_FIELDS[field][0], STATE_SUMMARY_FIELDS[field][2]
+    summary = _state_summary(field, record)
+    return {"$cond": [
+        {"$or": [
+            {"$not": [f"${field}"]},
+            {"$eq": [f"${field}.{id_key}", summary[id_key]]},
+            {"$gt": [summary[time_key], f"${field}.{time_key}"]}
+        ]},
+        {"$literal": summary},
+        f"${field}"
+    ]}
+
+async def _update_baby_state(baby_id: str, fields: dict):
+    """Atomically apply pipeline expressions to a baby's state document"""
+    state = await db.baby_state.find_one_and_update(
+        {"_id": baby_id},
+        [{"$set": {
+            **fields,
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+            "updated_at": datetime.now(timezone.utc)
+        }}],
+        {"_id": 0, **{field: 1 for field in fields}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    await alert_engine.state_changed(baby_id, state, fields.keys())
+
+async def _recompute_baby_state(baby_id: str) -> dict:
+    """Rebuild a baby's state from the record collections (used after deletes)"""
+    for _ in range(5):
+        current = await db.baby_state.find_one({"_id": baby_id}, {"version": 1})
+        version = current.get("version", 0) if current else None
+        
+        last_feeding, last_diaper, last_wet_diaper, last_sleep, ongoing_sleep = await asyncio.gather(
+            db.feeding_records.find_one(
+                {"baby_id": baby_id}, _state_projection("last_feeding"), sort=[("start_time", -1)]
+            ),
+            db.diaper_records.find_one(
+                {"baby_id": baby_id}, _state_projection("last_diaper"), sort=[("time", -1)]
+            ),
+            db.diaper_records.find_one(
+                {"baby_id": baby_id, "diaper_type": {"$in": WET_DIAPER_TYPES}},
+                _state_projection("last_wet_diaper"), sort=[("time", -1)]
+            ),
+            db.sleep_records.find_one(
+                {"baby_id": baby_id, "end_time": {"$ne": None}}, _state_projection("last_sleep"), sort=[("start_time", -1)]
+            ),
+            db.sleep_records.find_one(
+                {"baby_id": baby_id, "end_time": None}, _state_projection("ongoing_sleep"), sort=[("start_time", -1)]
+            ),
+        )
+        state = {
+            "last_feeding": last_feeding,
+            "last_diaper": last_diaper,
+            "last_wet_diaper": last_wet_diaper,
+            "last_sleep": last_sleep,
+            "ongoing_sleep": ongoing_sleep,
+            "schema": BABY_STATE_SCHEMA,
+            "version": (version or 0) + 1,
+            "updated_at": datetime.now(timezone.utc)
+        }
+        
+        # Only write if no handler changed the state while we were reading
+        if current is None:
+            try:
+                await db.baby_state.insert_one({"_id": baby_id, **state})
+            except DuplicateKeyError:
+                continue
+            await alert_engine.state_changed(baby_id, state)
+            return state
+        result = await db.baby_state.update_one({"_id": baby_id, "version": version}, {"$set": state})
+        if result.matched_count:
+            await alert_engine.state_changed(baby_id, state)
+            return state
+    
+    logger.warning("Gave up recomputing state for %s after concurrent updates", baby_id)
+    return await db.baby_state.find_one({"_id": baby_id}, {"_id": 0}) or {}
+
+async def _load_baby_states(baby_ids: List[str], source=db) -> dict:
+    """Point-read the state of several babies, rebuilding any that are missing or outdated"""
+    states = {
+        state.pop("_id"): state
+        for state in await source.baby_state.find({"_id": {"$in": baby_ids}}).to_list(len(baby_ids))
+    }
+    stale = [baby_id for baby_id in baby_ids if states.get(baby_id, {}).get("schema") != BABY_STATE_SCHEMA]
+    if stale:
+        rebuilt = await asyncio.gather(*(_recompute_baby_state(baby_id) for baby_id in stale))
+        states.update(zip(stale, rebuilt))
+    return states
+
+# ==================== Idempotency Helper ====================
+
+# Responses to requests carrying an Idempotency-Key are kept this long
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+# A pending key older than this is assumed abandoned by a crashed request
+IDEMPOTENCY_PENDING_TIMEOUT = timedelta(seconds=60)
+IDEMPOTENCY_CACHE_SIZE = 10000
+
+_idempotency_cache: "OrderedDict[str, dict]" = OrderedDict()
+_idempotency_inflight: Dict[str, asyncio.Future] = {}
+_idempotency_retries = set()
+
+def _replay_idempotent(entry: dict, route: str, fingerprint: str):
+    # Keys stored before bodies were fingerprinted only check the route
+    if entry["route"] != route or entry.get("fingerprint", fingerprint) != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key already used for a different request")
+    return entry["response"]
+
+def _idempotency_expired(entry: dict, now: datetime) -> bool:
+    return _as_utc(entry["created_at"]) < now - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+
+async def _claim_idempotency_key(cache_key: str, route: str, fingerprint: str) -> Optional[dict]:
+    """Claim a key for this request; return the stored entry if another request already owns it"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": cache_key,
+            "route": route,
+            "fingerprint": fingerprint,
+            "status": "pending",
+            "created_at": now
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    
+    # Another worker is handling the same key: wait for its response
+    for _ in range(50):
+        entry = await db.idempotency_keys.find_one({"_id": cache_key})
+        if entry and _idempotency_expired(entry, now):
+            # Past its TTL but not reaped yet by the TTL monitor
+            await db.idempotency_keys.delete_one({"_id": cache_key, "created_at": entry["created_at"]})
+            entry = None
+        if not entry:
+            # The other request failed and released the key
+            return await _claim_idempotency_key(cache_key, route, fingerprint)
+        if entry["status"] == "done":
+            return entry
+        
+        if _as_utc(entry["created_at"]) < now - IDEMPOTENCY_PENDING_TIMEOUT:
+            taken = await db.idempotency_keys.update_one(
+                {"_id": cache_key, "status": "pending", "created_at": entry["created_at"]},
+                {"$set": {"created_at": now, "route": route, "fingerprint": fingerprint}}
+            )
+            if taken.modified_count:
+                return None
+        
+        await asyncio.sleep(0.1)
+    
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+async def _finish_idempotency_key(cache_key: str, response, attempts: int = 1) -> bool:
+    """Store the response of a claimed key, retrying with backoff for up to `attempts` tries"""
+    delay = 0.5
+    for attempt in range(attempts):
+        try:
+            await db.idempotency_keys.update_one(
+                {"_id": cache_key},
+                {"$set": {"status": "done", "response": response}}
+            )
+            return True
+        except Exception:
+            if attempt == attempts - 1:
+                logger.exception("Could not store the response of Idempotency-Key %s", cache_key)
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+async def run_idempotent(request: Request, user: User, create):
+    """Run a record-creating handler at most once per (user, Idempotency-Key)"""
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        return await create()
+    
+    cache_key = f"{user.user_id}:{key}"
+    route = request.url.path
+    fingerprint = hashlib.sha256(await request.body()).hexdigest()
+    
+    entry = _idempotency_cache.get(cache_key)
+    if entry and _idempotency_expired(entry, datetime.now(timezone.utc)):
+        del _idempotency_cache[cache_key]
+        entry = None
+    if entry:
+        _idempotency_cache.move_to_end(cache_key)
+        return _replay_idempotent(entry, route, fingerprint)
+    
+    # Concurrent duplicate in this worker: share the first request's outcome
+    inflight = _idempotency_inflight.get(cache_key)
+    if inflight:
+        entry = await asyncio.shield(inflight)
+        if entry is None:
+            return await run_idempotent(request, user, create)
+        return _replay_idempotent(entry, route, fingerprint)
+    
+    future = asyncio.get_running_loop().create_future()
+    _idempotency_inflight[cache_key] = future
+    entry = None
+    try:
+        entry = await _claim_idempotency_key(cache_key, route, fingerprint)
+        if entry is None:
+            try:
+                record = await create()
+            except BaseException:
+                await db.idempotency_keys.delete_one({"_id": cache_key, "status": "pending"})
+                raise
+            
+            entry = {
+                "route": route,
+                "fingerprint": fingerprint,
+                "response": jsonable_encoder(record),
+                "created_at": datetime.now(timezone.utc),
+            }
+            if not await _finish_idempotency_key(cache_key, entry["response"]):
+                # The record exists: a key left pending would be taken over after
+                # IDEMPOTENCY_PENDING_TIMEOUT and create it again, so keep trying
+                task = asyncio.create_task(_finish_idempotency_key(cache_key, entry["response"], attempts=10))
+                _idempotency_retries.add(task)
+                task.add_done_callback(_idempotency_retries.discard)
+        
+        _idempotency_cache[cache_key] = entry
+        if len(_idempotency_cache) > IDEMPOTENCY_CACHE_SIZE:
+            _idempotency_cache.popitem(last=False)
+    finally:
+        _idempotency_inflight.pop(cache_key, None)
+        future.set_result(entry)
+    
+    return _replay_idempotent(entry, route, fingerprint)
+
 # ==================== Auth Routes ====================
 
 @api_router.post("/auth/session")
@@ -312,6 +808,7 @@ async def exchange_session(request: Request, response: Response):
     session_doc = {
         "user_id": user_id,
         "session_token": session_data.session_token,
+        "session_id": session_id(session_data.session_token),
         "expires_at": expires_at,
         "created_at": datetime.now(timezone.utc)
     }
@@ -329,7 +826,43 @@ async def exchange_session(request: Request, response: Response):
     )
     
     user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-    return {"user": user_doc, "session_token": session_data.session_token}
+    return {
+        "user": user_doc,
+        "session_token": session_data.session_token,
+        **_issue_access_token(response, user_doc, session_data.session_token)
+    }
+
+def _issue_access_token(response: Response, user_doc: dict, session_token: str) -> dict:
+    """Sign an access token for a session and also set it as a cookie"""
+    token, expires_at = access_tokens.issue(user_doc, session_token)
+    response.set_cookie(
+        key="access_token",
+        value=token,
+        httponly=True,
+        secure=True,
+        samesite="none",
+        path="/",
+        max_age=access_tokens.ttl_seconds
+    )
+    return {"access_token": token, "access_token_expires_at": expires_at}
+
+@api_router.post("/auth/refresh")
+async def refresh_access_token(request: Request, response: Response):
+    """Exchange a session token for a fresh access token"""
+    session_token = request.cookies.get("session_token") or _bearer_token(request)
+    if not session_token or is_access_token(session_token):
+        raise HTTPException(status_code=401, detail="Session token required")
+    
+    user_doc = await _session_user(session_token)
+    if not user_doc:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Sessions created before access tokens existed can't be logged out by session id otherwise
+    await db.user_sessions.update_one(
+        {"session_token": session_token, "session_id": {"$exists": False}},
+        {"$set": {"session_id": session_id(session_token)}}
+    )
+    return _issue_access_token(response, user_doc, session_token)
 
 @api_router.get("/auth/me")
 async def get_me(request: Request):
@@ -344,14 +877,25 @@ async def logout(request: Request, response: Response):
     """Logout user"""
     session_token = request.cookies.get("session_token")
     if not session_token:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            session_token = auth_header.split(" ")[1]
-    
-    if session_token:
+        session_token = _bearer_token(request)
+    
+    # Clients holding only an access token are logged out through its session id
+    sid = None
+    if session_token and is_access_token(session_token):
+        claims = access_tokens.verify(session_token)
+        sid = claims["session_id"] if claims else None
+        if sid:
+            await db.user_sessions.delete_one({"session_id": sid})
+    elif session_token:
+        sid = session_id(session_token)
         await db.user_sessions.delete_one({"session_token": session_token})
     
+    # Access tokens already handed out stay valid until they expire unless revoked
+    if sid:
+        await access_tokens.revoke(sid)
+    
     response.delete_cookie(key="session_token", path="/")
+    response.delete_cookie(key="access_token", path="/")
     return {"message": "Logged out successfully"}
 
 # ==================== Baby Routes ====================
@@ -369,7 +913,7 @@ async def create_baby(baby_data: BabyCreate, request: Request):
         photo=baby_data.photo
     )
     
-    await db.babies.insert_one(baby.dict())
+    await db.babies.insert_one({**baby.dict(), "birth_date": _stored_date(baby.birth_date, "birth_date")})
     return baby
 
 @api_router.get("/baby", response_model=List[Baby])
@@ -407,18 +951,20 @@ async def update_baby(baby_id: str, baby_data: BabyUpdate, request: Request):
     """Update baby profile"""
     user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, baby_id):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
     update_data = {k: v for k, v in baby_data.dict().items() if v is not None}
+    if "birth_date" in update_data:
+        update_data["birth_date"] = _stored_date(update_data["birth_date"], "birth_date")
     update_data["updated_at"] = datetime.now(timezone.utc)
     
-    await db.babies.update_one(
-        {"baby_id": baby_id},
-        {"$set": update_data}
+    baby = await db.babies.find_one_and_update(
+        {"baby_id": baby_id, **_baby_access_filter(user.user_id)},
+        {"$set": update_data},
+        {"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    
-    baby = await db.babies.find_one({"baby_id": baby_id}, {"_id": 0})
+    if not baby:
+        raise HTTPException(status_code=403, detail="Access denied")
+    single_flight.bump(baby_id)
     return Baby(**baby)
 
 @api_router.delete("/baby/{baby_id}")
@@ -426,20 +972,27 @@ async def delete_baby(baby_id: str, request: Request):
     """Delete baby profile (owner only)"""
     user = await require_auth(request)
     
-    baby = await db.babies.find_one({"baby_id": baby_id}, {"_id": 0})
+    baby = await db.babies.find_one_and_delete(
+        {"baby_id": baby_id, "user_id": user.user_id}, {"_id": 0, "photo": 0}
+    )
     if not baby:
+        if await db.babies.find_one({"baby_id": baby_id}, {"_id": 1}):
+            raise HTTPException(status_code=403, detail="Only owner can delete")
         raise HTTPException(status_code=404, detail="Baby not found")
     
-    if baby["user_id"] != user.user_id:
-        raise HTTPException(status_code=403, detail="Only owner can delete")
-    
     # Delete all related records
-    await db.babies.delete_one({"baby_id": baby_id})
     await db.feeding_records.delete_many({"baby_id": baby_id})
     await db.sleep_records.delete_many({"baby_id": baby_id})
     await db.diaper_records.delete_many({"baby_id": baby_id})
     await db.growth_records.delete_many({"baby_id": baby_id})
     await db.reminders.delete_many({"baby_id": baby_id})
+    await event_store.delete_baby(baby_id)
+    await db.baby_state.delete_one({"_id": baby_id})
+    await alert_engine.delete_baby(baby_id)
+    await db.alerts.delete_many({"baby_id": baby_id})
+    single_flight.bump(baby_id)
+    feeding_analytics_cache.invalidate(baby_id)
+    await feeding_forecaster.delete_baby(baby_id)
     
     return {"message": "Baby profile deleted"}
 
@@ -450,23 +1003,31 @@ async def create_feeding(feeding_data: FeedingCreate, request: Request):
     """Create a feeding record"""
     user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, feeding_data.baby_id):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    feeding = FeedingRecord(
-        baby_id=feeding_data.baby_id,
-        user_id=user.user_id,
-        feeding_type=feeding_data.feeding_type,
-        start_time=datetime.fromisoformat(feeding_data.start_time.replace('Z', '+00:00')),
-        end_time=datetime.fromisoformat(feeding_data.end_time.replace('Z', '+00:00')) if feeding_data.end_time else None,
-        duration_minutes=feeding_data.duration_minutes,
-        amount_ml=feeding_data.amount_ml,
-        notes=feeding_data.notes,
-        food_type=feeding_data.food_type
-    )
+    async def create():
+        if not await check_baby_access(user.user_id, feeding_data.baby_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        feeding = FeedingRecord(
+            baby_id=feeding_data.baby_id,
+            user_id=user.user_id,
+            feeding_type=feeding_data.feeding_type,
+            start_time=datetime.fromisoformat(feeding_data.start_time.replace('Z', '+00:00')),
+            end_time=datetime.fromisoformat(feeding_data.end_time.replace('Z', '+00:00')) if feeding_data.end_time else None,
+            duration_minutes=feeding_data.duration_minutes,
+            amount_ml=feeding_data.amount_ml,
+            notes=feeding_data.notes,
+            food_type=feeding_data.food_type
+        )
+        
+        await write_buffer.insert(db.feeding_records, feeding.dict())
+        await event_store.insert("feeding", feeding.dict())
+        single_flight.bump(feeding.baby_id)
+        await _update_baby_state(feeding.baby_id, {"last_feeding": _newer_state("last_feeding", feeding.dict())})
+        feeding_analytics_cache.invalidate(feeding.baby_id, feeding.start_time)
+        await feeding_forecaster.record_added(feeding.dict())
+        return feeding
     
-    await db.feeding_records.insert_one(feeding.dict())
-    return feeding
+    return await run_idempotent(request, user, create)
 
 @api_router.get("/feeding/{baby_id}", response_model=List[FeedingRecord])
 async def get_feedings(baby_id: str, request: Request, date: Optional[str] = None):
@@ -476,30 +1037,119 @@ async def get_feedings(baby_id: str, request: Request, date: Optional[str] = Non
     if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    query = {"baby_id": baby_id}
+    start_date, end_date = _day_range(date) if date else (None, None)
     
-    if date:
-        start_date = datetime.fromisoformat(date)
-        end_date = start_date + timedelta(days=1)
-        query["start_time"] = {"$gte": start_date, "$lt": end_date}
-    
-    records = await db.feeding_records.find(query, {"_id": 0}).sort("start_time", -1).to_list(100)
+    records = await event_store.find(
+        "feeding", [baby_id], start_date, end_date, newest_first=True
+    ).to_list(100)
     return [FeedingRecord(**record) for record in records]
 
+@api_router.put("/feeding/{feeding_id}", response_model=FeedingRecord)
+async def update_feeding(feeding_id: str, feeding_data: FeedingUpdate, request: Request):
+    """Update fields of a feeding record"""
+    user = await require_auth(request)
+    
+    update_data = _update_fields(feeding_data, ("start_time", "end_time"), ("feeding_type", "start_time"))
+    if not update_data:
+        return FeedingRecord(**await _mutate_record(db.feeding_records, "feeding_id", feeding_id, user))
+    
+    # The previous values are needed to retract the record from derived data
+    before = await _mutate_record(
+        db.feeding_records, "feeding_id", feeding_id, user, {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
+    )
+    record = {**before, **update_data}
+    
+    await event_store.replace("feeding", record)
+    single_flight.bump(record["baby_id"])
+    if "start_time" in update_data:
+        await _recompute_baby_state(record["baby_id"])
+    else:
+        await _update_baby_state(record["baby_id"], {"last_feeding": _newer_state("last_feeding", record)})
+    feeding_analytics_cache.invalidate(record["baby_id"], before["start_time"])
+    feeding_analytics_cache.invalidate(record["baby_id"], record["start_time"])
+    if update_data.keys() & {"start_time", "feeding_type", "amount_ml"}:
+        await feeding_forecaster.record_removed(before)
+        await feeding_forecaster.record_added(record)
+    return FeedingRecord(**record)
+
 @api_router.delete("/feeding/{feeding_id}")
 async def delete_feeding(feeding_id: str, request: Request):
     """Delete a feeding record"""
     user = await require_auth(request)
     
-    record = await db.feeding_records.find_one({"feeding_id": feeding_id}, {"_id": 0})
-    if not record:
-        raise HTTPException(status_code=404, detail="Record not found")
+    record = await _mutate_record(db.feeding_records, "feeding_id", feeding_id, user, delete=True)
+    await event_store.delete("feeding", feeding_id)
+    single_flight.bump(record["baby_id"])
+    await _recompute_baby_state(record["baby_id"])
+    feeding_analytics_cache.invalidate(record["baby_id"], record["start_time"])
+    await feeding_forecaster.record_removed(record)
+    return {"message": "Feeding record deleted"}
+
+# ==================== Feeding Analytics ====================
+
+FEEDING_ANALYTICS_MAX_DAYS = 365
+
+@api_router.get("/feeding/analytics/{baby_id}")
+async def get_feeding_analytics(baby_id: str, request: Request, date: Optional[str] = None, days: int = 14):
+    """Get inter-feed intervals, side balance, bottle trend and cluster feeding for the days up to `date`"""
+    user = await require_auth(request)
+    
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if not 1 <= days <= FEEDING_ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {FEEDING_ANALYTICS_MAX_DAYS}")
+
+    _, end_date = _day_range(date)
+    start_date = end_date - timedelta(days=days)
+
+    analytics = feeding_analytics_cache.get(baby_id, end_date, days)
+    if analytics is None:
+        _, store = _analytics_sources(request, user)
+        records = await store.find(
+            "feeding", [baby_id], start_date, end_date, projection=FEEDING_PROJECTION
+        ).to_list(None)
+        analytics = analyze_feedings(records, start_date, days)
+        feeding_analytics_cache.put(baby_id, end_date, days, analytics)
+
+    return {
+        "baby_id": baby_id,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "days": days,
+        **analytics
+    }
+
+# ==================== Feeding Forecast ====================
+
+def _age_in_months(baby: dict) -> float:
+    birth_date = read_date(baby.get("birth_date"))
+    if birth_date is None:
+        # Stored before birth dates were validated; the age-based priors need one
+        raise HTTPException(status_code=422, detail="The baby's birth date is not a valid date (YYYY-MM-DD)")
+    return (datetime.now(timezone.utc).date() - birth_date).days / 30
+
+@api_router.get("/feeding/forecast/{baby_id}", response_model=FeedingForecast)
+async def get_feeding_forecast(baby_id: str, request: Request):
+    """Predict the next feed time and amount from the baby's recent feeding pattern"""
+    user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, record["baby_id"]):
+    if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    await db.feeding_records.delete_one({"feeding_id": feeding_id})
-    return {"message": "Feeding record deleted"}
+    source, _ = _analytics_sources(request, user)
+    baby, states, model = await asyncio.gather(
+        source.babies.find_one({"baby_id": baby_id}, {"_id": 0, "photo": 0}),
+        _load_baby_states([baby_id], source),
+        feeding_forecaster.load(baby_id, source),
+    )
+    if not baby:
+        raise HTTPException(status_code=404, detail="Baby not found")
+    
+    return FeedingForecast(**forecast_feeding(
+        model, states[baby_id].get("last_feeding"), _age_in_months(baby), datetime.now(timezone.utc)
+    ))
 
 # ==================== Sleep Routes ====================
 
@@ -508,22 +1158,29 @@ async def create_sleep(sleep_data: SleepCreate, request: Request):
     """Create a sleep record"""
     user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, sleep_data.baby_id):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    sleep = SleepRecord(
-        baby_id=sleep_data.baby_id,
-        user_id=user.user_id,
-        sleep_type=sleep_data.sleep_type,
-        start_time=datetime.fromisoformat(sleep_data.start_time.replace('Z', '+00:00')),
-        end_time=datetime.fromisoformat(sleep_data.end_time.replace('Z', '+00:00')) if sleep_data.end_time else None,
-        duration_minutes=sleep_data.duration_minutes,
-        quality=sleep_data.quality,
-        notes=sleep_data.notes
-    )
+    async def create():
+        if not await check_baby_access(user.user_id, sleep_data.baby_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        sleep = SleepRecord(
+            baby_id=sleep_data.baby_id,
+            user_id=user.user_id,
+            sleep_type=sleep_data.sleep_type,
+            start_time=datetime.fromisoformat(sleep_data.start_time.replace('Z', '+00:00')),
+            end_time=datetime.fromisoformat(sleep_data.end_time.replace('Z', '+00:00')) if sleep_data.end_time else None,
+            duration_minutes=sleep_data.duration_minutes,
+            quality=sleep_data.quality,
+            notes=sleep_data.notes
+        )
+        
+        await write_buffer.insert(db.sleep_records, sleep.dict())
+        await event_store.insert("sleep", sleep.dict())
+        single_flight.bump(sleep.baby_id)
+        state_field = "last_sleep" if sleep.end_time else "ongoing_sleep"
+        await _update_baby_state(sleep.baby_id, {state_field: _newer_state(state_field, sleep.dict())})
+        return sleep
     
-    await db.sleep_records.insert_one(sleep.dict())
-    return sleep
+    return await run_idempotent(request, user, create)
 
 @api_router.get("/sleep/{baby_id}", response_model=List[SleepRecord])
 async def get_sleep_records(baby_id: str, request: Request, date: Optional[str] = None):
@@ -533,29 +1190,19 @@ async def get_sleep_records(baby_id: str, request: Request, date: Optional[str]
     if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    query = {"baby_id": baby_id}
+    start_date, end_date = _day_range(date) if date else (None, None)
     
-    if date:
-        start_date = datetime.fromisoformat(date)
-        end_date = start_date + timedelta(days=1)
-        query["start_time"] = {"$gte": start_date, "$lt": end_date}
-    
-    records = await db.sleep_records.find(query, {"_id": 0}).sort("start_time", -1).to_list(100)
+    records = await event_store.find(
+        "sleep", [baby_id], start_date, end_date, newest_first=True
+    ).to_list(100)
     return [SleepRecord(**record) for record in records]
 
 @api_router.put("/sleep/{sleep_id}", response_model=SleepRecord)
 async def update_sleep(sleep_id: str, sleep_data: SleepCreate, request: Request):
-    """Update a sleep record (to add end time)"""
+    """Update a sleep record (to add end time or correct its start)"""
     user = await require_auth(request)
     
-    record = await db.sleep_records.find_one({"sleep_id": sleep_id}, {"_id": 0})
-    if not record:
-        raise HTTPException(status_code=404, detail="Record not found")
-    
-    if not await check_baby_access(user.user_id, record["baby_id"]):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    update_data = {}
+    update_data = {"start_time": datetime.fromisoformat(sleep_data.start_time.replace('Z', '+00:00'))}
     if sleep_data.end_time:
         update_data["end_time"] = datetime.fromisoformat(sleep_data.end_time.replace('Z', '+00:00'))
     if sleep_data.duration_minutes:
@@ -564,99 +1211,116 @@ async def update_sleep(sleep_id: str, sleep_data: SleepCreate, request: Request)
         update_data["quality"] = sleep_data.quality
     if sleep_data.notes:
         update_data["notes"] = sleep_data.notes
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
-    if update_data:
-        await db.sleep_records.update_one(
-            {"sleep_id": sleep_id},
-            {"$set": update_data}
-        )
+    # The previous times tell whether the baby's last/ongoing sleep may have changed
+    before = await _mutate_record(
+        db.sleep_records, "sleep_id", sleep_id, user, {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
+    )
+    record = {**before, **update_data}
     
-    updated_record = await db.sleep_records.find_one({"sleep_id": sleep_id}, {"_id": 0})
-    return SleepRecord(**updated_record)
+    await event_store.replace("sleep", record)
+    single_flight.bump(record["baby_id"])
+    if any(
+        before.get(field) is None or _as_utc(before[field]) != _as_utc(update_data[field])
+        for field in update_data.keys() & {"start_time", "end_time"}
+    ):
+        await _recompute_baby_state(record["baby_id"])
+    return SleepRecord(**record)
 
 @api_router.delete("/sleep/{sleep_id}")
 async def delete_sleep(sleep_id: str, request: Request):
     """Delete a sleep record"""
     user = await require_auth(request)
     
-    record = await db.sleep_records.find_one({"sleep_id": sleep_id}, {"_id": 0})
-    if not record:
-        raise HTTPException(status_code=404, detail="Record not found")
-    
-    if not await check_baby_access(user.user_id, record["baby_id"]):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    await db.sleep_records.delete_one({"sleep_id": sleep_id})
+    record = await _mutate_record(db.sleep_records, "sleep_id", sleep_id, user, delete=True)
+    await event_store.delete("sleep", sleep_id)
+    single_flight.bump(record["baby_id"])
+    await _recompute_baby_state(record["baby_id"])
     return {"message": "Sleep record deleted"}
 
-# ==================== Sleep Prediction ====================
+# ==================== Sleep Chart ====================
 
-@api_router.get("/sleep/prediction/{baby_id}", response_model=SleepPrediction)
-async def get_sleep_prediction(baby_id: str, request: Request):
-    """Get sleep prediction based on baby's sleep patterns"""
+SLEEP_CHART_MAX_DAYS = 92
+
+@api_router.get("/sleep/chart/{baby_id}")
+async def get_sleep_chart(baby_id: str, request: Request, date: Optional[str] = None, days: int = 7,
+                          tz_offset_minutes: int = 0):
+    """Get per-day sleep totals, day/night split, longest stretch, wake windows and asleep segments.
+
+    Days are local days ending with `date`; `tz_offset_minutes` is the client's offset from UTC.
+    """
     user = await require_auth(request)
-    
+
     if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Get baby's age
-    baby = await db.babies.find_one({"baby_id": baby_id}, {"_id": 0})
-    if not baby:
-        raise HTTPException(status_code=404, detail="Baby not found")
-    
-    birth_date = datetime.fromisoformat(baby["birth_date"])
-    age_days = (datetime.now(timezone.utc).replace(tzinfo=None) - birth_date).days
-    age_months = age_days / 30
-    
-    # Get recent sleep records (last 7 days)
-    week_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    recent_sleep = await db.sleep_records.find(
-        {"baby_id": baby_id, "start_time": {"$gte": week_ago}},
-        {"_id": 0}
-    ).sort("start_time", -1).to_list(100)
-    
-    # Calculate average wake window based on age and recent patterns
+
+    if not 1 <= days <= SLEEP_CHART_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {SLEEP_CHART_MAX_DAYS}")
+
+    if date:
+        window_end = datetime.fromisoformat(date) + timedelta(days=1)
+    else:
+        local_now = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=tz_offset_minutes)
+        window_end = local_now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    window_start = window_end - timedelta(days=days)
+
+    # Query in UTC
+    offset = timedelta(minutes=tz_offset_minutes)
+    _, store = _analytics_sources(request, user)
+    records = await store.find_overlapping(
+        "sleep", [baby_id], window_start - offset - SLEEP_CONTEXT, window_end - offset,
+        MAX_SLEEP_DURATION, SLEEP_PROJECTION
+    ).to_list(None)
+
+    return {
+        "baby_id": baby_id,
+        "tz_offset_minutes": tz_offset_minutes,
+        "days": account_sleep(records, window_start, days, utc_offset_minutes=tz_offset_minutes,
+                              include_segments=True)
+    }
+
+# ==================== Sleep Prediction ====================
+
+def _wake_window_for_age(age_months: float):
+    """Return (base wake window, recommended nap duration) in minutes for an age"""
     if age_months < 3:
-        base_wake_window = 60  # 1 hour
-        recommended_duration = 45
+        return 60, 45  # 1 hour
     elif age_months < 6:
-        base_wake_window = 90  # 1.5 hours
-        recommended_duration = 60
+        return 90, 60  # 1.5 hours
     elif age_months < 9:
-        base_wake_window = 120  # 2 hours
-        recommended_duration = 75
+        return 120, 75  # 2 hours
     elif age_months < 12:
-        base_wake_window = 150  # 2.5 hours
-        recommended_duration = 90
-    else:
-        base_wake_window = 180  # 3 hours
-        recommended_duration = 90
-    
-    # Adjust based on recent patterns
-    if recent_sleep:
-        # Find the last sleep end time
-        last_sleep = None
-        for sleep in recent_sleep:
-            if sleep.get("end_time"):
-                last_sleep = sleep
-                break
+        return 150, 90  # 2.5 hours
+    return 180, 90  # 3 hours
+
+def _predict_next_nap(baby: dict, state: dict) -> SleepPrediction:
+    """Predict the next nap from a baby document and its current state"""
+    age_months = _age_in_months(baby)
+    
+    # Calculate average wake window based on age and recent patterns
+    base_wake_window, recommended_duration = _wake_window_for_age(age_months)
+    
+    # Adjust based on recent patterns (last 7 days)
+    week_ago = datetime.now(timezone.utc) - timedelta(days=7)
+    last_sleep = state.get("last_sleep")
+    ongoing_sleep = state.get("ongoing_sleep")
+    
+    if last_sleep and _as_utc(last_sleep["start_time"]) >= week_ago:
+        last_wake_time = _as_utc(last_sleep["end_time"])
         
-        if last_sleep and last_sleep.get("end_time"):
-            last_wake_time = last_sleep["end_time"]
-            if last_wake_time.tzinfo is None:
-                last_wake_time = last_wake_time.replace(tzinfo=timezone.utc)
-            
-            next_nap_time = last_wake_time + timedelta(minutes=base_wake_window)
-            
-            # If prediction is in the past, calculate from now
-            if next_nap_time < datetime.now(timezone.utc):
-                next_nap_time = datetime.now(timezone.utc) + timedelta(minutes=30)
-            
-            confidence = 0.75
-        else:
-            # No end time recorded, estimate from now
-            next_nap_time = datetime.now(timezone.utc) + timedelta(minutes=base_wake_window // 2)
-            confidence = 0.5
+        next_nap_time = last_wake_time + timedelta(minutes=base_wake_window)
+        
+        # If prediction is in the past, calculate from now
+        if next_nap_time < datetime.now(timezone.utc):
+            next_nap_time = datetime.now(timezone.utc) + timedelta(minutes=30)
+        
+        confidence = 0.75
+    elif ongoing_sleep and _as_utc(ongoing_sleep["start_time"]) >= week_ago:
+        # No end time recorded, estimate from now
+        next_nap_time = datetime.now(timezone.utc) + timedelta(minutes=base_wake_window // 2)
+        confidence = 0.5
     else:
         # No recent data, use default
         next_nap_time = datetime.now(timezone.utc) + timedelta(minutes=base_wake_window)
@@ -669,26 +1333,60 @@ async def get_sleep_prediction(baby_id: str, request: Request):
         wake_window_minutes=base_wake_window
     )
 
+@api_router.get("/sleep/prediction/{baby_id}", response_model=SleepPrediction)
+async def get_sleep_prediction(baby_id: str, request: Request):
+    """Get sleep prediction based on baby's sleep patterns"""
+    user = await require_auth(request)
+    
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    # Get baby's age and last sleep state
+    source, _ = _analytics_sources(request, user)
+    
+    async def predict():
+        baby, states = await asyncio.gather(
+            source.babies.find_one({"baby_id": baby_id}, {"_id": 0, "photo": 0}),
+            _load_baby_states([baby_id], source),
+        )
+        if not baby:
+            raise HTTPException(status_code=404, detail="Baby not found")
+        return _predict_next_nap(baby, states[baby_id])
+    
+    return await single_flight.run(baby_id, ("sleep_prediction", source is db), predict)
+
 # ==================== Diaper Routes ====================
 
+def _diaper_state_fields(record: dict) -> dict:
+    fields = {"last_diaper": _newer_state("last_diaper", record)}
+    if record["diaper_type"] in WET_DIAPER_TYPES:
+        fields["last_wet_diaper"] = _newer_state("last_wet_diaper", record)
+    return fields
+
 @api_router.post("/diaper", response_model=DiaperRecord)
 async def create_diaper(diaper_data: DiaperCreate, request: Request):
     """Create a diaper record"""
     user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, diaper_data.baby_id):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    diaper = DiaperRecord(
-        baby_id=diaper_data.baby_id,
-        user_id=user.user_id,
-        diaper_type=diaper_data.diaper_type,
-        time=datetime.fromisoformat(diaper_data.time.replace('Z', '+00:00')),
-        notes=diaper_data.notes
-    )
+    async def create():
+        if not await check_baby_access(user.user_id, diaper_data.baby_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        diaper = DiaperRecord(
+            baby_id=diaper_data.baby_id,
+            user_id=user.user_id,
+            diaper_type=diaper_data.diaper_type,
+            time=datetime.fromisoformat(diaper_data.time.replace('Z', '+00:00')),
+            notes=diaper_data.notes
+        )
+        
+        await write_buffer.insert(db.diaper_records, diaper.dict())
+        await event_store.insert("diaper", diaper.dict())
+        single_flight.bump(diaper.baby_id)
+        await _update_baby_state(diaper.baby_id, _diaper_state_fields(diaper.dict()))
+        return diaper
     
-    await db.diaper_records.insert_one(diaper.dict())
-    return diaper
+    return await run_idempotent(request, user, create)
 
 @api_router.get("/diaper/{baby_id}", response_model=List[DiaperRecord])
 async def get_diapers(baby_id: str, request: Request, date: Optional[str] = None):
@@ -698,29 +1396,40 @@ async def get_diapers(baby_id: str, request: Request, date: Optional[str] = None
     if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    query = {"baby_id": baby_id}
+    start_date, end_date = _day_range(date) if date else (None, None)
     
-    if date:
-        start_date = datetime.fromisoformat(date)
-        end_date = start_date + timedelta(days=1)
-        query["time"] = {"$gte": start_date, "$lt": end_date}
-    
-    records = await db.diaper_records.find(query, {"_id": 0}).sort("time", -1).to_list(100)
+    records = await event_store.find(
+        "diaper", [baby_id], start_date, end_date, newest_first=True
+    ).to_list(100)
     return [DiaperRecord(**record) for record in records]
 
+@api_router.put("/diaper/{diaper_id}", response_model=DiaperRecord)
+async def update_diaper(diaper_id: str, diaper_data: DiaperUpdate, request: Request):
+    """Update fields of a diaper record"""
+    user = await require_auth(request)
+    
+    update_data = _update_fields(diaper_data, ("time",), ("diaper_type", "time"))
+    record = await _mutate_record(
+        db.diaper_records, "diaper_id", diaper_id, user, {"$set": update_data} if update_data else None
+    )
+    if update_data:
+        await event_store.replace("diaper", record)
+        single_flight.bump(record["baby_id"])
+        if update_data.keys() & {"time", "diaper_type"}:
+            await _recompute_baby_state(record["baby_id"])
+        else:
+            await _update_baby_state(record["baby_id"], _diaper_state_fields(record))
+    return DiaperRecord(**record)
+
 @api_router.delete("/diaper/{diaper_id}")
 async def delete_diaper(diaper_id: str, request: Request):
     """Delete a diaper record"""
     user = await require_auth(request)
     
-    record = await db.diaper_records.find_one({"diaper_id": diaper_id}, {"_id": 0})
-    if not record:
-        raise HTTPException(status_code=404, detail="Record not found")
-    
-    if not await check_baby_access(user.user_id, record["baby_id"]):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    await db.diaper_records.delete_one({"diaper_id": diaper_id})
+    record = await _mutate_record(db.diaper_records, "diaper_id", diaper_id, user, delete=True)
+    await event_store.delete("diaper", diaper_id)
+    single_flight.bump(record["baby_id"])
+    await _recompute_baby_state(record["baby_id"])
     return {"message": "Diaper record deleted"}
 
 # ==================== Growth Routes ====================
@@ -730,21 +1439,24 @@ async def create_growth(growth_data: GrowthCreate, request: Request):
     """Create a growth record"""
     user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, growth_data.baby_id):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    growth = GrowthRecord(
-        baby_id=growth_data.baby_id,
-        user_id=user.user_id,
-        date=growth_data.date,
-        weight_kg=growth_data.weight_kg,
-        height_cm=growth_data.height_cm,
-        head_circumference_cm=growth_data.head_circumference_cm,
-        notes=growth_data.notes
-    )
+    async def create():
+        if not await check_baby_access(user.user_id, growth_data.baby_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        growth = GrowthRecord(
+            baby_id=growth_data.baby_id,
+            user_id=user.user_id,
+            date=growth_data.date,
+            weight_kg=growth_data.weight_kg,
+            height_cm=growth_data.height_cm,
+            head_circumference_cm=growth_data.head_circumference_cm,
+            notes=growth_data.notes
+        )
+        
+        await db.growth_records.insert_one({**growth.dict(), "date": _stored_date(growth.date, "date")})
+        return growth
     
-    await db.growth_records.insert_one(growth.dict())
-    return growth
+    return await run_idempotent(request, user, create)
 
 @api_router.get("/growth/{baby_id}", response_model=List[GrowthRecord])
 async def get_growth_records(baby_id: str, request: Request):
@@ -754,56 +1466,296 @@ async def get_growth_records(baby_id: str, request: Request):
     if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    records = await db.growth_records.find(
-        {"baby_id": baby_id},
-        {"_id": 0}
-    ).sort("date", -1).to_list(100)
+    # Until migration 2 has run, string dates sort apart from converted ones. Range
+    # filters only match values of their own type, so take the newest of each.
+    newest = await asyncio.gather(*(
+        db.growth_records.find(
+            {"baby_id": baby_id, "date": {"$gte": lowest}},
+            {"_id": 0}
+        ).sort("date", -1).to_list(100)
+        for lowest in ("", datetime.min)
+    ))
+    records = [record for group in newest for record in group]
+    records.sort(key=lambda record: read_date(record["date"]) or datetime.min.date(), reverse=True)
+    
+    return [GrowthRecord(**record) for record in records[:100]]
+
+@api_router.put("/growth/{growth_id}", response_model=GrowthRecord)
+async def update_growth(growth_id: str, growth_data: GrowthUpdate, request: Request):
+    """Update fields of a growth record"""
+    user = await require_auth(request)
     
-    return [GrowthRecord(**record) for record in records]
+    update_data = _update_fields(growth_data, required=("date",))
+    if "date" in update_data:
+        update_data["date"] = _stored_date(update_data["date"], "date")
+    record = await _mutate_record(
+        db.growth_records, "growth_id", growth_id, user, {"$set": update_data} if update_data else None
+    )
+    return GrowthRecord(**record)
 
 @api_router.delete("/growth/{growth_id}")
 async def delete_growth(growth_id: str, request: Request):
     """Delete a growth record"""
     user = await require_auth(request)
     
-    record = await db.growth_records.find_one({"growth_id": growth_id}, {"_id": 0})
-    if not record:
-        raise HTTPException(status_code=404, detail="Record not found")
-    
-    if not await check_baby_access(user.user_id, record["baby_id"]):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    await db.growth_records.delete_one({"growth_id": growth_id})
+    await _mutate_record(db.growth_records, "growth_id", growth_id, user, delete=True)
     return {"message": "Growth record deleted"}
 
-# ==================== Timeline Routes ====================
-
-@api_router.get("/timeline/{baby_id}")
-async def get_timeline(baby_id: str, request: Request, date: Optional[str] = None):
-    """Get timeline of all activities for a baby"""
+# ==================== Import Routes ====================
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 50
+# A running import that has not checkpointed for this long is assumed abandoned
+IMPORT_LEASE = timedelta(minutes=2)
+
+# record_type -> (create model, record model, collection, id field)
+IMPORT_TYPES = {
+    "feeding": (FeedingCreate, FeedingRecord, "feeding_records", "feeding_id"),
+    "sleep": (SleepCreate, SleepRecord, "sleep_records", "sleep_id"),
+    "diaper": (DiaperCreate, DiaperRecord, "diaper_records", "diaper_id"),
+    "growth": (GrowthCreate, GrowthRecord, "growth_records", "growth_id"),
+}
+
+def _import_record(record_type: str, baby_id: str, user_id: str, fields: dict, ordinal: int = 0) -> dict:
+    """Validate mapped fields with the Create model and build the stored record"""
+    create_model, record_model, _, id_field = IMPORT_TYPES[record_type]
+    data = create_model(baby_id=baby_id, **fields).dict()
+    for field in ("start_time", "end_time", "time"):
+        if data.get(field):
+            data[field] = datetime.fromisoformat(data[field])
+    data[id_field] = csv_import.record_id(record_type, baby_id, fields, ordinal)
+    record = record_model(user_id=user_id, **data).dict()
+    if record_type == "growth":
+        record["date"] = stored_date(record["date"])
+    return record
+
+async def _claim_import(import_id: str, user: User, baby_id: str) -> dict:
+    """Start or resume an import; return its checkpoint"""
+    now = datetime.now(timezone.utc)
+    checkpoint = {
+        "_id": import_id, "user_id": user.user_id, "baby_id": baby_id, "status": "running",
+        "rows_done": 0, "inserted": {}, "duplicates": {}, "created_at": now, "updated_at": now
+    }
+    try:
+        await db.imports.insert_one(checkpoint)
+        return checkpoint
+    except DuplicateKeyError:
+        pass
+    
+    existing = await db.imports.find_one({"_id": import_id})
+    if existing["user_id"] != user.user_id or existing["baby_id"] != baby_id:
+        raise HTTPException(status_code=409, detail="import_id already used for a different import")
+    if existing["status"] == "done":
+        return existing
+    updated_at = existing["updated_at"]
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    if existing["status"] == "running" and updated_at > now - IMPORT_LEASE:
+        raise HTTPException(status_code=409, detail="This import is still running")
+    taken = await db.imports.update_one(
+        {"_id": import_id, "updated_at": existing["updated_at"]},
+        {"$set": {"status": "running", "updated_at": now}}
+    )
+    if not taken.modified_count:
+        raise HTTPException(status_code=409, detail="This import is still running")
+    return existing
+
+async def _write_import_batch(record_type: str, records: List[dict], dry_run: bool) -> int:
+    """Insert the records not stored yet; returns how many were new.
+    
+    Ids come from row content and are unique-indexed, so rows a retried or
+    concurrent import already stored are skipped. Stored rows still missing
+    their event (a crash between the two writes) are mirrored again.
+    """
+    _, _, collection_name, id_field = IMPORT_TYPES[record_type]
+    collection = db[collection_name]
+    by_id = {record[id_field]: record for record in records}
+    stored = await collection.find({id_field: {"$in": list(by_id)}}, {"_id": 0}).to_list(None)
+    for doc in stored:
+        by_id.pop(doc[id_field], None)
+    new = list(by_id.values())
+    if dry_run:
+        return len(new)
+    
+    inserted = len(new)
+    if new:
+        try:
+            await collection.insert_many(new, ordered=False)
+        except BulkWriteError as error:
+            if any(e["code"] != 11000 for e in error.details["writeErrors"]):
+                raise
+            inserted = error.details["nInserted"]
+    if record_type in EVENT_TYPES:
+        await event_store.insert_missing(record_type, stored + new)
+    return inserted
+
+@api_router.post("/import/{baby_id}")
+async def import_csv(baby_id: str, request: Request, record_type: str = "auto", dry_run: bool = False,
+                     import_id: Optional[str] = None, tz_offset_minutes: int = 0):
+    """Import records from a CSV body (Content-Type: text/csv), streamed in batches.
+    
+    `record_type` is feeding, sleep, diaper, growth, or auto to read it from a
+    type/activity column. Times without an offset are local at `tz_offset_minutes`.
+    With `dry_run` nothing is written and the report shows what would be.
+    Re-sending the file with the returned `import_id` continues after the last
+    committed batch; rows imported before are recognised either way.
+    """
     user = await require_auth(request)
-    
     if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
-    
-    timeline = []
-    
-    # Set date range
+    if record_type != "auto" and record_type not in IMPORT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown record_type: {record_type}")
+    
+    checkpoint = {"rows_done": 0, "inserted": {}, "duplicates": {}}
+    if not dry_run:
+        import_id = import_id or f"imp_{uuid.uuid4().hex[:12]}"
+        checkpoint = await _claim_import(import_id, user, baby_id)
+        if checkpoint["status"] == "done":
+            return checkpoint["report"]
+    
+    inserted: Dict[str, int] = dict(checkpoint["inserted"])
+    duplicates: Dict[str, int] = dict(checkpoint["duplicates"])
+    valid: Dict[str, int] = {}
+    errors: List[dict] = []
+    error_count = 0
+    rows = 0
+    header = None
+    columns: Dict[str, int] = {}
+    unmapped: List[str] = []
+    pending: Dict[str, List[dict]] = {}
+    pending_count = 0
+    # Content id -> identical rows seen so far, counted from the first row so resumed imports agree
+    occurrences: Dict[str, int] = {}
+    
+    async def flush(rows_done: int):
+        nonlocal pending_count
+        for kind, records in pending.items():
+            new = await _write_import_batch(kind, records, dry_run)
+            inserted[kind] = inserted.get(kind, 0) + new
+            duplicates[kind] = duplicates.get(kind, 0) + len(records) - new
+        pending.clear()
+        pending_count = 0
+        if not dry_run:
+            await db.imports.update_one({"_id": import_id}, {"$set": {
+                "rows_done": rows_done, "inserted": inserted, "duplicates": duplicates,
+                "updated_at": datetime.now(timezone.utc)
+            }})
+    
+    try:
+        # Row numbers count the header as row 1, as spreadsheets do
+        async for row in csv_import.read_rows(request.stream()):
+            if header is None:
+                header = row
+                columns, unmapped = csv_import.map_columns(header)
+                continue
+            if not any(cell.strip() for cell in row):
+                continue
+            rows += 1
+            row_number = rows + 1
+            done = row_number <= checkpoint["rows_done"]
+            
+            values = {field: row[index] for field, index in columns.items() if index < len(row)}
+            kind = record_type if record_type != "auto" else csv_import.record_type_of(values)
+            try:
+                if kind is None:
+                    raise ValueError("Unknown record type")
+                fields = csv_import.map_row(kind, values, tz_offset_minutes)
+                content_id = csv_import.record_id(kind, baby_id, fields)
+                ordinal = occurrences.get(content_id, 0)
+                occurrences[content_id] = ordinal + 1
+                if done:
+                    continue
+                record = _import_record(kind, baby_id, user.user_id, fields, ordinal)
+            except (ValueError, ValidationError) as e:
+                if done:
+                    continue
+                error_count += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    message = e.errors()[0]["msg"] if isinstance(e, ValidationError) else str(e)
+                    errors.append({"row": row_number, "error": message})
+                continue
+            
+            valid[kind] = valid.get(kind, 0) + 1
+            pending.setdefault(kind, []).append(record)
+            pending_count += 1
+            if pending_count >= IMPORT_BATCH_SIZE:
+                await flush(row_number)
+        
+        if header is None:
+            raise HTTPException(status_code=400, detail="Empty CSV: a header row is required")
+        await flush(rows + 1)
+    except ValueError as e:
+        if not dry_run:
+            await db.imports.update_one({"_id": import_id}, {"$set": {"status": "failed"}})
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        if not dry_run:
+            await db.imports.update_one({"_id": import_id}, {"$set": {"status": "interrupted"}})
+        raise
+    
+    report = {
+        "import_id": import_id,
+        "dry_run": dry_run,
+        "rows": rows,
+        "resumed_after_row": checkpoint["rows_done"] or None,
+        "valid": valid,
+        "inserted": inserted,
+        "duplicates": duplicates,
+        "error_count": error_count,
+        "errors": errors,
+        "columns": {header[index]: field for field, index in columns.items()},
+        "unmapped_columns": unmapped,
+    }
+    if dry_run:
+        report["would_insert"] = report.pop("inserted")
+        return report
+    
+    # Derived state is rebuilt once for the whole import instead of per record
+    if any(inserted.values()):
+        await _recompute_baby_state(baby_id)
+        single_flight.bump(baby_id)
+        feeding_analytics_cache.invalidate(baby_id)
+        if inserted.get("feeding"):
+            await feeding_forecaster.invalidate(baby_id)
+    await db.imports.update_one({"_id": import_id}, {"$set": {
+        "status": "done", "report": report, "updated_at": datetime.now(timezone.utc)
+    }})
+    return report
+
+# ==================== Timeline Routes ====================
+
+def _day_range(date: Optional[str]):
+    """Return the [start, end) range for an ISO date, defaulting to today (UTC)"""
     if date:
         start_date = datetime.fromisoformat(date)
     else:
         start_date = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     
-    end_date = start_date + timedelta(days=1)
+    return start_date, start_date + timedelta(days=1)
+
+async def _fetch_timelines(baby_ids: List[str], start_date: datetime, end_date: datetime) -> dict:
+    """Build the activity timeline of several babies with one $in-batched query per record type"""
+    # The window is one day, so each type is read whole and limited per baby
+    # below; a busy baby can't crowd the others out of the result
+    def latest(event_type: str):
+        return event_store.find(event_type, baby_ids, start_date, end_date, newest_first=True).to_list(None)
+
+    def limited(records: list, limit: int = 100) -> list:
+        kept, counts = [], {}
+        for record in records:
+            counts[record["baby_id"]] = counts.get(record["baby_id"], 0) + 1
+            if counts[record["baby_id"]] <= limit:
+                kept.append(record)
+        return kept
+
+    feedings, sleep_records, diapers = (
+        limited(records) for records in await asyncio.gather(latest("feeding"), latest("sleep"), latest("diaper"))
+    )
     
-    # Get feeding records
-    feedings = await db.feeding_records.find(
-        {"baby_id": baby_id, "start_time": {"$gte": start_date, "$lt": end_date}},
-        {"_id": 0}
-    ).to_list(100)
+    timelines = {baby_id: [] for baby_id in baby_ids}
     
     for f in feedings:
-        timeline.append({
+        timelines[f["baby_id"]].append({
             "entry_id": f["feeding_id"],
             "entry_type": "feeding",
             "time": f["start_time"],
@@ -811,14 +1763,8 @@ async def get_timeline(baby_id: str, request: Request, date: Optional[str] = Non
             "created_by": f["user_id"]
         })
     
-    # Get sleep records
-    sleep_records = await db.sleep_records.find(
-        {"baby_id": baby_id, "start_time": {"$gte": start_date, "$lt": end_date}},
-        {"_id": 0}
-    ).to_list(100)
-    
     for s in sleep_records:
-        timeline.append({
+        timelines[s["baby_id"]].append({
             "entry_id": s["sleep_id"],
             "entry_type": "sleep",
             "time": s["start_time"],
@@ -826,14 +1772,8 @@ async def get_timeline(baby_id: str, request: Request, date: Optional[str] = Non
             "created_by": s["user_id"]
         })
     
-    # Get diaper records
-    diapers = await db.diaper_records.find(
-        {"baby_id": baby_id, "time": {"$gte": start_date, "$lt": end_date}},
-        {"_id": 0}
-    ).to_list(100)
-    
     for d in diapers:
-        timeline.append({
+        timelines[d["baby_id"]].append({
             "entry_id": d["diaper_id"],
             "entry_type": "diaper",
             "time": d["time"],
@@ -842,12 +1782,248 @@ async def get_timeline(baby_id: str, request: Request, date: Optional[str] = Non
         })
     
     # Sort by time (most recent first)
-    timeline.sort(key=lambda x: x["time"], reverse=True)
+    for timeline in timelines.values():
+        timeline.sort(key=lambda x: x["time"], reverse=True)
+    
+    return timelines
+
+@api_router.get("/timeline/{baby_id}")
+async def get_timeline(baby_id: str, request: Request, date: Optional[str] = None):
+    """Get timeline of all activities for a baby"""
+    user = await require_auth(request)
+    
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    start_date, end_date = _day_range(date)
+    
+    async def fetch():
+        timelines = await _fetch_timelines([baby_id], start_date, end_date)
+        return timelines[baby_id]
+    
+    return await single_flight.run(baby_id, ("timeline", start_date), fetch)
+
+# ==================== Search Routes ====================
+
+# entry type -> (collection, id field, time field, text-indexed fields)
+SEARCHABLE = {
+    "feeding": ("feeding_records", "feeding_id", "start_time", ["notes", "food_type"]),
+    "sleep": ("sleep_records", "sleep_id", "start_time", ["notes"]),
+    "diaper": ("diaper_records", "diaper_id", "time", ["notes"]),
+    "growth": ("growth_records", "growth_id", "date", ["notes"]),
+}
+SEARCH_MAX_LIMIT = 100
+
+def _search_time(entry_type: str, record: dict) -> datetime:
+    value = record[SEARCHABLE[entry_type][2]]
+    # Growth records not yet migrated carry an ISO date string
+    return datetime.fromisoformat(value[:10]) if isinstance(value, str) else value
+
+def _encode_search_cursor(entry: dict, sort: str) -> str:
+    key = {"m": sort, "s": entry["score"], "t": entry["time"].isoformat(), "e": entry["entry_type"],
+           "i": entry["entry_id"]}
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def _decode_search_cursor(cursor: str, sort: str) -> dict:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key["t"] = datetime.fromisoformat(key["t"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if key.get("m") != sort:
+        raise HTTPException(status_code=400, detail="Cursor belongs to a different sort order")
+    return key
+
+def _search_after(entry_type: str, key: dict) -> dict:
+    """Filter for entries after `key` in (score, time, entry type, id) descending order"""
+    _, id_field, time_field, _ = SEARCHABLE[entry_type]
+    after_time = key["t"]
+    if entry_type == "growth":
+        # A growth entry sorts at midnight of its date, stored as a string or a date
+        day = after_time.date().isoformat()
+        at_midnight = after_time == after_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        before = "$lt" if at_midnight else "$lte"
+        earlier = {"$or": [{time_field: {before: day}}, {time_field: {before: stored_date(day)}}]}
+        same_time = {"$or": [{time_field: day}, {time_field: stored_date(day)}]} if at_midnight else None
+    else:
+        earlier = {time_field: {"$lt": after_time}}
+        same_time = {time_field: after_time}
+    
+    # At equal times, types are ordered by name and ids within a type
+    if entry_type < key["e"]:
+        ties = {}
+    elif entry_type == key["e"]:
+        ties = {id_field: {"$lt": key["i"]}}
+    else:
+        ties = None
+    branches = [earlier] + ([{**same_time, **ties}] if same_time is not None and ties is not None else [])
+    
+    if key["s"] is None:
+        return {"$or": branches}
+    return {"$or": [{"score": {"$lt": key["s"]}}] + [{"score": key["s"], **branch} for branch in branches]}
+
+async def _search_collection(entry_type: str, query: str, baby_ids: List[str], sort: str,
+                             after: Optional[dict], limit: int) -> List[dict]:
+    collection_name, id_field, time_field, fields = SEARCHABLE[entry_type]
+    pipeline = [
+        {"$match": {"$text": {"$search": query}, "baby_id": {"$in": baby_ids}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after:
+        pipeline.append({"$match": _search_after(entry_type, after)})
+    order = {time_field: -1, id_field: -1}
+    pipeline += [
+        {"$sort": {"score": -1, **order} if sort == "relevance" else order},
+        {"$limit": limit},
+        {"$project": {"_id": 0}},
+    ]
+    records = await db[collection_name].aggregate(pipeline).to_list(limit)
+    
+    if entry_type in EVENT_TYPES:
+        # Archived months have no text index; their buckets are scored in memory
+        archived = await event_store.archive.search(
+            entry_type, baby_ids, fields, query, after["t"] if after and sort == "time" else None
+        )
+        if after:
+            archived = [r for r in archived if match_query(r, _search_after(entry_type, after))]
+        # A record being archived is briefly in both places
+        hot_ids = {r[id_field] for r in records}
+        records += [r for r in archived if r[id_field] not in hot_ids]
+        records.sort(key=lambda r: (r["score"] if sort == "relevance" else 0, r[time_field], r[id_field]),
+                     reverse=True)
+        del records[limit:]
+    
+    entries = []
+    for record in records:
+        score = record.pop("score")
+        entry_time = _search_time(entry_type, record)
+        if entry_type == "growth":
+            record[time_field] = iso_date(record[time_field])
+        entries.append({
+            "entry_id": record[id_field],
+            "entry_type": entry_type,
+            "baby_id": record["baby_id"],
+            "time": entry_time,
+            "score": score if sort == "relevance" else None,
+            "data": record,
+            "created_by": record.get("user_id")
+        })
+    return entries
+
+@api_router.get("/search")
+async def search_records(request: Request, q: str, baby_id: Optional[str] = None, types: Optional[str] = None,
+                         sort: str = "relevance", limit: int = 20, cursor: Optional[str] = None):
+    """Search the notes (and solid food types) of a user's records"""
+    user = await require_auth(request)
     
-    return timeline
+    query = q.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Search query required")
+    if sort not in ("relevance", "time"):
+        raise HTTPException(status_code=400, detail="sort must be 'relevance' or 'time'")
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+    entry_types = types.split(",") if types else list(SEARCHABLE)
+    if any(t not in SEARCHABLE for t in entry_types):
+        raise HTTPException(status_code=400, detail=f"types must be among {', '.join(SEARCHABLE)}")
+    after = _decode_search_cursor(cursor, sort) if cursor else None
+    
+    if baby_id:
+        if not await check_baby_access(user.user_id, baby_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        baby_ids = [baby_id]
+    else:
+        baby_ids = await accessible_baby_ids(user.user_id)
+    if not baby_ids:
+        return {"results": [], "next_cursor": None}
+    
+    # One more than needed per collection tells whether another page exists
+    per_type = await asyncio.gather(*(
+        _search_collection(t, query, baby_ids, sort, after, limit + 1) for t in entry_types
+    ))
+    entries = [entry for entries in per_type for entry in entries]
+    entries.sort(key=lambda e: (e["score"] or 0, e["time"], e["entry_type"], e["entry_id"]), reverse=True)
+    
+    page = entries[:limit]
+    return {
+        "results": page,
+        "next_cursor": _encode_search_cursor(page[-1], sort) if len(entries) > limit else None
+    }
 
 # ==================== Statistics Routes ====================
 
+async def _fetch_daily_stats(baby_ids: List[str], start_date: datetime, end_date: datetime,
+                             store: EventStore = event_store) -> dict:
+    """Aggregate daily statistics for several babies with one pipeline per collection"""
+    feeding_stages = [
+        {"$group": {
+            "_id": "$baby_id",
+            "count": {"$sum": 1},
+            "total_minutes": {"$sum": {"$ifNull": ["$duration_minutes", 0]}},
+            "total_bottle_ml": {"$sum": {"$cond": [
+                {"$eq": ["$feeding_type", "bottle"]},
+                {"$ifNull": ["$amount_ml", 0]},
+                0
+            ]}}
+        }}
+    ]
+    diaper_stages = [
+        {"$group": {
+            "_id": "$baby_id",
+            "total": {"$sum": 1},
+            "wet": {"$sum": {"$cond": [{"$eq": ["$diaper_type", "wet"]}, 1, 0]}},
+            "dirty": {"$sum": {"$cond": [{"$eq": ["$diaper_type", "dirty"]}, 1, 0]}},
+            "mixed": {"$sum": {"$cond": [{"$eq": ["$diaper_type", "mixed"]}, 1, 0]}}
+        }}
+    ]
+    
+    # Sleeps are counted on every day they overlap, so they are clipped rather than grouped
+    feeding_rows, sleep_records, diaper_rows = await asyncio.gather(
+        store.aggregate("feeding", baby_ids, start_date, end_date, feeding_stages).to_list(None),
+        store.find_overlapping(
+            "sleep", baby_ids, start_date - SLEEP_CONTEXT, end_date, MAX_SLEEP_DURATION, SLEEP_PROJECTION
+        ).to_list(None),
+        store.aggregate("diaper", baby_ids, start_date, end_date, diaper_stages).to_list(None),
+    )
+    
+    feeding_by_baby = {row["_id"]: row for row in feeding_rows}
+    diaper_by_baby = {row["_id"]: row for row in diaper_rows}
+    sleeps_by_baby = {baby_id: [] for baby_id in baby_ids}
+    for record in sleep_records:
+        sleeps_by_baby[record["baby_id"]].append(record)
+    
+    stats = {}
+    for baby_id in baby_ids:
+        feeding = feeding_by_baby.get(baby_id, {})
+        sleep = account_sleep(sleeps_by_baby[baby_id], start_date, 1)[0]
+        diaper = diaper_by_baby.get(baby_id, {})
+        total_sleep_minutes = sleep["total_minutes"]
+        
+        stats[baby_id] = {
+            "date": start_date.isoformat(),
+            "feeding": {
+                "count": feeding.get("count", 0),
+                "total_minutes": feeding.get("total_minutes", 0),
+                "total_bottle_ml": feeding.get("total_bottle_ml", 0)
+            },
+            "sleep": {
+                "count": sleep["sleep_count"],
+                "total_minutes": total_sleep_minutes,
+                "total_hours": round(total_sleep_minutes / 60, 1) if total_sleep_minutes else 0,
+                "day_minutes": sleep["day_minutes"],
+                "night_minutes": sleep["night_minutes"],
+                "longest_stretch_minutes": sleep["longest_stretch_minutes"]
+            },
+            "diaper": {
+                "total": diaper.get("total", 0),
+                "wet": diaper.get("wet", 0),
+                "dirty": diaper.get("dirty", 0),
+                "mixed": diaper.get("mixed", 0)
+            }
+        }
+    
+    return stats
+
 @api_router.get("/stats/{baby_id}")
 async def get_stats(baby_id: str, request: Request, date: Optional[str] = None):
     """Get daily statistics for a baby"""
@@ -856,61 +2032,341 @@ async def get_stats(baby_id: str, request: Request, date: Optional[str] = None):
     if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Set date range
-    if date:
-        start_date = datetime.fromisoformat(date)
-    else:
-        start_date = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date, end_date = _day_range(date)
     
-    end_date = start_date + timedelta(days=1)
+    _, store = _analytics_sources(request, user)
     
-    # Feeding stats
-    feedings = await db.feeding_records.find(
-        {"baby_id": baby_id, "start_time": {"$gte": start_date, "$lt": end_date}},
-        {"_id": 0}
-    ).to_list(100)
+    async def fetch():
+        stats = await _fetch_daily_stats([baby_id], start_date, end_date, store)
+        return stats[baby_id]
     
-    feeding_count = len(feedings)
-    total_feeding_minutes = sum(f.get("duration_minutes", 0) or 0 for f in feedings)
-    total_bottle_ml = sum(f.get("amount_ml", 0) or 0 for f in feedings if f.get("feeding_type") == "bottle")
+    return await single_flight.run(baby_id, ("stats", start_date, store is event_store), fetch)
+
+# ==================== Report Routes ====================
+
+REPORT_MAX_DAYS = 366
+REPORT_DEFAULT_DAYS = 30
+# Rendered job results are kept this long for polling clients
+REPORT_JOB_TTL = timedelta(hours=1)
+# A pending job older than this belonged to a worker that went away
+REPORT_JOB_TIMEOUT = timedelta(minutes=5)
+
+_report_tasks = set()
+
+def _report_period(start: Optional[str], end: Optional[str], tz_offset_minutes: int):
+    """Local midnights of the first day and of the day after the last one"""
+    try:
+        if end:
+            window_end = datetime.fromisoformat(end[:10]) + timedelta(days=1)
+        else:
+            local_now = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=tz_offset_minutes)
+            window_end = local_now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        window_start = datetime.fromisoformat(start[:10]) if start else window_end - timedelta(days=REPORT_DEFAULT_DAYS)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be dates (YYYY-MM-DD)")
+    if not 1 <= (window_end - window_start).days <= REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"The period must be 1 to {REPORT_MAX_DAYS} days")
+    return window_start, window_end
+
+async def _gather_report_data(baby: dict, window_start: datetime, window_end: datetime,
+                              tz_offset_minutes: int, source=db, store: EventStore = event_store) -> dict:
+    """Per-day feeding, sleep and diaper figures and growth measurements of a period"""
+    baby_id = baby["baby_id"]
+    offset = timedelta(minutes=tz_offset_minutes)
+    days = (window_end - window_start).days
+    local_day = lambda field: {"$dateToString": {
+        "format": "%Y-%m-%d", "date": {"$add": [f"${field}", tz_offset_minutes * 60 * 1000]}
+    }}
+    count_if = lambda field, value: {"$sum": {"$cond": [{"$eq": [f"${field}", value]}, 1, 0]}}
+    feeding_stages = [
+        {"$group": {
+            "_id": local_day("start_time"),
+            "feeds": {"$sum": 1},
+            "breast": {"$sum": {"$cond": [{"$in": ["$feeding_type", ["breast_left", "breast_right"]]}, 1, 0]}},
+            "bottle": count_if("feeding_type", "bottle"),
+            "solid": count_if("feeding_type", "solid"),
+            "bottle_ml": {"$sum": {"$cond": [
+                {"$eq": ["$feeding_type", "bottle"]}, {"$ifNull": ["$amount_ml", 0]}, 0
+            ]}},
+        }}
+    ]
+    diaper_stages = [
+        {"$group": {
+            "_id": local_day("time"),
+            "diapers": {"$sum": 1},
+            "wet": count_if("diaper_type", "wet"),
+            "dirty": count_if("diaper_type", "dirty"),
+            "mixed": count_if("diaper_type", "mixed"),
+        }}
+    ]
+    
+    feeding_rows, sleep_records, diaper_rows, growth = await asyncio.gather(
+        store.aggregate("feeding", [baby_id], window_start - offset, window_end - offset, feeding_stages).to_list(None),
+        store.find_overlapping(
+            "sleep", [baby_id], window_start - offset - SLEEP_CONTEXT, window_end - offset,
+            MAX_SLEEP_DURATION, SLEEP_PROJECTION
+        ).to_list(None),
+        store.aggregate("diaper", [baby_id], window_start - offset, window_end - offset, diaper_stages).to_list(None),
+        source.growth_records.find(
+            {"baby_id": baby_id, "$or": [
+                {"date": {"$gte": window_start.date().isoformat(), "$lt": window_end.date().isoformat()}},
+                {"date": {"$gte": stored_date(window_start), "$lt": stored_date(window_end)}},
+            ]},
+            {"_id": 0, "date": 1, "weight_kg": 1, "height_cm": 1, "head_circumference_cm": 1}
+        ).to_list(None),
+    )
+    for row in growth:
+        row["date"] = iso_date(row["date"])
+    growth.sort(key=lambda row: row["date"])
+    
+    feeding_by_day = {row.pop("_id"): row for row in feeding_rows}
+    diaper_by_day = {row.pop("_id"): row for row in diaper_rows}
+    per_day = []
+    for sleep in account_sleep(sleep_records, window_start, days, utc_offset_minutes=tz_offset_minutes):
+        feeding = feeding_by_day.get(sleep["date"], {})
+        diaper = diaper_by_day.get(sleep["date"], {})
+        per_day.append({
+            "date": sleep["date"],
+            **{field: feeding.get(field, 0) for field in ("feeds", "breast", "bottle", "solid", "bottle_ml")},
+            "sleep_minutes": sleep["total_minutes"],
+            "night_minutes": sleep["night_minutes"],
+            "day_minutes": sleep["day_minutes"],
+            "longest_stretch_minutes": sleep["longest_stretch_minutes"],
+            "naps": sleep["sleep_count"],
+            **{field: diaper.get(field, 0) for field in ("diapers", "wet", "dirty", "mixed")},
+        })
     
-    # Sleep stats
-    sleep_records = await db.sleep_records.find(
-        {"baby_id": baby_id, "start_time": {"$gte": start_date, "$lt": end_date}},
-        {"_id": 0}
-    ).to_list(100)
+    return {
+        "baby": {"name": baby["name"], "birth_date": iso_date(baby.get("birth_date")), "gender": baby.get("gender")},
+        "period": {
+            "start": window_start.date().isoformat(),
+            "end": (window_end - timedelta(days=1)).date().isoformat(),
+            "days": days,
+            "tz_offset_minutes": tz_offset_minutes,
+        },
+        "days": per_day,
+        "growth": growth,
+    }
+
+async def _prepare_report(baby_id: str, request: Request, user: User, start: Optional[str], end: Optional[str],
+                          format: str, tz_offset_minutes: int):
+    """Check access and gather the data; returns (cache key, data)"""
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be pdf or html")
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    window_start, window_end = _report_period(start, end, tz_offset_minutes)
+    source, store = _analytics_sources(request, user)
+    baby = await source.babies.find_one({"baby_id": baby_id}, {"_id": 0, "photo": 0})
+    if not baby:
+        raise HTTPException(status_code=404, detail="Baby not found")
+    data = await _gather_report_data(baby, window_start, window_end, tz_offset_minutes, source, store)
+    key = (baby_id, data["period"]["start"], data["period"]["end"], tz_offset_minutes, format, data_version(data))
+    return key, data
+
+async def _render_report(key: tuple, data: dict, format: str) -> bytes:
+    try:
+        return await report_renderer.render(key, data, format)
+    except RendererBusy:
+        raise HTTPException(status_code=503, detail="Too many reports are being generated, try again shortly",
+                            headers={"Retry-After": "5"})
+
+def _report_response(content: bytes, format: str, filename: str) -> Response:
+    return Response(
+        content=content,
+        media_type=REPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
+
+@api_router.get("/report/{baby_id}")
+async def get_visit_report(baby_id: str, request: Request, start: Optional[str] = None, end: Optional[str] = None,
+                           format: str = "pdf", tz_offset_minutes: int = 0):
+    """Download a visit summary (growth, feeding and sleep averages, diaper counts) for local days start..end"""
+    user = await require_auth(request)
+    key, data = await _prepare_report(baby_id, request, user, start, end, format, tz_offset_minutes)
+    content = await _render_report(key, data, format)
+    return _report_response(content, format, f"visit-summary-{data['period']['start']}-{data['period']['end']}")
+
+@api_router.post("/report/{baby_id}/jobs", status_code=202)
+async def create_report_job(baby_id: str, request: Request, start: Optional[str] = None, end: Optional[str] = None,
+                            format: str = "pdf", tz_offset_minutes: int = 0):
+    """Start rendering a visit summary in the background; poll GET /report/jobs/{job_id}"""
+    user = await require_auth(request)
+    key, data = await _prepare_report(baby_id, request, user, start, end, format, tz_offset_minutes)
+    now = datetime.now(timezone.utc)
+    job = {
+        "_id": f"report_{uuid.uuid4().hex[:12]}",
+        "user_id": user.user_id,
+        "baby_id": baby_id,
+        "format": format,
+        "filename": f"visit-summary-{data['period']['start']}-{data['period']['end']}",
+        "status": "pending",
+        "created_at": now,
+        "expires_at": now + REPORT_JOB_TTL,
+    }
+    await db.report_jobs.insert_one(job)
+    
+    async def run():
+        try:
+            content = await report_renderer.render(key, data, format)
+            update = {"status": "done", "content": content}
+        except RendererBusy:
+            update = {"status": "failed", "error": "Too many reports are being generated, try again shortly"}
+        except Exception:
+            logger.exception("Rendering report %s failed", job["_id"])
+            update = {"status": "failed", "error": "Rendering failed"}
+        await db.report_jobs.update_one({"_id": job["_id"]}, {"$set": update})
+    
+    # Jobs are stored, so any worker can answer the polls
+    task = asyncio.ensure_future(run())
+    _report_tasks.add(task)
+    task.add_done_callback(_report_tasks.discard)
+    return {"job_id": job["_id"], "status": "pending"}
+
+async def _load_report_job(job_id: str, user: User, projection: Optional[dict] = None) -> dict:
+    job = await db.report_jobs.find_one({"_id": job_id, "user_id": user.user_id}, projection)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    created_at = job["created_at"]
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    if job["status"] == "pending" and created_at < datetime.now(timezone.utc) - REPORT_JOB_TIMEOUT:
+        job.update(status="failed", error="Rendering did not finish")
+    return job
+
+@api_router.get("/report/jobs/{job_id}")
+async def get_report_job(job_id: str, request: Request):
+    """Get the status of a report job"""
+    user = await require_auth(request)
+    job = await _load_report_job(job_id, user, {"content": 0})
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "format": job["format"],
+        "error": job.get("error"),
+        "download": f"/api/report/jobs/{job_id}/download" if job["status"] == "done" else None,
+    }
+
+@api_router.get("/report/jobs/{job_id}/download")
+async def download_report_job(job_id: str, request: Request):
+    """Download the report of a finished job"""
+    user = await require_auth(request)
+    job = await _load_report_job(job_id, user)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Report is {job['status']}")
+    return _report_response(job["content"], job["format"], job["filename"])
+
+# ==================== Cohort Benchmarks ====================
+
+@api_router.get("/cohort/{baby_id}")
+async def get_cohort_comparison(baby_id: str, request: Request, date: Optional[str] = None, tz_offset_minutes: int = 0):
+    """Compare the baby's last 7 local days up to `date` (default yesterday) with babies of the same age"""
+    user = await require_auth(request)
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    try:
+        if date:
+            window_end = datetime.fromisoformat(date[:10]) + timedelta(days=1)
+        else:
+            local_now = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=tz_offset_minutes)
+            window_end = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be a date (YYYY-MM-DD)")
+    window_start = window_end - timedelta(days=cohort.COMPARE_DAYS)
+
+    source, store = _analytics_sources(request, user)
+    baby = await source.babies.find_one({"baby_id": baby_id}, {"_id": 0, "baby_id": 1, "birth_date": 1})
+    if not baby:
+        raise HTTPException(status_code=404, detail="Baby not found")
+    age_weeks = cohort.age_in_weeks(baby, (window_end - timedelta(days=1)).date())
+
+    table, metrics = await asyncio.gather(
+        cohort_tables.get(),
+        cohort.daily_metrics(store, baby_id, window_start, cohort.COMPARE_DAYS, tz_offset_minutes)
+    )
+    comparison = {}
+    for metric, by_day in metrics.items():
+        if not by_day:
+            comparison[metric] = None
+            continue
+        value = sum(by_day.values()) / len(by_day)
+        cohort_row = cohort.compare(table, age_weeks, metric, value) if table and age_weeks is not None else None
+        comparison[metric] = {"value": round(value, 1), "days": len(by_day), "cohort": cohort_row}
+
+    return {
+        "baby_id": baby_id,
+        "age_weeks": age_weeks,
+        "period": {
+            "start": window_start.date().isoformat(),
+            "end": (window_end - timedelta(days=1)).date().isoformat(),
+            "tz_offset_minutes": tz_offset_minutes,
+        },
+        "generated_at": table["generated_at"] if table else None,
+        "metrics": comparison,
+    }
+
+# ==================== Current State Routes ====================
+
+def _public_state(state: dict) -> dict:
+    return {k: state.get(k) for k in ("ongoing_sleep", "last_sleep", "last_feeding", "last_diaper", "last_wet_diaper", "updated_at")}
+
+@api_router.get("/state/{baby_id}", response_model=BabyState)
+async def get_baby_state(baby_id: str, request: Request):
+    """Get ongoing sleep, last sleep, last feeding and last diaper for a baby"""
+    user = await require_auth(request)
     
-    sleep_count = len(sleep_records)
-    total_sleep_minutes = sum(s.get("duration_minutes", 0) or 0 for s in sleep_records)
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    # Diaper stats
-    diapers = await db.diaper_records.find(
-        {"baby_id": baby_id, "time": {"$gte": start_date, "$lt": end_date}},
-        {"_id": 0}
+    states = await _load_baby_states([baby_id])
+    return BabyState(baby_id=baby_id, **_public_state(states[baby_id]))
+
+# ==================== Dashboard Routes ====================
+
+@api_router.get("/dashboard")
+async def get_dashboard(request: Request, date: Optional[str] = None, events_limit: int = 20):
+    """Get everything the home screen needs for all accessible babies in one call"""
+    user = await require_auth(request)
+    
+    # Photos are large base64 blobs; the client fetches them via /baby/{baby_id}
+    babies = await db.babies.find(
+        {"$or": [
+            {"user_id": user.user_id},
+            {"shared_with": user.user_id}
+        ]},
+        {"_id": 0, "photo": 0}
     ).to_list(100)
+    baby_ids = [baby["baby_id"] for baby in babies]
+    
+    start_date, end_date = _day_range(date)
     
-    wet_count = len([d for d in diapers if d.get("diaper_type") == "wet"])
-    dirty_count = len([d for d in diapers if d.get("diaper_type") == "dirty"])
-    mixed_count = len([d for d in diapers if d.get("diaper_type") == "mixed"])
+    if baby_ids:
+        stats, timelines, states, invites = await asyncio.gather(
+            _fetch_daily_stats(baby_ids, start_date, end_date),
+            _fetch_timelines(baby_ids, start_date, end_date),
+            _load_baby_states(baby_ids),
+            _load_pending_invites(user),
+        )
+    else:
+        stats, timelines, states = {}, {}, {}
+        invites = await _load_pending_invites(user)
     
     return {
-        "date": start_date.isoformat(),
-        "feeding": {
-            "count": feeding_count,
-            "total_minutes": total_feeding_minutes,
-            "total_bottle_ml": total_bottle_ml
-        },
-        "sleep": {
-            "count": sleep_count,
-            "total_minutes": total_sleep_minutes,
-            "total_hours": round(total_sleep_minutes / 60, 1) if total_sleep_minutes else 0
-        },
-        "diaper": {
-            "total": len(diapers),
-            "wet": wet_count,
-            "dirty": dirty_count,
-            "mixed": mixed_count
-        }
+        "user": user,
+        "babies": [
+            {
+                "baby": Baby(**baby),
+                "stats": stats[baby["baby_id"]],
+                "timeline": timelines[baby["baby_id"]][:events_limit],
+                "state": BabyState(baby_id=baby["baby_id"], **_public_state(states[baby["baby_id"]])),
+                # One baby with an unreadable birth date (see _age_in_months) mustn't fail the whole
+                # home screen; it just has no prediction
+                "sleep_prediction": _predict_next_nap(baby, states[baby["baby_id"]])
+                if read_date(baby.get("birth_date")) else None
+            }
+            for baby in babies
+        ],
+        "pending_invites": invites
     }
 
 # ==================== Family Sharing Routes ====================
@@ -947,11 +2403,8 @@ async def create_share_invite(invite_data: ShareInviteCreate, request: Request):
     await db.share_invites.insert_one(invite.dict())
     return invite
 
-@api_router.get("/share/invites/pending")
-async def get_pending_invites(request: Request):
-    """Get pending invites for current user"""
-    user = await require_auth(request)
-    
+async def _load_pending_invites(user: User) -> list:
+    """Load a user's pending invites enriched with baby and inviter names"""
     invites = await db.share_invites.find(
         {"invitee_email": user.email, "status": "pending"},
         {"_id": 0}
@@ -965,8 +2418,10 @@ async def get_pending_invites(request: Request):
     inviter_ids = list(set(invite["inviter_user_id"] for invite in invites))
     
     # Fetch all babies and inviters in bulk
-    babies_list = await db.babies.find({"baby_id": {"$in": baby_ids}}, {"_id": 0}).to_list(100)
-    inviters_list = await db.users.find({"user_id": {"$in": inviter_ids}}, {"_id": 0}).to_list(100)
+    babies_list, inviters_list = await asyncio.gather(
+        db.babies.find({"baby_id": {"$in": baby_ids}}, {"_id": 0, "baby_id": 1, "name": 1}).to_list(100),
+        db.users.find({"user_id": {"$in": inviter_ids}}, {"_id": 0, "user_id": 1, "name": 1}).to_list(100),
+    )
     
     # Create lookup dictionaries
     babies = {b["baby_id"]: b for b in babies_list}
@@ -986,20 +2441,34 @@ async def get_pending_invites(request: Request):
     
     return enriched
 
-@api_router.post("/share/invite/{invite_id}/accept")
-async def accept_invite(invite_id: str, request: Request):
-    """Accept a share invite"""
+@api_router.get("/share/invites/pending")
+async def get_pending_invites(request: Request):
+    """Get pending invites for current user"""
     user = await require_auth(request)
-    
+    return await _load_pending_invites(user)
+
+async def _raise_invite_error(invite_id: str, user: User):
+    """Explain why an invite could not be claimed"""
     invite = await db.share_invites.find_one({"invite_id": invite_id}, {"_id": 0})
     if not invite:
         raise HTTPException(status_code=404, detail="Invite not found")
-    
     if invite["invitee_email"] != user.email:
         raise HTTPException(status_code=403, detail="Not your invite")
+    raise HTTPException(status_code=400, detail="Invite already processed")
+
+@api_router.post("/share/invite/{invite_id}/accept")
+async def accept_invite(invite_id: str, request: Request):
+    """Accept a share invite"""
+    user = await require_auth(request)
     
-    if invite["status"] != "pending":
-        raise HTTPException(status_code=400, detail="Invite already processed")
+    # Claiming the pending invite atomically also stops it being accepted twice
+    invite = await db.share_invites.find_one_and_update(
+        {"invite_id": invite_id, "invitee_email": user.email, "status": "pending"},
+        {"$set": {"status": "accepted"}},
+        {"_id": 0}
+    )
+    if not invite:
+        await _raise_invite_error(invite_id, user)
     
     # Add user to baby's shared_with
     await db.babies.update_one(
@@ -1007,12 +2476,6 @@ async def accept_invite(invite_id: str, request: Request):
         {"$addToSet": {"shared_with": user.user_id}}
     )
     
-    # Update invite status
-    await db.share_invites.update_one(
-        {"invite_id": invite_id},
-        {"$set": {"status": "accepted"}}
-    )
-    
     return {"message": "Invite accepted"}
 
 @api_router.post("/share/invite/{invite_id}/decline")
@@ -1020,17 +2483,13 @@ async def decline_invite(invite_id: str, request: Request):
     """Decline a share invite"""
     user = await require_auth(request)
     
-    invite = await db.share_invites.find_one({"invite_id": invite_id}, {"_id": 0})
-    if not invite:
-        raise HTTPException(status_code=404, detail="Invite not found")
-    
-    if invite["invitee_email"] != user.email:
-        raise HTTPException(status_code=403, detail="Not your invite")
-    
-    await db.share_invites.update_one(
-        {"invite_id": invite_id},
-        {"$set": {"status": "declined"}}
+    invite = await db.share_invites.find_one_and_update(
+        {"invite_id": invite_id, "invitee_email": user.email},
+        {"$set": {"status": "declined"}},
+        {"_id": 1}
     )
+    if not invite:
+        await _raise_invite_error(invite_id, user)
     
     return {"message": "Invite declined"}
 
@@ -1039,18 +2498,16 @@ async def remove_shared_access(baby_id: str, user_id: str, request: Request):
     """Remove shared access (owner only)"""
     current_user = await require_auth(request)
     
-    baby = await db.babies.find_one({"baby_id": baby_id}, {"_id": 0})
+    baby = await db.babies.find_one_and_update(
+        {"baby_id": baby_id, "user_id": current_user.user_id},
+        {"$pull": {"shared_with": user_id}},
+        {"_id": 1}
+    )
     if not baby:
+        if await db.babies.find_one({"baby_id": baby_id}, {"_id": 1}):
+            raise HTTPException(status_code=403, detail="Only owner can remove access")
         raise HTTPException(status_code=404, detail="Baby not found")
     
-    if baby["user_id"] != current_user.user_id:
-        raise HTTPException(status_code=403, detail="Only owner can remove access")
-    
-    await db.babies.update_one(
-        {"baby_id": baby_id},
-        {"$pull": {"shared_with": user_id}}
-    )
-    
     return {"message": "Access removed"}
 
 # ==================== Reminder Routes ====================
@@ -1060,19 +2517,22 @@ async def create_reminder(reminder_data: ReminderCreate, request: Request):
     """Create a reminder"""
     user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, reminder_data.baby_id):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    reminder = Reminder(
-        baby_id=reminder_data.baby_id,
-        user_id=user.user_id,
-        reminder_type=reminder_data.reminder_type,
-        time=datetime.fromisoformat(reminder_data.time.replace('Z', '+00:00')),
-        message=reminder_data.message
-    )
+    async def create():
+        if not await check_baby_access(user.user_id, reminder_data.baby_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        
+        reminder = Reminder(
+            baby_id=reminder_data.baby_id,
+            user_id=user.user_id,
+            reminder_type=reminder_data.reminder_type,
+            time=datetime.fromisoformat(reminder_data.time.replace('Z', '+00:00')),
+            message=reminder_data.message
+        )
+        
+        await db.reminders.insert_one(reminder.dict())
+        return reminder
     
-    await db.reminders.insert_one(reminder.dict())
-    return reminder
+    return await run_idempotent(request, user, create)
 
 @api_router.get("/reminder/{baby_id}", response_model=List[Reminder])
 async def get_reminders(baby_id: str, request: Request):
@@ -1089,20 +2549,140 @@ async def get_reminders(baby_id: str, request: Request):
     
     return [Reminder(**r) for r in reminders]
 
+@api_router.put("/reminder/{reminder_id}", response_model=Reminder)
+async def update_reminder(reminder_id: str, reminder_data: ReminderUpdate, request: Request):
+    """Update fields of a reminder (e.g. to deactivate it)"""
+    user = await require_auth(request)
+    
+    update_data = _update_fields(reminder_data, ("time",), ("reminder_type", "time", "message", "is_active"))
+    reminder = await _mutate_record(
+        db.reminders, "reminder_id", reminder_id, user, {"$set": update_data} if update_data else None,
+        not_found="Reminder not found"
+    )
+    return Reminder(**reminder)
+
 @api_router.delete("/reminder/{reminder_id}")
 async def delete_reminder(reminder_id: str, request: Request):
     """Delete a reminder"""
     user = await require_auth(request)
     
-    reminder = await db.reminders.find_one({"reminder_id": reminder_id}, {"_id": 0})
-    if not reminder:
-        raise HTTPException(status_code=404, detail="Reminder not found")
+    await _mutate_record(db.reminders, "reminder_id", reminder_id, user, delete=True, not_found="Reminder not found")
+    return {"message": "Reminder deleted"}
+
+# ==================== Alert Routes ====================
+
+@api_router.get("/alerts/{baby_id}/rules", response_model=List[AlertRule])
+async def get_alert_rules(baby_id: str, request: Request):
+    """Get a baby's alert rules and when each is next due"""
+    user = await require_auth(request)
     
-    if not await check_baby_access(user.user_id, reminder["baby_id"]):
+    if not await check_baby_access(user.user_id, baby_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    await db.reminders.delete_one({"reminder_id": reminder_id})
-    return {"message": "Reminder deleted"}
+    return [AlertRule(**rule) for rule in await alert_engine.list_rules(baby_id)]
+
+@api_router.put("/alerts/{baby_id}/rules/{rule}", response_model=AlertRule)
+async def set_alert_rule(baby_id: str, rule: str, rule_data: AlertRuleSet, request: Request):
+    """Create or change an alert rule (no_feed, no_wet_diaper or long_sleep)"""
+    user = await require_auth(request)
+    
+    if rule not in ALERT_RULES:
+        raise HTTPException(status_code=400, detail=f"rule must be one of {', '.join(ALERT_RULES)}")
+    if not ALERT_MIN_MINUTES <= rule_data.threshold_minutes <= ALERT_MAX_MINUTES:
+        raise HTTPException(
+            status_code=400, detail=f"threshold_minutes must be between {ALERT_MIN_MINUTES} and {ALERT_MAX_MINUTES}"
+        )
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    states = await _load_baby_states([baby_id])
+    return AlertRule(**await alert_engine.set_rule(
+        baby_id, rule, rule_data.threshold_minutes, states[baby_id], user.user_id
+    ))
+
+@api_router.delete("/alerts/{baby_id}/rules/{rule}")
+async def delete_alert_rule(baby_id: str, rule: str, request: Request):
+    """Delete an alert rule"""
+    user = await require_auth(request)
+    
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if not await alert_engine.delete_rule(baby_id, rule):
+        raise HTTPException(status_code=404, detail="Alert rule not found")
+    return {"message": "Alert rule deleted"}
+
+@api_router.get("/alerts/{baby_id}")
+async def get_alerts(baby_id: str, request: Request, limit: int = 50):
+    """Get the alerts fired for a baby, newest first"""
+    user = await require_auth(request)
+    
+    if not await check_baby_access(user.user_id, baby_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return await db.alerts.find(
+        {"baby_id": baby_id}, {"_id": 0, "expires_at": 0}
+    ).sort("fired_at", -1).to_list(min(max(limit, 1), 200))
+
+# ==================== Admin Routes ====================
+
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()}
+PROFILE_TOKEN_MAX_TTL = 24 * 60 * 60
+
+async def require_admin(request: Request) -> User:
+    user = await require_auth(request)
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+@api_router.post("/admin/profiler/arm")
+async def arm_profiler(request: Request, route: str, count: int = 1, method: str = "GET"):
+    """Profile the next `count` requests to a route template (e.g. /api/timeline/{baby_id}) in this worker"""
+    await require_admin(request)
+    if not any(getattr(r, "path", None) == route for r in app.router.routes):
+        raise HTTPException(status_code=404, detail=f"No route {route}")
+    request_profiler.arm(method.upper(), route, count)
+    return {"armed": request_profiler.armed, "worker_pid": os.getpid()}
+
+@api_router.delete("/admin/profiler/arm")
+async def disarm_profiler(request: Request):
+    """Stop profiling armed routes in this worker"""
+    await require_admin(request)
+    request_profiler.disarm()
+    return {"armed": request_profiler.armed, "worker_pid": os.getpid()}
+
+@api_router.post("/admin/profiler/token")
+async def issue_profile_token(request: Request, ttl_seconds: int = 3600):
+    """Get an X-Profile header value; requests sending it are profiled in any worker until it expires"""
+    await require_admin(request)
+    if not 1 <= ttl_seconds <= PROFILE_TOKEN_MAX_TTL:
+        raise HTTPException(status_code=400, detail=f"ttl_seconds must be between 1 and {PROFILE_TOKEN_MAX_TTL}")
+    token, expires_at = request_profiler.issue_token(ttl_seconds)
+    return {"header": "X-Profile", "value": token, "expires_at": expires_at}
+
+@api_router.get("/admin/profiles")
+async def list_profiles(request: Request, route: Optional[str] = None, limit: int = 20):
+    """List recent profiles, newest first"""
+    await require_admin(request)
+    query = {"route": route} if route else {}
+    return await db.profiles.find(
+        query, {"stacks": 0, "expires_at": 0}
+    ).sort("created_at", -1).to_list(max(1, min(limit, 100)))
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request, format: str = "collapsed"):
+    """Get a profile as collapsed stacks (flamegraph.pl, speedscope) or as a JSON call tree"""
+    await require_admin(request)
+    profile = await db.profiles.find_one({"_id": profile_id})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return Response(content=collapsed(profile["stacks"]), media_type="text/plain")
+    if format == "json":
+        profile.pop("expires_at", None)
+        profile["tree"] = call_tree(profile.pop("stacks"))
+        return profile
+    raise HTTPException(status_code=400, detail="format must be collapsed or json")
 
 # ==================== Health Check ====================
 
@@ -1112,11 +2692,37 @@ async def root():
 
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "log_records_dropped": dropped_records()}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Profiling wraps only the application, so profiles show the handler's time
+app.add_middleware(ProfilerMiddleware, profiler=request_profiler, store=db.profiles)
+
+# Lets any worker route a client's reads to the primary right after its writes
+app.add_middleware(ReadYourWritesMiddleware, router=read_router)
+
+# Admission control (added before CORS so rejections still carry CORS headers)
+if os.environ.get("RATE_LIMIT_BACKEND", "memory") == "mongo":
+    rate_limit_backend = MongoBucketBackend(db)
+else:
+    rate_limit_backend = MemoryBucketBackend()
+
+app.add_middleware(
+    AdmissionControlMiddleware,
+    backend=rate_limit_backend,
+    user_per_minute=int(os.environ.get("RATE_LIMIT_USER_PER_MINUTE", "600")),
+    baby_per_minute=int(os.environ.get("RATE_LIMIT_BABY_PER_MINUTE", "600")),
+    expensive_prefixes=[
+        "/api/stats/", "/api/feeding/analytics/", "/api/feeding/forecast/", "/api/sleep/chart/",
+        "/api/sleep/prediction/", "/api/dashboard", "/api/import/"
+    ],
+    expensive_concurrency=int(os.environ.get("EXPENSIVE_ROUTE_CONCURRENCY", "8")),
+    verify_token=lambda token: (access_tokens.verify(token) or {}).get("user_id"),
+    client_ip_header=os.environ.get("RATE_LIMIT_CLIENT_IP_HEADER")
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1125,6 +2731,77 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+)
+
+@app.on_event("startup")
+async def setup_access_tokens():
+    await access_tokens.setup(db)
+    request_profiler.set_key(access_tokens.derived_key("profiler"))
+
+@app.on_event("startup")
+async def setup_event_store():
+    await event_store.setup()
+
+@app.on_event("startup")
+async def create_search_indexes():
+    for collection_name, _, _, fields in SEARCHABLE.values():
+        await db[collection_name].create_index([(field, "text") for field in fields], name="notes_text")
+
+@app.on_event("startup")
+async def start_alert_engine():
+    await alert_engine.setup()
+    alert_engine.start(float(os.environ.get("ALERT_CHECK_SECONDS", "30")))
+
+@app.on_event("startup")
+async def create_record_id_indexes():
+    # Imports rely on these to skip rows that are already stored
+    for _, _, collection_name, id_field in IMPORT_TYPES.values():
+        try:
+            await db[collection_name].create_index(id_field, unique=True, name=f"{id_field}_unique")
+        except OperationFailure as e:
+            logger.warning("Unique index on %s.%s not created: %s", collection_name, id_field, e)
+
+@app.on_event("startup")
+async def create_baby_access_indexes():
+    await db.babies.create_index("user_id")
+    await db.babies.create_index("shared_with")
+
+@app.on_event("startup")
+async def create_profile_index():
+    await db.profiles.create_index("expires_at", expireAfterSeconds=0)
+    await db.profiles.create_index([("route", 1), ("created_at", -1)])
+
+@app.on_event("startup")
+async def create_report_job_index():
+    await db.report_jobs.create_index("expires_at", expireAfterSeconds=0)
+
+@app.on_event("startup")
+async def create_idempotency_index():
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+
+@app.on_event("startup")
+async def setup_rate_limits():
+    if isinstance(rate_limit_backend, MongoBucketBackend):
+        await rate_limit_backend.setup()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await write_buffer.close()
+    await feeding_forecaster.close()
+    await access_tokens.close()
+    await alert_engine.close()
+    report_renderer.close()
     client.close()
+    log_listener.stop()
+
+# Access logs (outermost, so latency includes compression and admission control)
+if os.environ.get("ACCESS_LOG", "true").lower() == "true":
+    app.add_middleware(
+        AccessLogMiddleware,
+        sample_rate=float(os.environ.get("ACCESS_LOG_SAMPLE_RATE", "1")),
+        slow_ms=float(os.environ.get("ACCESS_LOG_SLOW_MS", "1000")),
+        hash_key=os.environ.get("ACCESS_LOG_HASH_KEY")
+    )
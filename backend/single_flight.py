@@ -0,0 +1,66 @@
+"""
+Request coalescing for hot read routes.
+
+Caregivers sharing a baby tend to open the app at the same moment (a
+feeding-time notification reaches everyone at once). Identical timeline,
+stats and prediction reads then arrive together. SingleFlight runs one
+computation per key and lets every concurrent caller await it.
+
+Keys include a per-baby data version that writes in this worker bump, so
+a read that starts after a write never joins a computation that started
+before it. An optional short result TTL also serves callers that arrive
+just after a computation finished. Writes made in other workers are seen
+within that TTL.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self, result_ttl_seconds: float = 0.0, max_results: int = 1000, max_versions: int = 100000):
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_results = max_results
+        self.max_versions = max_versions
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._results: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+
+    def bump(self, scope: str):
+        """Mark data under `scope` (a baby_id) as changed"""
+        if scope not in self._versions and len(self._versions) >= self.max_versions:
+            # Forgetting versions is safe: cached results are dropped with them
+            self._versions.clear()
+            self._results.clear()
+        self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    async def run(self, scope: str, key: tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return compute()'s result, sharing it with identical concurrent calls.
+
+        The result is shared, so callers must not mutate it.
+        """
+        key = (scope, self._versions.get(scope, 0)) + key
+
+        if self.result_ttl_seconds:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    return cached[1]
+                del self._results[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            # A task, so followers still get the result if the first caller disconnects
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: tuple, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not self.result_ttl_seconds or task.cancelled() or task.exception() is not None:
+            return
+        self._results[key] = (time.monotonic() + self.result_ttl_seconds, task.result())
+        if len(self._results) > self.max_results:
+            self._results.popitem(last=False)
@@ -0,0 +1,164 @@
+"""
+Interval-correct sleep accounting.
+
+A sleep is counted on every day it overlaps, clipped to that day. For
+example, a night sleep from 20:00 to 06:00 contributes four hours to the
+evening it started and six hours to the next morning.
+
+Overlapping records are merged first, so a sleep logged by two caregivers
+is not counted twice. The merged stretches are then swept once against the
+day and night boundaries of the whole window. The sweep yields per-day
+totals, the day/night split, the longest stretch, wake windows and the
+asleep segments that charts draw.
+
+Night is NIGHT_START_HOUR to NIGHT_END_HOUR in the caller's local time,
+given as an offset from UTC.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+SLEEP_PROJECTION = {"_id": 0, "baby_id": 1, "sleep_id": 1, "start_time": 1, "end_time": 1, "duration_minutes": 1}
+
+# Records longer than this are treated as data-entry mistakes; also bounds the overlap query
+MAX_SLEEP_DURATION = timedelta(hours=24)
+# Earlier sleeps loaded to know the wake window and stretch leading into the first day
+CONTEXT = timedelta(days=1)
+# Longer gaps mean sleeps were not logged rather than an awake baby
+MAX_WAKE_WINDOW = timedelta(hours=12)
+
+NIGHT_START_HOUR = 19
+NIGHT_END_HOUR = 7
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def sleep_interval(record: dict, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """Return the (start, end) of a sleep record in naive UTC, or None if it can't be placed"""
+    start = _naive_utc(record["start_time"])
+    if record.get("end_time"):
+        end = _naive_utc(record["end_time"])
+    elif record.get("duration_minutes"):
+        end = start + timedelta(minutes=record["duration_minutes"])
+    elif now - start <= MAX_SLEEP_DURATION:
+        # Still asleep
+        end = now
+    else:
+        return None
+    if end <= start or end - start > MAX_SLEEP_DURATION:
+        return None
+    return start, min(end, now)
+
+
+def merge_intervals(intervals: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """Sweep start/end events into non-overlapping asleep stretches"""
+    # Starts sort before ends at the same instant, so back-to-back sleeps merge
+    events = sorted([(s, 1) for s, _ in intervals] + [(e, -1) for _, e in intervals], key=lambda x: (x[0], -x[1]))
+    stretches, depth, opened = [], 0, None
+    for moment, delta in events:
+        if depth == 0:
+            opened = moment
+        depth += delta
+        if depth == 0:
+            stretches.append((opened, moment))
+    return stretches
+
+
+def _is_night(moment: datetime) -> bool:
+    return moment.hour >= NIGHT_START_HOUR or moment.hour < NIGHT_END_HOUR
+
+
+def _next_boundary(moment: datetime) -> datetime:
+    """The next midnight, night start or night end after `moment`"""
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    for hour in (NIGHT_END_HOUR, NIGHT_START_HOUR):
+        boundary = midnight + timedelta(hours=hour)
+        if boundary > moment:
+            return boundary
+    return midnight + timedelta(days=1)
+
+
+def _minutes(delta: timedelta) -> float:
+    return delta.total_seconds() / 60
+
+
+def account_sleep(records: List[dict], window_start: datetime, days: int, now: Optional[datetime] = None,
+                  utc_offset_minutes: int = 0, include_segments: bool = False) -> List[dict]:
+    """Per-day sleep accounting for [window_start, window_start + days) in local time.
+
+    `window_start` is the local midnight of the first day. `records` should be
+    every sleep overlapping the window plus CONTEXT before it.
+    """
+    offset = timedelta(minutes=utc_offset_minutes)
+    now = _naive_utc(now or datetime.now(timezone.utc))
+    window_start = _naive_utc(window_start)
+    window_end = window_start + timedelta(days=days)
+
+    intervals = []
+    sleep_counts = [0] * days
+    for record in records:
+        interval = sleep_interval(record, now)
+        if interval is None:
+            continue
+        start, end = interval[0] + offset, interval[1] + offset
+        intervals.append((start, end))
+        if window_start <= start < window_end:
+            sleep_counts[(start - window_start).days] += 1
+
+    totals = [{"day": 0.0, "night": 0.0} for _ in range(days)]
+    longest = [0.0] * days
+    wake_windows: List[List[float]] = [[] for _ in range(days)]
+    segments: List[List[Dict]] = [[] for _ in range(days)]
+
+    previous_end = None
+    for start, end in merge_intervals(intervals):
+        # Stretches count on the day they end, wake windows on the day they end (falling asleep)
+        if window_start <= end < window_end:
+            index = (end - window_start).days
+            longest[index] = max(longest[index], _minutes(end - start))
+        if previous_end is not None and window_start <= start < window_end and \
+                start - previous_end <= MAX_WAKE_WINDOW:
+            wake_windows[(start - window_start).days].append(_minutes(start - previous_end))
+        previous_end = end
+
+        # Split the clipped stretch at every day and night boundary it crosses
+        moment, stop = max(start, window_start), min(end, window_end)
+        while moment < stop:
+            piece_end = min(stop, _next_boundary(moment))
+            index = (moment - window_start).days
+            night = _is_night(moment)
+            totals[index]["night" if night else "day"] += _minutes(piece_end - moment)
+            if include_segments:
+                day_start = window_start + timedelta(days=index)
+                segments[index].append({
+                    "start_minute": round(_minutes(moment - day_start)),
+                    "end_minute": round(_minutes(piece_end - day_start)),
+                    "night": night,
+                })
+            moment = piece_end
+
+    result = []
+    for index in range(days):
+        day_minutes = round(totals[index]["day"])
+        night_minutes = round(totals[index]["night"])
+        windows = wake_windows[index]
+        entry = {
+            "date": (window_start + timedelta(days=index)).date().isoformat(),
+            "sleep_count": sleep_counts[index],
+            "total_minutes": day_minutes + night_minutes,
+            "day_minutes": day_minutes,
+            "night_minutes": night_minutes,
+            "longest_stretch_minutes": round(longest[index]),
+            "wake_windows": {
+                "count": len(windows),
+                "mean_minutes": round(sum(windows) / len(windows)) if windows else None,
+                "max_minutes": round(max(windows)) if windows else None,
+            },
+        }
+        if include_segments:
+            entry["segments"] = segments[index]
+        result.append(entry)
+    return result
@@ -0,0 +1,590 @@
+"""
+Embedded SQLite storage backend.
+
+Implements the subset of the Motor collection API that server.py uses
+(find/find_one/insert/update/delete, find_one_and_*, aggregate and
+pipeline updates), so the route handlers run unchanged on a single SQLite
+file. Each collection is a table of JSON documents. Indexes are SQLite
+expression indexes on `json_extract`, and filters that can be expressed in
+SQL are pushed down to them. Everything else is evaluated in Python with
+MongoDB semantics (see query.py).
+
+The database runs in WAL mode. Writes are serialized on a single writer
+thread, so read-modify-write operations are atomic. Reads use a small pool
+of reader threads. Enable it with STORAGE_BACKEND=sqlite; intended for
+single-family self-hosting, not for large deployments.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+
+from query import (MISSING, TEXT_SCORE, apply_update, decode, dumps, get_path, is_operator_dict, match, normalize,
+                   project, run_pipeline, sort_docs, text_score, upsert_seed, without_score)
+
+# Fields holding arrays; equality on them means "contains", which SQL pushdown can't express
+ARRAY_FIELDS = {"shared_with", "ids"}
+
+# Indexes created together with each table
+DEFAULT_INDEXES = {
+    "users": [["user_id"], ["email"]],
+    "user_sessions": [["session_token"]],
+    "babies": [["baby_id"], ["user_id"]],
+    "feeding_records": [["feeding_id"], ["baby_id", "start_time"]],
+    "sleep_records": [["sleep_id"], ["baby_id", "start_time"]],
+    "diaper_records": [["diaper_id"], ["baby_id", "time"]],
+    "growth_records": [["growth_id"], ["baby_id", "date"]],
+    "reminders": [["reminder_id"], ["baby_id", "time"]],
+    "share_invites": [["invite_id"], ["invitee_email", "status"]],
+}
+
+TTL_PURGE_INTERVAL_SECONDS = 60
+
+
+# ==================== SQL pushdown ====================
+
+def _field_sql(key: str) -> str:
+    if key == "_id":
+        return "_id"
+    return f"json_extract(doc, '$.{key}')"
+
+
+def _sql_param(key: str, value):
+    """SQL parameter comparable with _field_sql(key), or MISSING if not pushable"""
+    value = normalize(value)
+    if key == "_id" or isinstance(value, (datetime, ObjectId)):
+        return dumps(value) if key != "_id" or not isinstance(value, str) else json.dumps(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (str, int, float)):
+        return value
+    return MISSING
+
+
+def _translate(query: dict) -> Tuple[str, list, bool]:
+    """Translate the pushable part of a filter to SQL; `exact` is False if Python must re-check"""
+    clauses, params, exact = [], [], True
+    for key, condition in query.items():
+        if key.startswith("$") or "." in key or key in ARRAY_FIELDS:
+            exact = False
+            continue
+        field = _field_sql(key)
+        ops = condition.items() if is_operator_dict(condition) else [("$eq", condition)]
+        for op, arg in ops:
+            if op in ("$eq", "$ne") and arg is None and key != "_id":
+                clauses.append(f"{field} IS {'NOT ' if op == '$ne' else ''}NULL")
+                continue
+            if op in ("$eq", "$gt", "$gte", "$lt", "$lte"):
+                param = _sql_param(key, arg)
+                if param is MISSING:
+                    exact = False
+                    continue
+                sql_op = {"$eq": "=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}[op]
+                clauses.append(f"{field} {sql_op} ?")
+                params.append(param)
+                # Mixed-type comparisons differ between SQLite and MongoDB
+                if op != "$eq":
+                    exact = False
+                continue
+            if op == "$in":
+                in_params = [_sql_param(key, a) for a in arg]
+                if any(p is MISSING for p in in_params) or any(a is None for a in arg):
+                    exact = False
+                    continue
+                if not in_params:
+                    clauses.append("0")
+                else:
+                    clauses.append(f"{field} IN ({','.join('?' * len(in_params))})")
+                    params.extend(in_params)
+                continue
+            exact = False
+    return (" AND ".join(clauses) or "1"), params, exact
+
+
+# ==================== Results ====================
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+        self.acknowledged = True
+
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+        self.acknowledged = True
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.acknowledged = True
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+        self.acknowledged = True
+
+
+# ==================== Cursors ====================
+
+class SQLiteCursor:
+    def __init__(self, collection, query: dict, projection: Optional[dict]):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._limit = 0
+        self._skip = 0
+
+    def sort(self, key, direction: int = 1):
+        if isinstance(key, list):
+            self._sort.extend(key)
+        else:
+            self._sort.append((key, direction))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> list:
+        limit = self._limit
+        if length:
+            limit = min(limit, length) if limit else length
+        docs = await self.collection._find(self.query, self._sort, self._skip, limit)
+        return [without_score(project(doc, self.projection)) for doc in docs]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list(None):
+            yield doc
+
+
+class SQLiteAggregationCursor:
+    def __init__(self, collection, pipeline: List[dict]):
+        self.collection = collection
+        self.pipeline = pipeline
+
+    async def to_list(self, length: Optional[int] = None) -> list:
+        docs = await self.collection._aggregate(self.pipeline)
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list(None):
+            yield doc
+
+
+# ==================== Collections ====================
+
+class SQLiteCollection:
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self._table = f'"{name}"'
+        self._ttl: Dict[str, int] = {}
+        self._last_purge = 0.0
+        self._text_fields: List[str] = []
+
+    # ---------- plumbing ----------
+
+    async def _read(self, fn, *args):
+        await self.database._ensure_table(self.name)
+        return await self.database._run_read(fn, *args)
+
+    async def _write(self, fn, *args):
+        await self.database._ensure_table(self.name)
+        if self._ttl and time.monotonic() - self._last_purge > TTL_PURGE_INTERVAL_SECONDS:
+            self._last_purge = time.monotonic()
+            await self.database._run_write(self._purge_expired_sync)
+        return await self.database._run_write(fn, *args)
+
+    def _select_sync(self, conn, query: dict, sort, skip: int, limit: int) -> List[dict]:
+        text = query.get("$text")
+        if text is not None:
+            # Scored in Python over the text-indexed fields, like MongoDB scans its text index
+            query = {k: v for k, v in query.items() if k != "$text"}
+        where, params, exact = _translate(query)
+        exact = exact and text is None
+        sql = f"SELECT _id, doc FROM {self._table} WHERE {where}"
+        if sort:
+            sql += " ORDER BY " + ", ".join(
+                f"{_field_sql(k)} {'DESC' if d < 0 else 'ASC'}" for k, d in sort
+            )
+        if exact:
+            if limit:
+                sql += f" LIMIT {int(limit)}"
+                if skip:
+                    sql += f" OFFSET {int(skip)}"
+            elif skip:
+                sql += f" LIMIT -1 OFFSET {int(skip)}"
+
+        docs = []
+        for _, raw in conn.execute(sql, params):
+            doc = decode(json.loads(raw))
+            if exact or match(doc, query):
+                if text is not None:
+                    score = text_score(doc, self._text_fields, text["$search"])
+                    if not score:
+                        continue
+                    doc[TEXT_SCORE] = score
+                docs.append(doc)
+        if sort:
+            # SQLite orders mixed types differently; keep MongoDB's order
+            docs = sort_docs(docs, sort)
+        if not exact:
+            docs = docs[skip:]
+            if limit:
+                docs = docs[:limit]
+        return docs
+
+    def _insert_sync(self, conn, doc: dict):
+        try:
+            conn.execute(f"INSERT INTO {self._table} (_id, doc) VALUES (?, ?)", (dumps(doc["_id"]), dumps(doc)))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} ({e})", 11000)
+
+    def _replace_sync(self, conn, doc: dict):
+        try:
+            conn.execute(f"UPDATE {self._table} SET doc = ? WHERE _id = ?", (dumps(doc), dumps(doc["_id"])))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} ({e})", 11000)
+
+    def _purge_expired_sync(self, conn):
+        now = datetime.now(timezone.utc)
+        for field, seconds in self._ttl.items():
+            cutoff = dumps(now - timedelta(seconds=seconds))
+            conn.execute(f"DELETE FROM {self._table} WHERE {_field_sql(field)} < ?", (cutoff,))
+
+    # ---------- reads ----------
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None, limit: int = 0):
+        cursor = SQLiteCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None):
+        docs = await self._find(filter or {}, sort or [], 0, 1)
+        return without_score(project(docs[0], projection)) if docs else None
+
+    async def _find(self, query: dict, sort, skip: int, limit: int) -> List[dict]:
+        return await self._read(self._select_sync, query, sort, skip, limit)
+
+    async def count_documents(self, filter: dict) -> int:
+        return len(await self._find(filter, [], 0, 0))
+
+    async def estimated_document_count(self) -> int:
+        def count(conn):
+            return conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+        return await self._read(count)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None) -> list:
+        unique = {}
+        for doc in await self._find(filter or {}, [], 0, 0):
+            value = get_path(doc, key)
+            for v in (value if isinstance(value, list) else [value]):
+                if v is not MISSING:
+                    unique.setdefault(dumps(v), v)
+        return list(unique.values())
+
+    def aggregate(self, pipeline: List[dict], **kwargs):
+        return SQLiteAggregationCursor(self, pipeline)
+
+    async def _aggregate(self, pipeline: List[dict]) -> List[dict]:
+        # Push a leading $match down to SQL
+        if pipeline and "$match" in pipeline[0]:
+            docs = await self._find(pipeline[0]["$match"], [], 0, 0)
+            pipeline = pipeline[1:]
+        else:
+            docs = await self._find({}, [], 0, 0)
+        return [without_score(doc) for doc in run_pipeline(docs, pipeline)]
+
+    # ---------- writes ----------
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        doc = dict(document)
+        await self._write(self._insert_sync, doc)
+        return InsertOneResult(document["_id"])
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        for document in documents:
+            if "_id" not in document:
+                document["_id"] = ObjectId()
+
+        def insert_all(conn):
+            errors = []
+            for index, document in enumerate(documents):
+                try:
+                    conn.execute("SAVEPOINT insert_doc")
+                    self._insert_sync(conn, dict(document))
+                    conn.execute("RELEASE insert_doc")
+                except DuplicateKeyError as e:
+                    conn.execute("ROLLBACK TO insert_doc")
+                    conn.execute("RELEASE insert_doc")
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": document})
+                    if ordered:
+                        break
+            return errors
+
+        errors = await self._write(insert_all)
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [],
+                "nInserted": len(documents) - len(errors) if not ordered else errors[0]["index"],
+            })
+        return InsertManyResult([d["_id"] for d in documents])
+
+    def _update_sync(self, conn, query: dict, update, upsert: bool, many: bool, sort=None,
+                     return_after: Optional[bool] = None):
+        docs = self._select_sync(conn, query, sort or [], 0, 0 if many else 1)
+        if not docs:
+            if not upsert:
+                return UpdateResult(0, 0), None
+            doc = apply_update(upsert_seed(query), update, inserting=True)
+            doc.setdefault("_id", ObjectId())
+            self._insert_sync(conn, doc)
+            return UpdateResult(0, 0, doc["_id"]), (doc if return_after else None)
+
+        modified = 0
+        before = after = None
+        for doc in docs:
+            original = dumps(doc)
+            before = decode(json.loads(original))
+            after = apply_update(doc, update, inserting=False)
+            if dumps(after) != original:
+                self._replace_sync(conn, after)
+                modified += 1
+        return UpdateResult(len(docs), modified), (after if return_after else before)
+
+    async def update_one(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        result, _ = await self._write(self._update_sync, filter, update, upsert, False)
+        return result
+
+    async def update_many(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        result, _ = await self._write(self._update_sync, filter, update, upsert, True)
+        return result
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        def replace(conn):
+            docs = self._select_sync(conn, filter, [], 0, 1)
+            if not docs:
+                if not upsert:
+                    return UpdateResult(0, 0)
+                doc = {**upsert_seed(filter), **replacement}
+                doc.setdefault("_id", ObjectId())
+                self._insert_sync(conn, doc)
+                return UpdateResult(0, 0, doc["_id"])
+            self._replace_sync(conn, {**replacement, "_id": docs[0]["_id"]})
+            return UpdateResult(1, 1)
+        return await self._write(replace)
+
+    async def find_one_and_update(self, filter: dict, update, projection: Optional[dict] = None, sort=None,
+                                  upsert: bool = False, return_document: bool = False, **kwargs):
+        _, doc = await self._write(self._update_sync, filter, update, upsert, False, sort, bool(return_document))
+        return project(doc, projection) if doc else None
+
+    def _delete_sync(self, conn, query: dict, many: bool, sort=None):
+        docs = self._select_sync(conn, query, sort or [], 0, 0 if many else 1)
+        for doc in docs:
+            conn.execute(f"DELETE FROM {self._table} WHERE _id = ?", (dumps(doc["_id"]),))
+        return docs
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult(len(await self._write(self._delete_sync, filter, False)))
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult(len(await self._write(self._delete_sync, filter, True)))
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None, sort=None, **kwargs):
+        docs = await self._write(self._delete_sync, filter, False, sort)
+        return project(docs[0], projection) if docs else None
+
+    async def drop(self):
+        def drop(conn):
+            conn.execute(f"DELETE FROM {self._table}")
+        await self._write(drop)
+
+    # ---------- indexes ----------
+
+    async def create_index(self, keys, unique: bool = False, expireAfterSeconds: Optional[int] = None,
+                           name: Optional[str] = None, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        fields = [k for k, _ in keys]
+        if any(d == "text" for _, d in keys):
+            # $text queries scan and score these fields
+            self._text_fields = [k for k, d in keys if d == "text"]
+            return name or "_".join(fields)
+        if any(d in ("2dsphere", "hashed") for _, d in keys):
+            # No SQLite equivalent; queries fall back to scans
+            return name or "_".join(fields)
+        if expireAfterSeconds is not None:
+            self._ttl[fields[0]] = expireAfterSeconds
+        index_name = name or f"ix_{self.name}_{'_'.join(fields)}".replace(".", "_")
+        await self.database._ensure_table(self.name)
+        await self.database._run_write(
+            lambda conn: conn.execute(
+                f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{index_name}" '
+                f'ON {self._table} ({", ".join(_field_sql(f) for f in fields)})'
+            )
+        )
+        return index_name
+
+
+# ==================== Database and client ====================
+
+class SQLiteDatabase:
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, SQLiteCollection] = {}
+        self._tables = set()
+        self._tables_lock = asyncio.Lock()
+
+    def __getattr__(self, name: str) -> SQLiteCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> SQLiteCollection:
+        if name not in self._collections:
+            self._collections[name] = SQLiteCollection(self, name)
+        return self._collections[name]
+
+    def get_collection(self, name: str, **kwargs) -> SQLiteCollection:
+        return self[name]
+
+    def with_options(self, **kwargs):
+        # Read preferences and concerns have no meaning for a single file
+        return self
+
+    async def create_collection(self, name: str, **kwargs) -> SQLiteCollection:
+        if name in self._tables:
+            raise CollectionInvalid(f"collection {name} already exists")
+        await self._ensure_table(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        def names(conn):
+            return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return await self._run_read(names)
+
+    async def command(self, command, *args, **kwargs):
+        if command == "ping" or command == {"ping": 1}:
+            return {"ok": 1}
+        raise OperationFailure(f"Command {command} is not supported by the SQLite backend")
+
+    async def _ensure_table(self, name: str):
+        if name in self._tables:
+            return
+        async with self._tables_lock:
+            if name in self._tables:
+                return
+
+            def create(conn):
+                table = f'"{name}"'
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+                for fields in DEFAULT_INDEXES.get(name, []):
+                    conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS "ix_{name}_{"_".join(fields)}" '
+                        f'ON {table} ({", ".join(_field_sql(f) for f in fields)})'
+                    )
+            await self._run_write(create)
+            self._tables.add(name)
+
+    async def _run_read(self, fn, *args):
+        return await self.client._run(self.client._readers, False, fn, *args)
+
+    async def _run_write(self, fn, *args):
+        return await self.client._run(self.client._writer, True, fn, *args)
+
+
+class SQLiteCommandEvent(NamedTuple):
+    """What command listeners receive for each statement batch run on the database"""
+    command_name: str
+    write: bool
+
+
+class SQLiteClient:
+    """Drop-in replacement for AsyncIOMotorClient backed by one SQLite file"""
+
+    def __init__(self, path: str, reader_threads: int = 4, event_listeners=()):
+        self.path = path
+        # pymongo-style command listeners; only `started` is called
+        self._listeners = list(event_listeners)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="sqlite-reader")
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._databases: Dict[str, SQLiteDatabase] = {}
+
+    def __getitem__(self, name: str) -> SQLiteDatabase:
+        if name not in self._databases:
+            self._databases[name] = SQLiteDatabase(self, name)
+        return self._databases[name]
+
+    def get_database(self, name: str = "baby_day_book") -> SQLiteDatabase:
+        return self[name]
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    async def _run(self, executor, write: bool, fn, *args):
+        for listener in self._listeners:
+            listener.started(SQLiteCommandEvent(fn.__name__, write))
+
+        def call():
+            conn = self._connection()
+            if not write:
+                return fn(conn, *args)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
@@ -0,0 +1,419 @@
+"""
+Visit summary reports for pediatrician appointments.
+
+A report covers one baby over a period of local days: averages per day,
+sleep and feeding charts, the growth measurements taken in the period and
+a per-day table. It is rendered as HTML with inline SVG charts, or as a
+PDF written by the small writer below (Helvetica only, so no font files
+or PDF library are needed).
+
+Rendering is CPU-bound, so it runs in a process pool, never on the event
+loop. ReportRenderer bounds how many renders run or wait at once, runs
+identical concurrent renders once, and keeps finished reports in an LRU
+cache. Cache keys include a digest of the report's input data, so any
+change to the data starts a new render, whichever worker made it.
+
+Only `render` and the functions it calls run in the pool's processes.
+This module must therefore stay importable without the server.
+"""
+import asyncio
+import hashlib
+import html
+import json
+import multiprocessing
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Hashable, List, Optional, Tuple
+
+FORMATS = {"pdf": "application/pdf", "html": "text/html; charset=utf-8"}
+
+PURPLE = (0.486, 0.227, 0.929)
+INDIGO = (0.388, 0.400, 0.945)
+AMBER = (0.961, 0.620, 0.043)
+GREY = (0.420, 0.447, 0.502)
+LIGHT = (0.898, 0.906, 0.922)
+
+
+class RendererBusy(Exception):
+    """Too many reports are being rendered or waiting already"""
+
+
+def data_version(data: dict) -> str:
+    """Digest of a report's input; equal digests render identical reports"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+# ==================== Content ====================
+
+def _per_day(days: List[dict], field: str) -> float:
+    return sum(day[field] for day in days) / len(days) if days else 0.0
+
+
+def summarize(data: dict) -> List[Tuple[str, str]]:
+    """(label, value) rows of per-day averages over the period"""
+    days = data["days"]
+    hours = lambda minutes: f"{minutes / 60:.1f} h"
+    return [
+        ("Feeds per day", f"{_per_day(days, 'feeds'):.1f}"),
+        ("Bottle per day", f"{_per_day(days, 'bottle_ml'):.0f} ml"),
+        ("Sleep per day", hours(_per_day(days, "sleep_minutes"))),
+        ("Night sleep per day", hours(_per_day(days, "night_minutes"))),
+        ("Day sleep per day", hours(_per_day(days, "day_minutes"))),
+        ("Longest stretch (average)", hours(_per_day(days, "longest_stretch_minutes"))),
+        ("Diapers per day", f"{_per_day(days, 'diapers'):.1f}"),
+        ("Wet / dirty / mixed per day",
+         " / ".join(f"{_per_day(days, kind):.1f}" for kind in ("wet", "dirty", "mixed"))),
+    ]
+
+
+def _growth_rows(data: dict) -> List[List[str]]:
+    number = lambda value, unit: f"{value:g} {unit}" if value is not None else "-"
+    return [
+        [row["date"][:10], number(row.get("weight_kg"), "kg"), number(row.get("height_cm"), "cm"),
+         number(row.get("head_circumference_cm"), "cm")]
+        for row in data["growth"]
+    ]
+
+
+def _daily_rows(data: dict) -> List[List[str]]:
+    return [
+        [day["date"], str(day["feeds"]), str(day["bottle_ml"]), f"{day['sleep_minutes'] / 60:.1f}",
+         str(day["naps"]), str(day["diapers"])]
+        for day in data["days"]
+    ]
+
+
+def _title(data: dict) -> Tuple[str, str]:
+    baby, period = data["baby"], data["period"]
+    subtitle = f"{period['start']} to {period['end']} ({period['days']} days)"
+    if baby.get("birth_date"):
+        subtitle = f"Born {baby['birth_date'][:10]} | " + subtitle
+    return f"Visit summary: {baby['name']}", subtitle
+
+
+GROWTH_HEADER = ["Date", "Weight", "Height", "Head"]
+DAILY_HEADER = ["Date", "Feeds", "Bottle ml", "Sleep h", "Sleeps", "Diapers"]
+
+
+# ==================== Charts ====================
+
+def _bar_chart(series: List[Tuple[str, Tuple[float, float, float], List[float]]], labels: List[str],
+               width: float, height: float, unit: str) -> list:
+    """Stacked bar chart as shapes in a box with the origin at the top left.
+
+    Shapes are ("rect", x, y, w, h, color), ("line", x1, y1, x2, y2, color)
+    and ("text", x, y, text, size, color), drawn by both output formats.
+    """
+    left, bottom = 34.0, 16.0
+    plot_w, plot_h = width - left, height - bottom
+    totals = [sum(values) for values in zip(*(values for _, _, values in series))] or [0.0]
+    top = max(max(totals), 1e-9)
+    shapes = []
+    for step in range(5):
+        value = top * step / 4
+        y = plot_h - plot_h * step / 4
+        shapes.append(("line", left, y, width, y, LIGHT))
+        shapes.append(("text", 0.0, y + 3, f"{value:.0f}{unit}" if top >= 4 else f"{value:.1f}{unit}", 7, GREY))
+    slot = plot_w / max(len(totals), 1)
+    bar = max(slot * 0.7, 1.0)
+    label_every = max(1, round(len(labels) / 8))
+    for index in range(len(totals)):
+        x = left + index * slot + (slot - bar) / 2
+        base = plot_h
+        for _, color, values in series:
+            h = plot_h * values[index] / top
+            if h > 0:
+                shapes.append(("rect", x, base - h, bar, h, color))
+                base -= h
+        if index % label_every == 0:
+            shapes.append(("text", x, height - 2, labels[index][5:], 7, GREY))
+    return shapes
+
+
+def _charts(data: dict, width: float) -> List[Tuple[str, list]]:
+    days = data["days"]
+    labels = [day["date"] for day in days]
+    return [
+        ("Sleep per day (hours): night and day", _bar_chart([
+            ("Night", INDIGO, [day["night_minutes"] / 60 for day in days]),
+            ("Day", AMBER, [day["day_minutes"] / 60 for day in days]),
+        ], labels, width, 120, "h")),
+        ("Feeds per day", _bar_chart([("Feeds", PURPLE, [day["feeds"] for day in days])], labels, width, 100, "")),
+    ]
+
+
+# ==================== HTML ====================
+
+def _rgb(color) -> str:
+    return "#%02x%02x%02x" % tuple(round(c * 255) for c in color)
+
+
+def _svg(shapes: list, width: float, height: float) -> str:
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}">']
+    for shape in shapes:
+        kind = shape[0]
+        if kind == "rect":
+            _, x, y, w, h, color = shape
+            parts.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{h:.1f}" fill="{_rgb(color)}"/>')
+        elif kind == "line":
+            _, x1, y1, x2, y2, color = shape
+            parts.append(f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" stroke="{_rgb(color)}"/>')
+        else:
+            _, x, y, text, size, color = shape
+            parts.append(f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" fill="{_rgb(color)}">'
+                         f'{html.escape(text)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def _html_table(header: List[str], rows: List[List[str]]) -> str:
+    head = "".join(f"<th>{html.escape(cell)}</th>" for cell in header)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>" for row in rows)
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+
+def render_html(data: dict) -> bytes:
+    title, subtitle = _title(data)
+    sections = [
+        "<h2>Averages</h2>",
+        _html_table(["", "Per day"], [list(row) for row in summarize(data)]),
+    ]
+    for chart_title, shapes in _charts(data, 640):
+        height = max(shape[2] for shape in shapes if shape[0] == "text") + 2
+        sections.append(f"<h2>{html.escape(chart_title)}</h2>{_svg(shapes, 640, height)}")
+    sections.append("<h2>Growth</h2>")
+    growth = _growth_rows(data)
+    sections.append(_html_table(GROWTH_HEADER, growth) if growth else "<p>No measurements in this period.</p>")
+    sections.append("<h2>Day by day</h2>")
+    sections.append(_html_table(DAILY_HEADER, _daily_rows(data)))
+
+    document = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+body {{ font-family: -apple-system, 'Segoe UI', Roboto, sans-serif; color: #1F2937; padding: 32px; }}
+h1, h2 {{ color: #7C3AED; }} h2 {{ font-size: 18px; border-bottom: 1px solid #E5E7EB; padding-bottom: 6px; }}
+p.subtitle {{ color: #6B7280; }}
+table {{ border-collapse: collapse; width: 100%; }} th, td {{ text-align: left; padding: 6px 10px; }}
+th {{ background: #F8F4FF; }} tr:nth-child(even) td {{ background: #F9FAFB; }}
+</style></head>
+<body><h1>{html.escape(title)}</h1><p class="subtitle">{html.escape(subtitle)}</p>
+{"".join(sections)}
+</body></html>"""
+    return document.encode("utf-8")
+
+
+# ==================== PDF ====================
+
+def _pdf_text(text: str) -> str:
+    text = text.encode("cp1252", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+class _PdfCanvas:
+    """A4 pages of text, lines and filled rectangles; y grows downwards like the layout"""
+
+    WIDTH, HEIGHT, MARGIN = 595.0, 842.0, 48.0
+
+    def __init__(self):
+        self.pages: List[List[str]] = []
+        self.y = 0.0
+        self.new_page()
+
+    def new_page(self):
+        self.pages.append([])
+        self.y = self.MARGIN
+
+    def ensure(self, height: float):
+        if self.y + height > self.HEIGHT - self.MARGIN:
+            self.new_page()
+
+    def text(self, x: float, y: float, text: str, size: float = 10, bold: bool = False, color=(0, 0, 0)):
+        font = "F2" if bold else "F1"
+        self.pages[-1].append(
+            "%.3f %.3f %.3f rg BT /%s %.1f Tf %.1f %.1f Td (%s) Tj ET"
+            % (*color, font, size, x, self.HEIGHT - y, _pdf_text(text))
+        )
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, color=(0, 0, 0)):
+        self.pages[-1].append(
+            "%.3f %.3f %.3f RG 0.5 w %.1f %.1f m %.1f %.1f l S"
+            % (*color, x1, self.HEIGHT - y1, x2, self.HEIGHT - y2)
+        )
+
+    def rect(self, x: float, y: float, w: float, h: float, color):
+        self.pages[-1].append("%.3f %.3f %.3f rg %.1f %.1f %.1f %.1f re f" % (*color, x, self.HEIGHT - y - h, w, h))
+
+    def shapes(self, shapes: list, x0: float, y0: float):
+        for shape in shapes:
+            if shape[0] == "rect":
+                _, x, y, w, h, color = shape
+                self.rect(x0 + x, y0 + y, w, h, color)
+            elif shape[0] == "line":
+                _, x1, y1, x2, y2, color = shape
+                self.line(x0 + x1, y0 + y1, x0 + x2, y0 + y2, color)
+            else:
+                _, x, y, text, size, color = shape
+                self.text(x0 + x, y0 + y, text, size, color=color)
+
+    def to_bytes(self) -> bytes:
+        objects: List[bytes] = []
+        page_ids = []
+        # 1 catalog, 2 page tree, 3-4 fonts, then a (page, content) pair per page
+        for index, operations in enumerate(self.pages):
+            content = zlib.compress("\n".join(operations).encode("latin-1"))
+            page_id = 5 + 2 * index
+            page_ids.append(page_id)
+            objects.append(
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R "
+                b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>"
+                % (self.WIDTH, self.HEIGHT, page_id + 1)
+            )
+            objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content
+                           + b"\nendstream")
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids)),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        ] + objects
+
+        out = bytearray(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+        return bytes(out)
+
+
+def _pdf_table(canvas: _PdfCanvas, header: List[str], rows: List[List[str]], widths: List[float]):
+    row_height = 16.0
+    left = canvas.MARGIN
+
+    def draw_header():
+        canvas.rect(left, canvas.y, sum(widths), row_height, (0.973, 0.957, 1.0))
+        x = left
+        for cell, width in zip(header, widths):
+            canvas.text(x + 4, canvas.y + 11, cell, 9, bold=True)
+            x += width
+        canvas.y += row_height
+
+    canvas.ensure(row_height * 2)
+    draw_header()
+    for row in rows:
+        if canvas.y + row_height > canvas.HEIGHT - canvas.MARGIN:
+            canvas.new_page()
+            draw_header()
+        x = left
+        for cell, width in zip(row, widths):
+            canvas.text(x + 4, canvas.y + 11, cell, 9)
+            x += width
+        canvas.line(left, canvas.y + row_height, left + sum(widths), canvas.y + row_height, LIGHT)
+        canvas.y += row_height
+    canvas.y += 10
+
+
+def _pdf_heading(canvas: _PdfCanvas, text: str):
+    canvas.ensure(40)
+    canvas.y += 14
+    canvas.text(canvas.MARGIN, canvas.y, text, 13, bold=True, color=PURPLE)
+    canvas.y += 10
+
+
+def render_pdf(data: dict) -> bytes:
+    canvas = _PdfCanvas()
+    content_width = canvas.WIDTH - 2 * canvas.MARGIN
+    title, subtitle = _title(data)
+    canvas.y += 10
+    canvas.text(canvas.MARGIN, canvas.y, title, 20, bold=True, color=PURPLE)
+    canvas.y += 18
+    canvas.text(canvas.MARGIN, canvas.y, subtitle, 10, color=GREY)
+    canvas.y += 10
+
+    _pdf_heading(canvas, "Averages")
+    _pdf_table(canvas, ["", "Per day"], [list(row) for row in summarize(data)], [260, 120])
+
+    for chart_title, shapes in _charts(data, content_width):
+        height = max(shape[2] for shape in shapes if shape[0] == "text") + 4
+        _pdf_heading(canvas, chart_title)
+        canvas.ensure(height + 10)
+        canvas.shapes(shapes, canvas.MARGIN, canvas.y + 6)
+        canvas.y += height + 16
+
+    _pdf_heading(canvas, "Growth")
+    growth = _growth_rows(data)
+    if growth:
+        _pdf_table(canvas, GROWTH_HEADER, growth, [110, 110, 110, 110])
+    else:
+        canvas.y += 8
+        canvas.text(canvas.MARGIN, canvas.y, "No measurements in this period.", 10, color=GREY)
+        canvas.y += 10
+
+    _pdf_heading(canvas, "Day by day")
+    _pdf_table(canvas, DAILY_HEADER, _daily_rows(data), [100, 70, 80, 70, 70, 70])
+    return canvas.to_bytes()
+
+
+def render(data: dict, fmt: str) -> bytes:
+    """Entry point of the pool's processes"""
+    return render_pdf(data) if fmt == "pdf" else render_html(data)
+
+
+# ==================== Renderer ====================
+
+class ReportRenderer:
+    """Renders reports in a process pool with bounded concurrency and an LRU cache"""
+
+    def __init__(self, max_workers: int = 2, max_queued: int = 8, cache_bytes: int = 32 * 1024 * 1024):
+        self.max_workers = max_workers
+        self.max_pending = max_workers + max_queued
+        self.cache_bytes = cache_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._cache: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Created on first use; "spawn" children import only this module, not the server
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def render(self, key: Hashable, data: dict, fmt: str) -> bytes:
+        """Render `data`, sharing results by `key` (which must include data_version(data))"""
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            if len(self._inflight) >= self.max_pending:
+                raise RendererBusy()
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(loop.run_in_executor(self._pool(), render, data, fmt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        content = task.result()
+        if len(content) > self.cache_bytes:
+            return
+        self._cache[key] = content
+        self._cached_bytes += len(content)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
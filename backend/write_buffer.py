@@ -0,0 +1,116 @@
+"""
+Group-commit buffer for high-frequency record inserts.
+
+Inserts into the same collection that arrive within a short window are
+flushed together with a single unordered `insert_many`. Each caller awaits
+its own future, which resolves once the batch containing its document has
+been acknowledged, or raises the error for its document if that write
+failed. The number of buffered documents is bounded, so callers wait
+instead of growing the queue when MongoDB falls behind.
+
+Disabled by default (window of 0ms): every insert goes straight to
+`insert_one`, exactly as before.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+from pymongo.errors import BulkWriteError, WriteError
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    def __init__(self, window_ms: float = 0, max_batch: int = 500, max_pending: int = 5000):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pending: Dict[str, List[Tuple[dict, asyncio.Future]]] = {}
+        self._collections = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flushes = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def insert(self, collection, doc: dict):
+        """Insert a document, batched with concurrent inserts into the same collection"""
+        if not self.enabled:
+            await collection.insert_one(doc)
+            return
+
+        # Backpressure: wait for room once max_pending documents are in flight.
+        # The slot is held until the document's batch is settled, not until the
+        # caller stops waiting, so cancelled requests still count against the bound.
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(lambda _: self._slots.release())
+        name = collection.name
+        self._collections[name] = collection
+        batch = self._pending.setdefault(name, [])
+        batch.append((doc, future))
+
+        if len(batch) >= self.max_batch:
+            self._start_flush(name)
+        elif name not in self._timers:
+            self._timers[name] = loop.call_later(self.window, self._start_flush, name)
+
+        # A cancelled request must not cancel the write shared with its batch
+        await asyncio.shield(future)
+
+    def _start_flush(self, name: str):
+        timer = self._timers.pop(name, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(name, None)
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._flush(self._collections[name], batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, collection, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            await collection.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            details = e.details or {}
+            if details.get("writeConcernErrors"):
+                # Not acknowledged as requested: none of the writes can be trusted
+                for _, future in batch:
+                    _fail(future, e)
+                return
+            failed = {err["index"]: err for err in details.get("writeErrors", [])}
+            for index, (_, future) in enumerate(batch):
+                err = failed.get(index)
+                if err:
+                    _fail(future, WriteError(err.get("errmsg"), err.get("code"), err))
+                else:
+                    _resolve(future)
+            return
+        except Exception as e:
+            logger.warning("Batched insert of %d documents into %s failed: %s", len(batch), collection.name, e)
+            for _, future in batch:
+                _fail(future, e)
+            return
+
+        for _, future in batch:
+            _resolve(future)
+
+    async def close(self):
+        """Flush everything still buffered and wait for in-flight batches"""
+        for name in list(self._pending):
+            self._start_flush(name)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _fail(future: asyncio.Future, exc: Exception):
+    if not future.done():
+        future.set_exception(exc)
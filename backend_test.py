@@ -7,11 +7,12 @@ Tests all backend endpoints with proper authentication
 import requests
 import json
 import sys
+import os
 from datetime import datetime, timezone, timedelta
 from typing import Dict, Any, Optional
 
 # Backend URL from frontend .env
-BACKEND_URL = "https://babycare-tracker.preview.emergentagent.com/api"
+BACKEND_URL = os.environ.get("BACKEND_URL", "https://babycare-tracker.preview.emergentagent.com/api")
 
 class BabyDayBookTester:
     def __init__(self):
@@ -404,6 +405,30 @@ class BabyDayBookTester:
         except Exception as e:
             self.log_test("Sleep prediction", False, f"Exception: {str(e)}")
     
+    def test_dashboard(self):
+        """Test home dashboard endpoint"""
+        if not self.baby_id:
+            self.log_test("Dashboard", False, "No baby_id available")
+            return
+        
+        try:
+            response = self.make_request("GET", "/dashboard")
+            
+            if response.status_code == 200:
+                dashboard = response.json()
+                entry = next((b for b in dashboard.get("babies", []) if b["baby"]["baby_id"] == self.baby_id), None)
+                if entry and "stats" in entry and "timeline" in entry and "sleep_prediction" in entry:
+                    self.log_test("Get dashboard", True, 
+                                f"Babies: {len(dashboard['babies'])}, "
+                                f"Pending invites: {len(dashboard.get('pending_invites', []))}")
+                else:
+                    self.log_test("Get dashboard", False, f"Baby missing from dashboard: {dashboard}")
+            else:
+                self.log_test("Get dashboard", False, f"Status: {response.status_code}")
+                
+        except Exception as e:
+            self.log_test("Dashboard", False, f"Exception: {str(e)}")
+    
     def run_all_tests(self):
         """Run all backend tests"""
         print("🚀 Starting Baby Day Book Backend API Tests")
@@ -436,6 +461,7 @@ class BabyDayBookTester:
         self.test_timeline()
         self.test_statistics()
         self.test_sleep_prediction()
+        self.test_dashboard()
         
         # Summary
         print("\n" + "=" * 60)
@@ -31,6 +31,42 @@ const api = axios.create({
   withCredentials: true,
 });
 
+// Short-lived access token, kept in memory and renewed with the stored session token
+let accessToken: { token: string; expiresAt: number } | null = null;
+let refreshing: Promise<string | null> | null = null;
+
+const saveAccessToken = (data: { access_token?: string; access_token_expires_at?: string }) => {
+  if (data.access_token && data.access_token_expires_at) {
+    accessToken = { token: data.access_token, expiresAt: Date.parse(data.access_token_expires_at) };
+  }
+};
+
+const refreshAccessToken = async (sessionToken: string): Promise<string | null> => {
+  try {
+    const response = await axios.post(`${BACKEND_URL}/api/auth/refresh`, {}, {
+      headers: { Authorization: `Bearer ${sessionToken}` },
+      withCredentials: true,
+    });
+    saveAccessToken(response.data);
+    return accessToken?.token ?? null;
+  } catch {
+    return null;
+  }
+};
+
+const getAccessToken = async (sessionToken: string): Promise<string | null> => {
+  // Renew a little before expiry so requests in flight don't race it
+  if (accessToken && accessToken.expiresAt - Date.now() > 30000) {
+    return accessToken.token;
+  }
+  if (!refreshing) {
+    refreshing = refreshAccessToken(sessionToken).finally(() => {
+      refreshing = null;
+    });
+  }
+  return refreshing;
+};
+
 // Token storage helpers
 const getToken = async (): Promise<string | null> => {
   try {
@@ -56,6 +92,7 @@ const setToken = async (token: string): Promise<void> => {
 };
 
 const removeToken = async (): Promise<void> => {
+  accessToken = null;
   try {
     if (Platform.OS === 'web') {
       await AsyncStorage.removeItem('session_token');
@@ -69,9 +106,14 @@ const removeToken = async (): Promise<void> => {
 
 // Add auth header to requests
 api.interceptors.request.use(async (config) => {
+  if (config.headers.Authorization) {
+    return config;
+  }
   const token = await getToken();
   if (token) {
-    config.headers.Authorization = `Bearer ${token}`;
+    // The session token still works if no access token can be obtained
+    const access = await getAccessToken(token);
+    config.headers.Authorization = `Bearer ${access || token}`;
   }
   return config;
 });
@@ -84,6 +126,7 @@ export const authApi = {
     });
     if (response.data.session_token) {
       await setToken(response.data.session_token);
+      saveAccessToken(response.data);
     }
     return response.data;
   },
@@ -94,7 +137,9 @@ export const authApi = {
   },
 
   logout: async (): Promise<void> => {
-    await api.post('/auth/logout');
+    // Sent with the session token so the session itself is ended
+    const token = await getToken();
+    await api.post('/auth/logout', {}, token ? { headers: { Authorization: `Bearer ${token}` } } : {});
     await removeToken();
   },
 
@@ -0,0 +1,74 @@
+"""
+Shared fixtures for the backend unit tests.
+
+The backend modules import each other by plain name (they run from
+backend/), so that directory goes on sys.path. Storage-backed tests run
+against the embedded SQLite backend in a temporary file, which implements
+the Motor API the engines use. Endpoint tests drive the whole app the same
+way, through one client and database shared by the test session; each test
+signs up its own users so their data doesn't mix.
+"""
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from sqlite_store import SQLiteClient  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    client = SQLiteClient(str(tmp_path / "test.db"))
+    yield client["baby_day_book"]
+    client.close()
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = str(tmp_path_factory.mktemp("server") / "server.db")
+    os.environ["ACCESS_LOG"] = "false"
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def api(server):
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def run(api):
+    """Run a coroutine function on the app's event loop, e.g. to seed or inspect the database"""
+    return api.portal.call
+
+
+@pytest.fixture
+def sign_up(server, run):
+    """Create a user with a session and return its Authorization header"""
+    def create(name="Parent"):
+        user_id, token = f"user_{uuid.uuid4().hex[:12]}", f"session_{uuid.uuid4().hex}"
+        now = datetime.now(timezone.utc)
+        run(server.db.users.insert_one, {"user_id": user_id, "email": f"{user_id}@example.com",
+                                         "name": name, "created_at": now})
+        run(server.db.user_sessions.insert_one, {"user_id": user_id, "session_token": token,
+                                                 "expires_at": now + timedelta(days=1), "created_at": now})
+        return {"Authorization": f"Bearer {token}"}
+    return create
+
+
+@pytest.fixture
+def add_baby(api):
+    """Create a baby owned by the given user and return its id"""
+    def create(headers, name="Baby", birth_date="2025-01-01"):
+        response = api.post("/api/baby", json={"name": name, "birth_date": birth_date}, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()["baby_id"]
+    return create
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from access_log import ACCESS_LOGGER, AccessLogMiddleware, CommandCounter, note_user
+from sqlite_store import SQLiteClient
+
+
+@pytest.fixture
+def app(tmp_path):
+    client = SQLiteClient(str(tmp_path / "log.db"), event_listeners=[CommandCounter()])
+    db = client["baby_day_book"]
+    # Create the table up front, so each request only counts its own reads
+    asyncio.run(db.babies.insert_one({"baby_id": "baby_1"}))
+    app = FastAPI()
+
+    @app.get("/api/reads/{baby_id}")
+    async def reads(baby_id: str, count: int):
+        note_user("user_1")
+        for _ in range(count):
+            # Yield between commands, so concurrent requests interleave
+            await db.babies.find_one({"baby_id": baby_id})
+            await asyncio.sleep(0.001)
+        return {}
+
+    @app.get("/api/missing")
+    async def missing():
+        raise HTTPException(status_code=404)
+
+    yield app
+    client.close()
+
+
+def access_lines(caplog):
+    return [record.access for record in caplog.records if record.name == ACCESS_LOGGER]
+
+
+def call(app, *paths):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.get(path) for path in paths))
+    return asyncio.run(scenario())
+
+
+def test_database_commands_are_counted_per_request(app, caplog):
+    app.add_middleware(AccessLogMiddleware)
+    caplog.set_level(logging.INFO, logger=ACCESS_LOGGER)
+    call(app, "/api/reads/baby_1?count=2", "/api/reads/baby_2?count=5", "/api/reads/baby_3?count=0")
+
+    lines = access_lines(caplog)
+    assert sorted(line["db_commands"] for line in lines) == [0, 2, 5]
+    line = lines[0]
+    assert line["route"] == "/api/reads/{baby_id}" and line["status"] == 200
+    assert line["user"] and line["baby"] and "baby_" not in line["baby"]
+
+
+def test_errors_are_logged_whatever_the_sample_rate(app, caplog):
+    app.add_middleware(AccessLogMiddleware, sample_rate=0)
+    caplog.set_level(logging.INFO, logger=ACCESS_LOGGER)
+    call(app, "/api/reads/baby_1?count=1", "/api/missing")
+
+    (line,) = access_lines(caplog)
+    assert (line["route"], line["status"], line["reason"], line["sample_rate"]) == ("/api/missing", 404, "error", 1.0)
@@ -0,0 +1,52 @@
+import asyncio
+from datetime import datetime, timezone
+
+import access_tokens
+from access_tokens import AccessTokens, session_id
+
+USER = {"user_id": "user_1", "email": "a@example.com", "name": "A", "created_at": datetime(2025, 1, 1)}
+
+
+def test_issued_token_verifies():
+    tokens = AccessTokens("secret")
+    token, expires_at = tokens.issue(USER, "session_1")
+    assert tokens.verify(token)["user_id"] == "user_1"
+    assert expires_at > datetime.now(timezone.utc)
+
+
+def test_tampered_and_malformed_tokens_are_rejected():
+    tokens = AccessTokens("secret")
+    token, _ = tokens.issue(USER, "session_1")
+    assert tokens.verify(token[:-1] + ("A" if token[-1] != "A" else "B")) is None
+    assert AccessTokens("other").verify(token) is None
+    # Non-ASCII input must be an invalid token, not a server error
+    for bad in ("v1.abc.\xe9", "v1.\xe9.abc", "v1.", "v1.abc"):
+        assert tokens.verify(bad) is None
+
+
+def test_tokens_expire(monkeypatch):
+    tokens = AccessTokens("secret", ttl_seconds=60)
+    token, expires_at = tokens.issue(USER, "session_1")
+    now = expires_at.timestamp()
+    monkeypatch.setattr(access_tokens.time, "time", lambda: now - 1)
+    assert tokens.verify(token) is not None
+    monkeypatch.setattr(access_tokens.time, "time", lambda: now + 1)
+    assert tokens.verify(token) is None
+
+
+def test_a_revoked_session_is_rejected_by_every_worker(db):
+    worker, other = AccessTokens("secret"), AccessTokens("secret")
+    token, _ = worker.issue(USER, "session_1")
+
+    async def scenario():
+        await worker.setup(db)
+        await other.setup(db)
+        await worker.revoke(session_id("session_1"))
+        await other.poll()
+        await worker.close()
+        await other.close()
+
+    asyncio.run(scenario())
+    assert worker.verify(token) is None and other.verify(token) is None
+    # Other sessions of the same user are unaffected
+    assert other.verify(worker.issue(USER, "session_2")[0])["user_id"] == "user_1"
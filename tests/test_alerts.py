@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from alerts import AlertEngine, InboxNotifier, _duration
+
+FED_AT = datetime(2025, 1, 1, 8, 0)
+
+
+class RecordingNotifier:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, alert):
+        self.sent.append(alert)
+
+
+class FailingNotifier:
+    async def send(self, alert):
+        raise RuntimeError("gateway down")
+
+
+def state(fed_at=FED_AT):
+    return {"last_feeding": {"feeding_id": "feed_1", "start_time": fed_at}, "ongoing_sleep": None}
+
+
+def test_durations():
+    assert [_duration(m) for m in (45, 60, 150)] == ["45 min", "1 h", "2 h 30 min"]
+
+
+def test_rule_deadline_follows_the_state(db):
+    engine = AlertEngine(db, [])
+
+    async def scenario():
+        await engine.setup()
+        created = await engine.set_rule("baby_1", "no_feed", 240, state(), "user_1")
+        asleep = await engine.set_rule("baby_1", "long_sleep", 180, state(), "user_1")
+        await engine.state_changed("baby_1", state(FED_AT + timedelta(hours=3)), ["last_feeding"])
+        return created, asleep, await engine.list_rules("baby_1")
+
+    created, asleep, rules = asyncio.run(scenario())
+    assert created["due_at"] == FED_AT + timedelta(hours=4)
+    # Nothing to measure from yet: never due
+    assert asleep["due_at"] is None
+    no_feed = next(rule for rule in rules if rule["rule"] == "no_feed")
+    assert no_feed["since"] == FED_AT + timedelta(hours=3)
+    assert no_feed["due_at"] == FED_AT + timedelta(hours=7)
+
+
+def test_state_changes_only_write_rules_that_move(db):
+    engine = AlertEngine(db, [])
+    writes = []
+
+    async def scenario():
+        await engine.setup()
+        await engine.set_rule("baby_1", "no_feed", 240, state(), "user_1")
+        await engine.set_rule("baby_1", "long_sleep", 180, state(), "user_1")
+        update_one = engine.rules.update_one
+
+        async def counting(*args, **kwargs):
+            writes.append(args[0]["rule"])
+            return await update_one(*args, **kwargs)
+
+        engine.rules.update_one = counting
+        await engine.state_changed("baby_2", state(FED_AT + timedelta(hours=1)))
+        await engine.state_changed("baby_1", state())
+        await engine.state_changed("baby_1", state(FED_AT + timedelta(hours=1)))
+
+    asyncio.run(scenario())
+    # No rules, or an unchanged `since`, costs a read and no write
+    assert writes == ["no_feed"]
+
+
+def test_due_rules_fire_once_until_the_state_moves(db):
+    notifier = RecordingNotifier()
+    engine = AlertEngine(db, [FailingNotifier(), notifier])
+
+    async def scenario():
+        await engine.setup()
+        await engine.set_rule("baby_1", "no_feed", 240, state(), "user_1")
+        early = await engine.fire_due(FED_AT + timedelta(hours=3))
+        due = await engine.fire_due(FED_AT + timedelta(hours=5))
+        again = await engine.fire_due(FED_AT + timedelta(hours=6))
+        # An edit that leaves the last feed unchanged doesn't re-arm the rule
+        await engine.state_changed("baby_1", state(), ["last_feeding"])
+        unchanged = await engine.fire_due(FED_AT + timedelta(hours=7))
+        await engine.state_changed("baby_1", state(FED_AT + timedelta(hours=6)), ["last_feeding"])
+        moved = await engine.fire_due(FED_AT + timedelta(hours=11))
+        return early, due, again, unchanged, moved
+
+    assert asyncio.run(scenario()) == (0, 1, 0, 0, 1)
+    first = notifier.sent[0]
+    assert first["message"] == "No feed logged for 4 h"
+    assert first["due_at"] == FED_AT + timedelta(hours=4)
+    assert first["fired_at"] == FED_AT + timedelta(hours=5)
+
+
+def test_concurrent_workers_fire_each_alert_once(db):
+    notifier = RecordingNotifier()
+    engines = [AlertEngine(db, [notifier]) for _ in range(3)]
+
+    async def scenario():
+        await engines[0].setup()
+        for baby in range(5):
+            await engines[0].set_rule(f"baby_{baby}", "no_feed", 60, state(), "user_1")
+        return await asyncio.gather(*(engine.fire_due(FED_AT + timedelta(hours=2)) for engine in engines))
+
+    assert sum(asyncio.run(scenario())) == 5
+    assert sorted(alert["baby_id"] for alert in notifier.sent) == [f"baby_{baby}" for baby in range(5)]
+
+
+def test_inbox_keeps_fired_alerts(db):
+    engine = AlertEngine(db, [InboxNotifier(db.alerts)])
+
+    async def scenario():
+        await engine.setup()
+        await engine.set_rule("baby_1", "no_feed", 60, state(), "user_1")
+        await engine.fire_due(FED_AT + timedelta(hours=2))
+        return await db.alerts.find({"baby_id": "baby_1"}, {"_id": 0}).to_list(None)
+
+    [alert] = asyncio.run(scenario())
+    assert alert["rule"] == "no_feed"
+    assert alert["expires_at"] == alert["fired_at"] + timedelta(days=30)
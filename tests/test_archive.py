@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from archive import EventArchive
+from event_store import EventStore
+
+OLD = datetime(2020, 3, 1, 8, 0)
+
+
+def diapers(count=3):
+    return [{"diaper_id": f"diaper_{n}", "baby_id": "baby_1", "user_id": "u", "diaper_type": "wet",
+             "time": OLD + timedelta(hours=n)} for n in range(count)]
+
+
+def everything(store: EventStore):
+    return store.find("diaper", ["baby_1"], datetime(2020, 1, 1), datetime(2020, 12, 1)).to_list(None)
+
+
+def test_archived_records_are_still_read(db):
+    store = EventStore(db)
+
+    async def scenario():
+        await db.diaper_records.insert_many(diapers())
+        moved = await store.archive.run(older_than_days=365, refresh_seconds=0)
+        return moved, await db.diaper_records.count_documents({}), await everything(store)
+
+    moved, hot, records = asyncio.run(scenario())
+    assert moved["diaper"] == 3 and hot == 0
+    assert sorted(r["diaper_id"] for r in records) == ["diaper_0", "diaper_1", "diaper_2"]
+
+
+def test_restore_moves_a_record_back_to_be_edited(db):
+    store = EventStore(db)
+
+    async def scenario():
+        await db.diaper_records.insert_many(diapers())
+        await store.archive.run(older_than_days=365, refresh_seconds=0)
+        forbidden = await store.restore("diaper", "diaper_1", ["baby_2"])
+        restored = await store.restore("diaper", "diaper_1", ["baby_1"])
+        hot = await db.diaper_records.find({}, {"_id": 0, "diaper_id": 1}).to_list(None)
+        bucket = await db.event_archive.find_one({})
+        return forbidden, restored, hot, bucket, await everything(store)
+
+    forbidden, restored, hot, bucket, records = asyncio.run(scenario())
+    assert (forbidden, restored) == (False, True)
+    assert hot == [{"diaper_id": "diaper_1"}]
+    assert bucket["ids"] == ["diaper_0", "diaper_2"] and bucket["count"] == 2
+    assert sorted(r["diaper_id"] for r in records) == ["diaper_0", "diaper_1", "diaper_2"]
+
+
+class EditingArchive(EventArchive):
+    """Edits a record right after the job has copied it into its bucket"""
+
+    async def _update_bucket(self, event_type, baby_id, month, change):
+        await super()._update_bucket(event_type, baby_id, month, change)
+        if not getattr(self, "edited", False):
+            self.edited = True
+            await self.db.diaper_records.update_one(
+                {"diaper_id": "diaper_1"}, {"$set": {"diaper_type": "dirty", "updated_at": datetime.now()}}
+            )
+
+
+def test_an_edit_during_archival_is_not_lost(db):
+    archive = EditingArchive(db)
+
+    async def scenario():
+        await db.diaper_records.insert_many(diapers())
+        await archive.setup()
+        await archive.set_horizon(datetime(2021, 1, 1))
+        moved = await archive.archive_month("diaper", "baby_1", datetime(2020, 3, 1))
+        hot = await db.diaper_records.find({}, {"_id": 0}).to_list(None)
+        bucket = await db.event_archive.find_one({})
+        return moved, hot, bucket
+
+    moved, hot, bucket = asyncio.run(scenario())
+    assert moved == 2
+    assert [(r["diaper_id"], r["diaper_type"]) for r in hot] == [("diaper_1", "dirty")]
+    # The stale copy is dropped from the bucket; the next run archives the edited one
+    assert bucket["ids"] == ["diaper_0", "diaper_2"]
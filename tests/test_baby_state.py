@@ -0,0 +1,43 @@
+def test_state_follows_creates_updates_and_deletes(api, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+
+    def state():
+        response = api.get(f"/api/state/{baby_id}", headers=headers)
+        assert response.status_code == 200
+        return response.json()
+
+    nap = {"baby_id": baby_id, "sleep_type": "nap", "start_time": "2025-06-01T09:00:00"}
+    sleep = api.post("/api/sleep", json=nap, headers=headers).json()
+    assert state()["ongoing_sleep"]["sleep_id"] == sleep["sleep_id"]
+
+    api.put(f"/api/sleep/{sleep['sleep_id']}", json={**nap, "end_time": "2025-06-01T10:00:00"}, headers=headers)
+    current = state()
+    assert current["ongoing_sleep"] is None
+    assert current["last_sleep"]["sleep_id"] == sleep["sleep_id"]
+
+    older, newer = (
+        api.post("/api/diaper", json={"baby_id": baby_id, "diaper_type": kind, "time": time}, headers=headers).json()
+        for kind, time in (("wet", "2025-06-01T08:00:00"), ("dirty", "2025-06-01T11:00:00"))
+    )
+    current = state()
+    assert current["last_diaper"]["diaper_id"] == newer["diaper_id"]
+    assert current["last_wet_diaper"]["diaper_id"] == older["diaper_id"]
+
+    # Deleting the latest record falls back to the one before it
+    api.delete(f"/api/diaper/{newer['diaper_id']}", headers=headers)
+    assert state()["last_diaper"]["diaper_id"] == older["diaper_id"]
+
+
+def test_an_older_record_does_not_replace_the_latest(api, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+
+    def feed(start_time):
+        return api.post("/api/feeding", json={"baby_id": baby_id, "feeding_type": "bottle", "amount_ml": 90,
+                                              "start_time": start_time}, headers=headers).json()
+
+    latest = feed("2025-06-01T12:00:00")
+    feed("2025-06-01T06:00:00")
+    state = api.get(f"/api/state/{baby_id}", headers=headers).json()
+    assert state["last_feeding"]["feeding_id"] == latest["feeding_id"]
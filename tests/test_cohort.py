@@ -0,0 +1,79 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from cohort import MAX_AGE_WEEKS, METRICS, PERCENTILES, age_in_weeks, build_cohort_tables, compare, percentile_table
+from event_store import EventStore
+
+
+def test_age_in_weeks_accepts_both_date_shapes():
+    assert age_in_weeks({"birth_date": "2025-01-01"}, date(2025, 1, 15)) == 2
+    assert age_in_weeks({"birth_date": datetime(2025, 1, 1)}, date(2025, 1, 14)) == 1
+    assert age_in_weeks({"birth_date": "2025-01-01"}, date(2024, 12, 31)) is None
+    assert age_in_weeks({"birth_date": "unknown"}, date(2025, 1, 1)) is None
+
+
+def test_percentile_table_buckets_by_week_and_hides_small_cohorts():
+    weeks = np.array([3] * 10 + [4] * 2, dtype=np.uint16)
+    values = np.array(list(range(1, 11)) + [5, 6], dtype=np.float64)
+    table = percentile_table(weeks, values, min_babies=10)
+
+    assert len(table) == MAX_AGE_WEEKS
+    assert table[3] == [10] + np.round(np.percentile(np.arange(1, 11), PERCENTILES), 1).tolist()
+    assert table[4] is None
+    assert table[0] is None
+
+
+def table_with(row):
+    metrics = {metric: [None] * MAX_AGE_WEEKS for metric in METRICS}
+    metrics["sleep_minutes"][10] = row
+    return {"metrics": metrics, "percentiles": list(PERCENTILES)}
+
+
+def test_compare_interpolates_between_cuts():
+    table = table_with([40, 500, 600, 700, 800, 900])
+    assert compare(table, 10, "sleep_minutes", 700)["percentile"] == 50
+    assert compare(table, 10, "sleep_minutes", 650)["percentile"] == 38
+    # Clamped to the outermost cuts
+    assert compare(table, 10, "sleep_minutes", 100)["percentile"] == 10
+    assert compare(table, 10, "sleep_minutes", 2000)["percentile"] == 90
+    assert compare(table, 10, "sleep_minutes", 700)["percentiles"]["p75"] == 800
+    assert compare(table, 11, "sleep_minutes", 700) is None
+    assert compare(table, -1, "sleep_minutes", 700) is None
+
+
+def test_compare_puts_ties_in_the_middle():
+    # Diaper counts are small integers, so cuts repeat often
+    assert compare(table_with([40, 6, 6, 6, 6, 6]), 10, "sleep_minutes", 6)["percentile"] == 50
+
+
+def test_build_cohort_tables_from_stored_history(db):
+    today = datetime.now(timezone.utc).date()
+    born = today - timedelta(days=8 * 7)
+
+    async def scenario():
+        babies, feedings = [], []
+        for index in range(3):
+            baby_id = f"baby_{index}"
+            babies.append({"baby_id": baby_id, "birth_date": born.isoformat(), "name": "private"})
+            # Week 1 of age: four days with index + 1 feeds each
+            for day in range(7, 11):
+                start = datetime(born.year, born.month, born.day) + timedelta(days=day, hours=8)
+                feedings += [{"feeding_id": f"feed_{baby_id}_{day}_{n}", "baby_id": baby_id, "user_id": "u",
+                              "feeding_type": "bottle", "amount_ml": 100,
+                              "start_time": start + timedelta(hours=n)} for n in range(index + 1)]
+        await db.babies.insert_many(babies)
+        await db.feeding_records.insert_many(feedings)
+        document = await build_cohort_tables(db, EventStore(db), max_workers=1, min_babies=3)
+        stored = await db.cohort_tables.find_one({"_id": "age_weeks"})
+        return document, stored
+
+    document, stored = asyncio.run(scenario())
+    assert document["babies"] == 3
+    assert stored["metrics"]["feeds"][1][0] == 3
+    assert stored["metrics"]["feeds"][1][3] == 2.0
+    assert stored["metrics"]["bottle_ml"][1][3] == 200.0
+    assert stored["metrics"]["feeds"][0] is None
+    # Only aggregates are kept, nothing that points back to a family
+    assert "private" not in repr(stored) and "baby_0" not in repr(stored)
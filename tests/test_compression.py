@@ -0,0 +1,96 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, NegotiatedJSONResponse, _qvalues
+
+PAYLOAD = {"entries": [{"entry_id": f"feed_{i:012d}", "entry_type": "feeding"} for i in range(100)]}
+
+
+def build_client(minimum_size=1024):
+    async def large(request):
+        return NegotiatedJSONResponse(PAYLOAD)
+
+    async def small(request):
+        return NegotiatedJSONResponse({"status": "ok"})
+
+    async def stream(request):
+        async def chunks():
+            for _ in range(50):
+                yield b"x" * 100
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app = Starlette(routes=[Route("/large", large), Route("/small", small), Route("/stream", stream)])
+    return TestClient(CompressionMiddleware(app, minimum_size=minimum_size))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=0.9, br;q=0.2", "gzip"),
+    ("*", "br"),
+    ("*;q=0.5, br;q=0", "gzip"),
+    ("identity", None),
+    ("", None),
+])
+def test_encoding_follows_q_values(header, expected, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+    assert CompressionMiddleware(None)._choose_encoding(header) == expected
+
+
+def test_without_brotli_gzip_is_used(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert CompressionMiddleware(None)._choose_encoding("br, gzip") == "gzip"
+    assert CompressionMiddleware(None)._choose_encoding("br") is None
+
+
+def test_qvalues():
+    assert _qvalues("application/msgpack;q=0, application/json, text/*;q=abc") == {
+        "application/msgpack": 0.0, "application/json": 1.0, "text/*": 0.0
+    }
+
+
+def test_large_responses_are_compressed(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    response = build_client().get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == PAYLOAD
+    assert "Accept-Encoding" in response.headers["vary"]
+
+
+def test_small_responses_are_left_alone():
+    response = build_client().get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"status": "ok"}
+
+
+def test_refused_encoding_is_not_sent():
+    response = build_client().get("/large", headers={"Accept-Encoding": "gzip;q=0, br;q=0"})
+    assert "content-encoding" not in response.headers
+
+
+def test_streamed_responses_are_compressed_chunk_by_chunk(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    client = build_client()
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(raw) == b"x" * 5000
+
+
+@pytest.mark.skipif(compression.msgpack is None, reason="msgpack not installed")
+def test_msgpack_negotiation():
+    client = build_client()
+    response = client.get("/large", headers={"Accept": "application/msgpack", "Accept-Encoding": "identity"})
+    assert response.headers["content-type"] == "application/msgpack"
+    assert compression.msgpack.unpackb(response.content) == PAYLOAD
+
+    refused = client.get("/large", headers={"Accept": "application/msgpack;q=0, application/json"})
+    assert refused.json() == PAYLOAD
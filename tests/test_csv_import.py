@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from csv_import import map_columns, map_row, parse_duration, read_rows, record_id, record_type_of
+
+CSV_TEXT = (
+    "﻿Activity,Start,End,Amount (oz),Notes\n"
+    'Bottle,2025-01-01 08:00,2025-01-01 08:20,4,"first ""bottle"",\nwith a line break"\n'
+    "Nap,2025-01-01 10:00,2025-01-01 11:30,,Schläfchen\n"
+)
+
+
+def parse(data: bytes, chunk_size: int):
+    async def chunks():
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    async def collect():
+        return [row async for row in read_rows(chunks())]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1024])
+def test_rows_survive_any_chunking(chunk_size):
+    # Chunks split multi-byte characters, the BOM and quoted line breaks
+    rows = parse(CSV_TEXT.encode("utf-8"), chunk_size)
+    assert rows == [
+        ["Activity", "Start", "End", "Amount (oz)", "Notes"],
+        ["Bottle", "2025-01-01 08:00", "2025-01-01 08:20", "4", 'first "bottle",\nwith a line break'],
+        ["Nap", "2025-01-01 10:00", "2025-01-01 11:30", "", "Schläfchen"],
+    ]
+
+
+def test_last_row_without_newline():
+    assert parse(b"a,b\n1,2", 3) == [["a", "b"], ["1", "2"]]
+
+
+def test_unterminated_quote_is_rejected():
+    with pytest.raises(ValueError):
+        parse(b'a,"' + b"x\n" * 40000, 4096)
+
+
+def test_columns_are_matched_loosely():
+    columns, unmapped = map_columns(["Activity", "Type", "Start Time", "Amount (oz)", "Mood"])
+    assert columns == {"record_type": 0, "subtype": 1, "start_time": 2, "amount_oz": 3}
+    assert unmapped == ["Mood"]
+
+
+def test_record_type_from_type_or_subtype():
+    assert record_type_of({"record_type": "Nursing"}) == "feeding"
+    assert record_type_of({"subtype": "Poop"}) == "diaper"
+    assert record_type_of({"record_type": "Mood"}) is None
+
+
+def test_bottle_feeding_in_ounces_with_local_time():
+    fields = map_row("feeding", {
+        "subtype": "Formula", "start_time": "01/02/2025 08:00", "end_time": "01/02/2025 08:15",
+        "amount_oz": "4", "notes": " hungry ",
+    }, tz_offset_minutes=60)
+    assert fields == {
+        "feeding_type": "bottle",
+        "start_time": "2025-01-02T07:00:00+00:00",
+        "end_time": "2025-01-02T07:15:00+00:00",
+        "duration_minutes": 15,
+        "amount_ml": 118,
+        "notes": "hungry",
+    }
+
+
+def test_breastfeeding_needs_a_side():
+    assert map_row("feeding", {"subtype": "Breast", "side": "L", "start_time": "2025-01-01T08:00"})[
+        "feeding_type"] == "breast_left"
+    with pytest.raises(ValueError, match="side"):
+        map_row("feeding", {"subtype": "Breast", "start_time": "2025-01-01T08:00"})
+
+
+def test_sleep_type_from_local_hour_and_duration():
+    fields = map_row("sleep", {"start_time": "2025-01-01T20:30", "duration_minutes": "1h 30m"})
+    assert fields["sleep_type"] == "night"
+    assert fields["end_time"] == "2025-01-01T22:00:00+00:00"
+    with pytest.raises(ValueError, match="end time or duration"):
+        map_row("sleep", {"start_time": "2025-01-01T20:30"})
+
+
+def test_diaper_and_growth_rows():
+    assert map_row("diaper", {"subtype": "Wet & dirty", "time": "2025-01-01T09:00Z"}) == {
+        "diaper_type": "mixed", "time": "2025-01-01T09:00:00+00:00"
+    }
+    assert map_row("growth", {"date": "31.01.2025", "weight_g": "4500", "height_cm": "55,5"}) == {
+        "date": "2025-01-31", "weight_kg": 4.5, "height_cm": 55.5
+    }
+    with pytest.raises(ValueError, match="No weight"):
+        map_row("growth", {"date": "2025-01-31"})
+
+
+@pytest.mark.parametrize("value, minutes", [("45", 45), ("0:45", 45), ("1:05:00", 65), ("1h 5m", 65),
+                                            ("45 min", 45), ("2 hours", 120)])
+def test_durations(value, minutes):
+    assert parse_duration(value) == minutes
+
+
+def test_record_ids_are_stable_per_baby_and_content():
+    fields = {"diaper_type": "wet", "time": "2025-01-01T09:00:00+00:00"}
+    assert record_id("diaper", "baby_1", fields) == record_id("diaper", "baby_1", dict(fields))
+    assert record_id("diaper", "baby_1", fields) != record_id("diaper", "baby_2", fields)
+    assert record_id("diaper", "baby_1", fields).startswith("diaper_")
+    # Identical rows of one file are told apart by their position among themselves
+    assert record_id("diaper", "baby_1", fields, 1) != record_id("diaper", "baby_1", fields)
+    assert record_id("diaper", "baby_1", fields, 0) == record_id("diaper", "baby_1", fields)
+
+
+DIAPERS_CSV = (
+    "Contents,Time,Notes\n"
+    "Wet,2025-01-01 09:00,\n"
+    "Wet,2025-01-01 09:00,\n"
+    "Dirty,2025-01-01 12:00,blowout\n"
+)
+
+
+def test_identical_rows_are_separate_records(api, server, run, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+
+    def upload(**params):
+        response = api.post(f"/api/import/{baby_id}", params={"record_type": "diaper", **params},
+                            content=DIAPERS_CSV, headers={**headers, "Content-Type": "text/csv"})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    first, again = upload(), upload()
+    assert (first["inserted"], first["duplicates"]) == ({"diaper": 3}, {"diaper": 0})
+    # Re-importing the file numbers the identical rows the same way and recognises all of them
+    assert (again["inserted"], again["duplicates"]) == ({"diaper": 0}, {"diaper": 3})
+
+    # So does an import resumed after the first of the identical rows
+    now = datetime.now(timezone.utc) - timedelta(hours=1)
+    user_id = api.get("/api/auth/me", headers=headers).json()["user_id"]
+    run(server.db.imports.insert_one, {"_id": "imp_resumed", "user_id": user_id, "baby_id": baby_id,
+                                       "status": "interrupted", "rows_done": 2, "inserted": {},
+                                       "duplicates": {}, "created_at": now, "updated_at": now})
+    resumed = upload(import_id="imp_resumed")
+    assert (resumed["inserted"], resumed["duplicates"]) == ({"diaper": 0}, {"diaper": 2})
+    assert run(server.db.diaper_records.count_documents, {"baby_id": baby_id}) == 3
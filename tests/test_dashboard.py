@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+DAY = datetime(2025, 6, 1)
+
+
+def diapers(baby_id, count):
+    return [{"diaper_id": f"diaper_{baby_id}_{n:03d}", "baby_id": baby_id, "user_id": "u", "diaper_type": "wet",
+             "time": DAY + timedelta(minutes=5 * n), "created_at": DAY} for n in range(count)]
+
+
+def test_timelines_are_batched_and_limited_per_baby(api, server, run, sign_up, add_baby, monkeypatch):
+    headers = sign_up()
+    busy, quiet = add_baby(headers, "Busy"), add_baby(headers, "Quiet")
+    run(server.db.diaper_records.insert_many, diapers(busy, 120) + diapers(quiet, 3))
+
+    queried = []
+    find = server.event_store.find
+
+    def counting_find(event_type, baby_ids, *args, **kwargs):
+        queried.append((event_type, sorted(baby_ids)))
+        return find(event_type, baby_ids, *args, **kwargs)
+
+    monkeypatch.setattr(server.event_store, "find", counting_find)
+    response = api.get("/api/dashboard", params={"date": "2025-06-01", "events_limit": 500}, headers=headers)
+
+    assert response.status_code == 200
+    assert sorted(queried) == [(event_type, sorted([busy, quiet])) for event_type in ("diaper", "feeding", "sleep")]
+    timelines = {entry["baby"]["baby_id"]: entry["timeline"] for entry in response.json()["babies"]}
+    # The busy baby is capped at its newest 100 without crowding out the quiet one
+    assert len(timelines[busy]) == 100
+    assert timelines[busy][0]["entry_id"] == f"diaper_{busy}_119"
+    assert [entry["entry_id"] for entry in timelines[quiet]] == [f"diaper_{quiet}_{n:03d}" for n in (2, 1, 0)]
+
+
+def test_a_bad_birth_date_only_drops_that_babys_prediction(api, server, run, sign_up, add_baby):
+    headers = sign_up()
+    good, bad = add_baby(headers, "Good"), add_baby(headers, "Bad")
+    # Stored before birth dates were validated
+    run(server.db.babies.update_one, {"baby_id": bad}, {"$set": {"birth_date": "sometime in May"}})
+
+    response = api.get("/api/dashboard", headers=headers)
+    assert response.status_code == 200
+    predictions = {entry["baby"]["baby_id"]: entry["sleep_prediction"] for entry in response.json()["babies"]}
+    assert predictions[bad] is None and predictions[good]["recommended_duration_minutes"]
+    # Asking for that baby's prediction directly still says what's wrong
+    assert api.get(f"/api/sleep/prediction/{bad}", headers=headers).status_code == 422
@@ -0,0 +1,26 @@
+import asyncio
+from datetime import datetime
+
+from event_store import EventStore
+
+
+def diapers(count=3):
+    return [{"diaper_id": f"diaper_{n}", "baby_id": "baby_1", "user_id": "u", "diaper_type": "wet",
+             "time": datetime(2025, 1, 1, 8 + n)} for n in range(count)]
+
+
+def test_insert_missing_mirrors_only_unmirrored_records(db):
+    store = EventStore(db, "dual")
+
+    async def scenario():
+        await store.setup()
+        records = diapers()
+        await db.diaper_records.insert_many([dict(r) for r in records])
+        # As if a crash had hit between the record and event writes for the last two
+        await store.insert_many("diaper", [dict(records[0])])
+        await store.insert_missing("diaper", records)
+        await store.insert_missing("diaper", records)
+        return await db.events.find({}, {"_id": 0, "diaper_id": 1}).sort("diaper_id", 1).to_list(None)
+
+    assert asyncio.run(scenario()) == [{"diaper_id": f"diaper_{n}"} for n in range(3)]
+
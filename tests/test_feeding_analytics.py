@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+from feeding_analytics import FeedingAnalyticsCache, analyze_feedings
+
+START = datetime(2025, 6, 1)
+
+
+def feeding(minutes, feeding_type="bottle", amount=None, duration=None):
+    return {"start_time": START + timedelta(minutes=minutes), "feeding_type": feeding_type,
+            "amount_ml": amount, "duration_minutes": duration}
+
+
+def test_side_switches_count_as_one_session():
+    records = [
+        feeding(0, "breast_left", duration=10), feeding(12, "breast_right", duration=8),
+        feeding(180, "breast_left", duration=15), feeding(420, "breast_right", duration=5),
+    ]
+    result = analyze_feedings(records, START, days=1)
+    assert (result["feed_count"], result["session_count"]) == (4, 3)
+    assert result["intervals"]["last_minutes"] == 240
+    assert result["intervals"]["mean_minutes"] == 210
+    assert result["side_balance"] == {"left_count": 2, "right_count": 2, "left_minutes": 25,
+                                      "right_minutes": 13, "left_share": 0.5, "last_side": "right"}
+
+
+def test_daily_bottle_volume_and_trend():
+    # 400, 500 then 600 ml on three days, out of order
+    records = [feeding(day * 1440 + offset, amount=amount)
+               for day, amount in ((2, 300), (0, 200), (1, 250)) for offset in (60, 300)]
+    result = analyze_feedings(records, START, days=4)
+    assert [day["bottle_ml"] for day in result["daily"]] == [400, 500, 600, 0]
+    assert result["bottle"] == {"total_ml": 1500, "trend_ml_per_day": 100.0}
+    assert result["daily"][3]["date"] == "2025-06-04"
+
+
+def test_cluster_feeding_episodes():
+    minutes = [0, 200, 260, 320, 380, 600]
+    result = analyze_feedings([feeding(m, amount=60) for m in minutes], START, days=1)
+    (episode,) = result["cluster_feeding"]
+    assert episode["feed_count"] == 4
+    assert episode["start"].replace(tzinfo=None) == START + timedelta(minutes=200)
+    assert episode["mean_interval_minutes"] == 60
+
+
+def test_empty_window():
+    result = analyze_feedings([], START, days=2)
+    assert result["feed_count"] == 0 and len(result["daily"]) == 2
+
+
+def test_cache_invalidates_only_windows_containing_the_record():
+    cache = FeedingAnalyticsCache()
+    week_end, earlier_end = START + timedelta(days=7), START
+    cache.put("baby_1", week_end, 7, {"week": True})
+    cache.put("baby_1", earlier_end, 7, {"earlier": True})
+    cache.put("baby_2", week_end, 7, {"other": True})
+
+    cache.invalidate("baby_1", START + timedelta(days=3))
+    assert cache.get("baby_1", week_end, 7) is None
+    assert cache.get("baby_1", earlier_end, 7) == {"earlier": True}
+    assert cache.get("baby_2", week_end, 7) == {"other": True}
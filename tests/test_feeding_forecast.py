@@ -0,0 +1,134 @@
+import asyncio
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from feeding_forecast import DECAY_DAYS, MAX_DECAY_EXPONENT, FeedingForecaster, _Moments, forecast
+
+# Models are rebuilt around the current time, so the history has to be recent
+NOW = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def feeding(feeding_id: str, start: datetime, amount=None):
+    return {"feeding_id": feeding_id, "baby_id": "baby_1", "user_id": "u", "start_time": start,
+            "feeding_type": "bottle" if amount else "breast_left", "amount_ml": amount}
+
+
+def history(count=60):
+    random.seed(7)
+    moment, records = NOW - timedelta(days=10), []
+    for index in range(count):
+        moment += timedelta(minutes=random.choice([150, 180, 195, 210, 240]))
+        records.append(feeding(f"feed_{index:03d}", moment, random.choice([None, 90, 120, 150])))
+    return records
+
+
+def summary(model: dict) -> dict:
+    """Per-bucket statistics, which don't depend on the model's landmark"""
+    result = {}
+    for section in ("intervals", "amounts"):
+        for bucket, stats in model[section].items():
+            moments = _Moments(stats)
+            if moments.effective_count > 1e-6:
+                result[f"{section}.{bucket}"] = (moments.effective_count, moments.mean, moments.std)
+    return result
+
+
+def assert_same_model(incremental: dict, rebuilt: dict):
+    left, right = summary(incremental), summary(rebuilt)
+    assert left and left.keys() == right.keys()
+    for key in left:
+        assert left[key] == pytest.approx(right[key], rel=1e-6, abs=1e-6), key
+
+
+def test_weights_at_the_decay_limit_stay_finite():
+    w = math.exp(MAX_DECAY_EXPONENT)
+    moments = _Moments({"w": w, "wx": w * 180, "wxx": w * 180 * 180, "ww": w * w})
+    assert math.isfinite(moments.ww)
+    assert moments.effective_count == pytest.approx(1.0)
+    assert moments.mean == pytest.approx(180)
+
+
+def test_incremental_updates_match_a_full_rebuild(db):
+    forecaster = FeedingForecaster(db)
+    records = history()
+
+    async def scenario():
+        # The model exists before the first feed, so every change below is incremental
+        await forecaster.rebuild("baby_1")
+        for record in random.sample(records, len(records)):
+            await db.feeding_records.insert_one(dict(record))
+            await forecaster.record_added(record)
+
+        removed = records[20]
+        await db.feeding_records.delete_one({"feeding_id": removed["feeding_id"]})
+        await forecaster.record_removed(removed)
+
+        before = records[30]
+        after = {**before, "start_time": before["start_time"] + timedelta(minutes=40), "amount_ml": 60}
+        await db.feeding_records.replace_one({"feeding_id": before["feeding_id"]}, after)
+        await forecaster.record_removed(before)
+        await forecaster.record_added(after)
+
+        incremental = await db.feeding_models.find_one({"_id": "baby_1"})
+        await forecaster.delete_baby("baby_1")
+        return incremental, await forecaster.rebuild("baby_1")
+
+    incremental, rebuilt = asyncio.run(scenario())
+    assert_same_model(incremental, rebuilt)
+
+
+def test_recent_intervals_dominate_the_forecast():
+    model = {"intervals": {"h12": {"w": 0.0, "wx": 0.0, "wxx": 0.0, "ww": 0.0}}}
+    for days_ago, minutes in ((30, 120), (0, 240)):
+        w = math.exp(-days_ago / DECAY_DAYS)
+        stats = model["intervals"]["h12"]
+        for _ in range(5):
+            stats["w"] += w
+            stats["wx"] += w * minutes
+            stats["wxx"] += w * minutes * minutes
+            stats["ww"] += w * w
+
+    noon = datetime(2025, 3, 1, 12, 0)
+    result = forecast(model, {"start_time": noon, "feeding_type": "breast_left"}, age_months=2, now=noon)
+    # Shrunk a little towards the 3-hour prior, but the month-old pattern has no say
+    assert 225 <= result["interval_minutes"] <= 240
+
+
+def test_model_is_rebased_before_its_weights_overflow(db):
+    forecaster = FeedingForecaster(db)
+    landmark = NOW - timedelta(days=DECAY_DAYS * (MAX_DECAY_EXPONENT + 10))
+
+    async def scenario():
+        await db.feeding_models.insert_one({"_id": "baby_1", "landmark": landmark, "intervals": {}, "amounts": {}})
+        for record in history(10):
+            await db.feeding_records.insert_one(dict(record))
+            await forecaster.record_added(record)
+        await forecaster.close()
+        return await forecaster.load("baby_1")
+
+    model = asyncio.run(scenario())
+    assert model["landmark"] > landmark
+    # Every interval still counts, instead of a nan sending the forecast back to the priors
+    intervals = [_Moments(stats) for stats in model["intervals"].values()]
+    assert sum(moments.effective_count for moments in intervals) > 1
+    assert all(math.isfinite(moments.ww) for moments in intervals)
+
+
+def test_a_missing_model_is_rebuilt_in_the_background(db):
+    forecaster = FeedingForecaster(db)
+
+    async def scenario():
+        await db.feeding_records.insert_many([dict(record) for record in history(10)])
+        # The request isn't held up by the history scan: it forecasts from the priors
+        cold = await forecaster.load("baby_1")
+        await forecaster.close()
+        return cold, await forecaster.load("baby_1")
+
+    cold, model = asyncio.run(scenario())
+    assert cold is None
+    assert summary(model)
+    prior = forecast(cold, None, age_months=2, now=NOW)
+    assert prior["interval_minutes"] == 180 and prior["confidence"] == 0.3
@@ -0,0 +1,41 @@
+def diaper(baby_id, diaper_type="wet", time="2025-06-01T08:00:00"):
+    return {"baby_id": baby_id, "diaper_type": diaper_type, "time": time}
+
+
+def test_a_retried_post_returns_the_first_record(api, server, run, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+    keyed = {**headers, "Idempotency-Key": "retry-1"}
+
+    first = api.post("/api/diaper", json=diaper(baby_id), headers=keyed)
+    again = api.post("/api/diaper", json=diaper(baby_id), headers=keyed)
+    # Another worker has no cached copy and replays the stored response
+    server._idempotency_cache.clear()
+    elsewhere = api.post("/api/diaper", json=diaper(baby_id), headers=keyed)
+
+    assert first.status_code == again.status_code == elsewhere.status_code == 200
+    assert first.json() == again.json() == elsewhere.json()
+    assert run(server.db.diaper_records.count_documents, {"baby_id": baby_id}) == 1
+
+
+def test_reusing_a_key_for_another_request_is_rejected(api, server, run, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+    keyed = {**headers, "Idempotency-Key": "reused"}
+
+    api.post("/api/diaper", json=diaper(baby_id), headers=keyed)
+    conflict = api.post("/api/diaper", json=diaper(baby_id, "dirty", "2025-06-01T09:00:00"), headers=keyed)
+
+    assert conflict.status_code == 422
+    assert run(server.db.diaper_records.count_documents, {"baby_id": baby_id}) == 1
+
+
+def test_keys_are_scoped_per_user(api, sign_up, add_baby):
+    mine, theirs = sign_up(), sign_up()
+    my_baby, their_baby = add_baby(mine), add_baby(theirs)
+
+    first = api.post("/api/diaper", json=diaper(my_baby), headers={**mine, "Idempotency-Key": "shared"})
+    second = api.post("/api/diaper", json=diaper(their_baby), headers={**theirs, "Idempotency-Key": "shared"})
+
+    assert first.status_code == second.status_code == 200
+    assert first.json()["diaper_id"] != second.json()["diaper_id"]
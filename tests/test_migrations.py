@@ -0,0 +1,116 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+
+from migrations import Migration, MigrationRunner, Throttle, iso_date, read_date, stored_date
+
+
+def test_date_shapes():
+    assert read_date("2025-01-31") == date(2025, 1, 31)
+    assert read_date(datetime(2025, 1, 31)) == date(2025, 1, 31)
+    assert read_date("junk") is None
+    assert stored_date("2025-01-31T10:00:00") == datetime(2025, 1, 31)
+    assert iso_date(datetime(2025, 1, 31)) == "2025-01-31"
+    # Strings, even unparseable ones, are passed through unchanged
+    assert iso_date("junk") == "junk"
+
+
+def test_throttle_backs_off_on_slow_batches_and_recovers():
+    throttle = Throttle(target_ms=50, batch_size=200, min_batch=10, max_batch=2000, rest_ratio=1.0)
+
+    assert throttle.observe(latency_ms=80, elapsed=0.5) == pytest.approx(0.1 + 0.5)
+    assert throttle.batch_size == 100
+    assert throttle.observe(latency_ms=80, elapsed=0.5) == pytest.approx(0.2 + 0.5)
+    assert throttle.batch_size == 50
+
+    assert throttle.observe(latency_ms=10, elapsed=0.2) == pytest.approx(0.1 + 0.2)
+    assert throttle.batch_size == 62
+
+
+def test_throttle_stays_within_bounds():
+    throttle = Throttle(batch_size=20, min_batch=10, max_batch=25, max_pause=1.0, rest_ratio=0)
+    for _ in range(10):
+        throttle.observe(latency_ms=1000, elapsed=0)
+    assert throttle.batch_size == 10
+    assert throttle.backoff == 1.0
+    for _ in range(10):
+        throttle.observe(latency_ms=0, elapsed=0)
+    assert throttle.batch_size == 25
+
+
+BIRTH_DATES = {"baby_1": "2024-01-01", "baby_2": "2024-02-02", "baby_3": datetime(2024, 3, 3),
+               "baby_4": "not a date", "baby_5": "2024-05-05", "baby_6": "2024-06-06"}
+
+
+def seed(db):
+    return db.babies.insert_many([
+        {"baby_id": baby_id, "birth_date": birth_date} for baby_id, birth_date in BIRTH_DATES.items()
+    ])
+
+
+def fast_throttle():
+    return Throttle(target_ms=10000, batch_size=2, min_batch=1, rest_ratio=0)
+
+
+def test_runner_converts_and_reports(db):
+    migration = Migration(1, "birth_date_as_date", {"babies": ["birth_date"]},
+                          lambda value: stored_date(value) if isinstance(value, str) else None)
+    runner = MigrationRunner(db, [migration], fast_throttle())
+
+    async def scenario():
+        await seed(db)
+        converted = await runner.run()
+        babies = await db.babies.find({}, {"_id": 0}).to_list(None)
+        return converted, {b["baby_id"]: b["birth_date"] for b in babies}, await runner.status()
+
+    converted, birth_dates, [status] = asyncio.run(scenario())
+    assert converted == {1: 4}
+    assert birth_dates["baby_1"] == datetime(2024, 1, 1)
+    assert birth_dates["baby_3"] == datetime(2024, 3, 3)
+    assert birth_dates["baby_4"] == "not a date"
+    assert status == {"version": 1, "name": "birth_date_as_date", "status": "done",
+                      "scanned": 6, "converted": 4, "unconvertible": 1}
+
+
+def test_interrupted_run_resumes_from_its_checkpoint(db):
+    seen = []
+
+    def flaky(value):
+        seen.append(value)
+        if len(seen) == 4:
+            raise RuntimeError("connection lost")
+        return stored_date(value) if isinstance(value, str) else None
+
+    migration = Migration(1, "birth_date_as_date", {"babies": ["birth_date"]}, flaky)
+
+    async def scenario():
+        await seed(db)
+        with pytest.raises(RuntimeError):
+            await MigrationRunner(db, [migration], fast_throttle()).run()
+        interrupted = await MigrationRunner(db, [migration]).status()
+        scanned_before = len(seen)
+        await MigrationRunner(db, [migration], fast_throttle()).run()
+        return interrupted, scanned_before, await MigrationRunner(db, [migration]).status()
+
+    [interrupted], scanned_before, [done] = asyncio.run(scenario())
+    assert interrupted["status"] == "running"
+    assert interrupted["scanned"] == 2
+    # The checkpointed batch is not read again
+    assert len(seen) - scanned_before == 4
+    assert (done["status"], done["scanned"], done["converted"]) == ("done", 6, 4)
+
+
+def test_runner_stops_at_the_requested_version(db):
+    migrations = [
+        Migration(1, "first", {"babies": ["birth_date"]}, lambda value: None),
+        Migration(2, "second", {"babies": ["birth_date"]}, lambda value: None),
+    ]
+
+    async def scenario():
+        await seed(db)
+        runner = MigrationRunner(db, migrations, fast_throttle())
+        await runner.run(up_to_version=1)
+        return [m["status"] for m in await runner.status()]
+
+    assert asyncio.run(scenario()) == ["done", "pending"]
@@ -0,0 +1,22 @@
+from profiler import PROFILE_HEADER, RequestProfiler
+
+
+def scope(value: bytes) -> dict:
+    return {"method": "GET", "path": "/api/x", "headers": [(PROFILE_HEADER.encode(), value)]}
+
+
+def test_header_token_enables_profiling():
+    profiler = RequestProfiler()
+    profiler.set_key(b"key")
+    token, _ = profiler.issue_token(60)
+    assert profiler.wants(scope(token.encode()))
+    assert not profiler.wants(scope(token.encode() + b"0"))
+
+
+def test_malformed_header_tokens_are_ignored():
+    profiler = RequestProfiler()
+    # No key yet: nothing is accepted
+    assert not profiler.wants(scope(b"9999999999.abc"))
+    profiler.set_key(b"key")
+    for value in ("9999999999.\xe9".encode("latin-1"), "²².abc".encode(), b"", b".", b"1.abc"):
+        assert not profiler.wants(scope(value))
@@ -0,0 +1,19 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+from query import apply_update, match, run_pipeline
+
+
+def test_pipeline_updates_unset_fields():
+    doc = {"a": 1, "b": {"c": 2, "d": 3}}
+    updated = apply_update(doc, [{"$set": {"e": "$a"}}, {"$unset": ["a", "b.c"]}], False)
+    assert updated == {"b": {"d": 3}, "e": 1}
+
+
+def test_unsupported_operators_fail_like_the_server():
+    with pytest.raises(OperationFailure, match=r"\$where is not supported"):
+        match({"a": 1}, {"a": {"$where": "1"}})
+    with pytest.raises(OperationFailure, match=r"\$project is not supported"):
+        apply_update({"a": 1}, [{"$project": {"a": 1}}], False)
+    with pytest.raises(OperationFailure, match=r"\$graphLookup is not supported"):
+        run_pipeline([{"a": 1}], [{"$graphLookup": {}}])
@@ -0,0 +1,101 @@
+import asyncio
+
+import rate_limit
+from rate_limit import MemoryBucketBackend, MongoBucketBackend, _baby_ids, _caller_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_bucket_allows_capacity_then_refills(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    backend = MemoryBucketBackend()
+
+    async def take():
+        return await backend.take("user:a", capacity=3, per_second=1)
+
+    assert [asyncio.run(take()) for _ in range(3)] == [0, 0, 0]
+    assert asyncio.run(take()) == 1.0
+
+    clock.now += 0.5
+    assert asyncio.run(take()) == 0.5
+    clock.now += 1
+    assert asyncio.run(take()) == 0
+
+
+def test_memory_buckets_are_per_key(monkeypatch):
+    monkeypatch.setattr(rate_limit.time, "monotonic", FakeClock())
+    backend = MemoryBucketBackend()
+
+    async def scenario():
+        first = await backend.take("user:a", capacity=1, per_second=1)
+        second = await backend.take("user:a", capacity=1, per_second=1)
+        other = await backend.take("user:b", capacity=1, per_second=1)
+        return first, second, other
+
+    assert asyncio.run(scenario()) == (0, 1.0, 0)
+
+
+def test_shared_bucket_limits_across_calls(db):
+    backend = MongoBucketBackend(db)
+
+    async def scenario():
+        await backend.setup()
+        return [await backend.take("user:a", capacity=2, per_second=0.01) for _ in range(3)]
+
+    allowed, again, rejected = asyncio.run(scenario())
+    assert (allowed, again) == (0, 0)
+    assert rejected > 90
+
+
+def test_concurrent_first_requests_share_one_bucket(db):
+    backend = MongoBucketBackend(db)
+
+    async def scenario():
+        return await asyncio.gather(*(backend.take("user:new", capacity=5, per_second=0.01) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [0] * 5
+
+
+def scope(headers=(), client=("10.0.0.1", 1234), path="/api/feeding", query=b""):
+    return {"headers": [(k.encode(), v.encode()) for k, v in headers], "client": client,
+            "path": path, "query_string": query}
+
+
+def verify(token):
+    return "user_1" if token == "valid" else None
+
+
+def test_verified_tokens_key_the_user():
+    assert _caller_key(scope([("authorization", "Bearer valid")]), verify) == "user_1"
+    assert _caller_key(scope([("cookie", "theme=dark; access_token=valid")]), verify) == "user_1"
+
+
+def test_unverifiable_callers_are_keyed_by_ip():
+    # Rotating made-up tokens must not buy fresh buckets
+    keys = {_caller_key(scope([("authorization", f"Bearer forged{i}")]), verify) for i in range(5)}
+    assert keys == {"ip:10.0.0.1"}
+    assert _caller_key(scope(), verify) == "ip:10.0.0.1"
+    assert _caller_key(scope(client=None), verify) == "anonymous"
+
+
+def test_the_proxy_header_keys_callers_behind_a_proxy():
+    proxied = [("x-forwarded-for", "6.6.6.6, 192.0.2.7")]
+    # Only the entry appended by the proxy counts; the rest is client-supplied
+    assert _caller_key(scope(proxied), verify, b"x-forwarded-for") == "ip:192.0.2.7"
+    assert _caller_key(scope(), verify, b"x-forwarded-for") == "ip:10.0.0.1"
+    # Not configured: the header is ignored, so clients can't pick their own bucket
+    assert _caller_key(scope(proxied), verify) == "ip:10.0.0.1"
+
+
+def test_babies_come_from_the_path_and_query():
+    assert _baby_ids(scope(path="/api/timeline/baby_a")) == ["baby_a"]
+    assert _baby_ids(scope(path="/api/search", query=b"q=rash&baby_id=baby_b")) == ["baby_b"]
+    assert _baby_ids(scope(path="/api/stats/baby_a", query=b"baby_id=baby_a")) == ["baby_a"]
+    assert _baby_ids(scope(path="/api/feeding")) == []
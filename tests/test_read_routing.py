@@ -0,0 +1,60 @@
+import time
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from read_routing import ReadRouter, ReadYourWritesMiddleware
+
+NO_HEADERS = {}
+
+
+def test_a_recent_write_cookie_routes_reads_to_the_primary(db):
+    router = ReadRouter(db, max_staleness_seconds=90)
+    now = int(time.time())
+
+    assert router.wants_primary("user_1", NO_HEADERS, {"last_write": str(now - 30)})
+    # The secondaries have caught up once the sticky period is over
+    assert not router.wants_primary("user_1", NO_HEADERS, {"last_write": str(now - router.sticky_seconds - 1)})
+    assert not router.wants_primary("user_1", NO_HEADERS, {"last_write": "garbage"})
+    assert not router.wants_primary("user_1", NO_HEADERS, {})
+
+
+def test_the_worker_that_took_a_write_remembers_the_user(db):
+    router = ReadRouter(db)
+    router.note_write("user_1")
+    assert router.wants_primary("user_1", NO_HEADERS, {})
+    assert not router.wants_primary("user_2", NO_HEADERS, {})
+
+
+def test_strong_reads_and_primary_only_setups(db):
+    assert ReadRouter(db).wants_primary("user_1", {"X-Read-Consistency": "strong"}, {})
+    assert ReadRouter(db, analytics_read_preference="primary").wants_primary("user_1", NO_HEADERS, {})
+    # Without read-your-writes only the header forces the primary
+    router = ReadRouter(db, read_your_writes=False)
+    router.note_write("user_1")
+    assert not router.wants_primary("user_1", NO_HEADERS, {"last_write": str(int(time.time()))})
+
+
+def test_successful_writes_set_the_cookie(db):
+    app = FastAPI()
+
+    @app.post("/ok")
+    async def ok():
+        return {}
+
+    @app.post("/bad")
+    async def bad():
+        raise HTTPException(status_code=400)
+
+    @app.get("/read")
+    async def read():
+        return {}
+
+    app.add_middleware(ReadYourWritesMiddleware, router=ReadRouter(db))
+    client = TestClient(app)
+
+    cookie = client.post("/ok").headers.get("set-cookie", "")
+    assert cookie.startswith("last_write=")
+    assert abs(int(cookie.split(";")[0].split("=")[1]) - time.time()) < 5
+    assert "set-cookie" not in client.get("/read").headers
+    assert "set-cookie" not in client.post("/bad").headers
@@ -0,0 +1,42 @@
+def add_diaper(api, headers, baby_id):
+    response = api.post("/api/diaper", json={"baby_id": baby_id, "diaper_type": "wet", "notes": "rash",
+                                             "time": "2025-06-01T08:00:00"}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["diaper_id"]
+
+
+def user_id(api, headers):
+    return api.get("/api/auth/me", headers=headers).json()["user_id"]
+
+
+def test_missing_and_forbidden_records(api, server, run, sign_up, add_baby):
+    owner, stranger = sign_up(), sign_up()
+    diaper_id = add_diaper(api, owner, add_baby(owner))
+
+    assert api.put("/api/diaper/diaper_missing", json={"notes": "x"}, headers=owner).status_code == 404
+    assert api.put(f"/api/diaper/{diaper_id}", json={"notes": "x"}, headers=stranger).status_code == 403
+    assert api.delete(f"/api/diaper/{diaper_id}", headers=stranger).status_code == 403
+    stored = run(server.db.diaper_records.find_one, {"diaper_id": diaper_id})
+    assert stored["notes"] == "rash"
+
+
+def test_sharing_grants_and_revokes_access_at_once(api, server, run, sign_up, add_baby):
+    owner, caregiver = sign_up(), sign_up()
+    baby_id = add_baby(owner)
+    diaper_id = add_diaper(api, owner, baby_id)
+    run(server.db.babies.update_one, {"baby_id": baby_id}, {"$push": {"shared_with": user_id(api, caregiver)}})
+
+    assert api.put(f"/api/diaper/{diaper_id}", json={"notes": "better"}, headers=caregiver).status_code == 200
+
+    run(server.db.babies.update_one, {"baby_id": baby_id}, {"$set": {"shared_with": []}})
+    assert api.put(f"/api/diaper/{diaper_id}", json={"notes": "again"}, headers=caregiver).status_code == 403
+
+
+def test_null_clears_optional_fields_only(api, sign_up, add_baby):
+    headers = sign_up()
+    diaper_id = add_diaper(api, headers, add_baby(headers))
+
+    cleared = api.put(f"/api/diaper/{diaper_id}", json={"notes": None}, headers=headers)
+    assert cleared.status_code == 200 and cleared.json()["notes"] is None
+    required = api.put(f"/api/diaper/{diaper_id}", json={"diaper_type": None}, headers=headers)
+    assert required.status_code == 400
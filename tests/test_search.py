@@ -0,0 +1,79 @@
+from datetime import datetime
+
+
+def note(api, headers, baby_id, notes, time, kind="diaper"):
+    if kind == "diaper":
+        body = {"baby_id": baby_id, "diaper_type": "wet", "time": time, "notes": notes}
+    else:
+        body = {"baby_id": baby_id, "feeding_type": "solid", "start_time": time, "notes": notes}
+    response = api.post(f"/api/{kind}", json=body, headers=headers)
+    assert response.status_code == 200
+    return response.json()[f"{kind}_id"]
+
+
+def search(api, headers, **params):
+    response = api.get("/api/search", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def every_page(api, headers, **params):
+    ids, cursor = [], None
+    while True:
+        page = search(api, headers, **params, **({"cursor": cursor} if cursor else {}))
+        ids += [entry["entry_id"] for entry in page["results"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return ids
+
+
+def test_results_are_ranked_by_relevance_or_time(api, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+    once = note(api, headers, baby_id, "small rash today", "2025-06-03T08:00:00")
+    twice = note(api, headers, baby_id, "rash cream on the rash", "2025-06-01T08:00:00")
+    note(api, headers, baby_id, "all fine", "2025-06-02T08:00:00")
+
+    by_relevance = search(api, headers, q="rash")["results"]
+    assert [entry["entry_id"] for entry in by_relevance] == [twice, once]
+    assert by_relevance[0]["score"] > by_relevance[1]["score"]
+    assert [entry["entry_id"] for entry in search(api, headers, q="rash", sort="time")["results"]] == [once, twice]
+    assert search(api, headers, q="rash -cream")["results"][0]["entry_id"] == once
+
+
+def test_pages_cover_every_match_once(api, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+    expected = {note(api, headers, baby_id, "spit up " * (1 + n % 3), f"2025-06-01T0{n}:00:00",
+                     kind="feeding" if n % 2 else "diaper") for n in range(7)}
+
+    for sort in ("relevance", "time"):
+        ids = every_page(api, headers, q="spit", sort=sort, limit=2)
+        assert len(ids) == len(expected) and set(ids) == expected, sort
+
+
+def test_only_accessible_babies_are_searched(api, sign_up, add_baby):
+    mine, theirs = sign_up(), sign_up()
+    my_baby, their_baby = add_baby(mine), add_baby(theirs)
+    own = note(api, mine, my_baby, "teething", "2025-06-01T08:00:00")
+    note(api, theirs, their_baby, "teething", "2025-06-01T08:00:00")
+
+    assert [entry["entry_id"] for entry in search(api, mine, q="teething")["results"]] == [own]
+    forbidden = api.get("/api/search", params={"q": "teething", "baby_id": their_baby}, headers=mine)
+    assert forbidden.status_code == 403
+
+
+def test_archived_records_are_searched(api, server, run, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers)
+    old = note(api, headers, baby_id, "first tooth", "2023-05-10T08:00:00")
+    recent = note(api, headers, baby_id, "another tooth", "2025-06-01T08:00:00")
+
+    archive = server.event_store.archive
+    run(archive.set_horizon, datetime(2024, 1, 1))
+    assert run(archive.archive_month, "diaper", baby_id, datetime(2023, 5, 1)) == 1
+
+    results = search(api, headers, q="tooth", sort="time")["results"]
+    assert [entry["entry_id"] for entry in results] == [recent, old]
+    assert every_page(api, headers, q="tooth", limit=1) == [entry["entry_id"] for entry in
+                                                              search(api, headers, q="tooth")["results"]]
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Counter:
+    """A slow computation counting how often it runs"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        run = self.calls
+        await asyncio.sleep(0.01)
+        return {"run": run}
+
+
+def test_concurrent_callers_share_one_computation():
+    flight, compute = SingleFlight(), Counter()
+
+    async def scenario():
+        return await asyncio.gather(*(flight.run("baby_1", ("stats",), compute) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert compute.calls == 1
+    assert results == [{"run": 1}] * 5
+
+
+def test_different_keys_and_later_calls_compute_again():
+    flight, compute = SingleFlight(), Counter()
+
+    async def scenario():
+        await asyncio.gather(flight.run("baby_1", ("stats",), compute), flight.run("baby_2", ("stats",), compute))
+        # Without a result TTL nothing is kept once the computation is done
+        return await flight.run("baby_1", ("stats",), compute)
+
+    assert asyncio.run(scenario()) == {"run": 3}
+
+
+def test_a_write_starts_a_fresh_computation():
+    flight, compute = SingleFlight(), Counter()
+
+    async def scenario():
+        before = asyncio.ensure_future(flight.run("baby_1", ("timeline",), compute))
+        await asyncio.sleep(0)
+        flight.bump("baby_1")
+        after = await flight.run("baby_1", ("timeline",), compute)
+        return await before, after
+
+    before, after = asyncio.run(scenario())
+    assert (before, after) == ({"run": 1}, {"run": 2})
+
+
+def test_results_are_reused_within_the_ttl_until_a_write():
+    flight, compute = SingleFlight(result_ttl_seconds=60), Counter()
+
+    async def scenario():
+        first = await flight.run("baby_1", ("stats",), compute)
+        cached = await flight.run("baby_1", ("stats",), compute)
+        flight.bump("baby_1")
+        return first, cached, await flight.run("baby_1", ("stats",), compute)
+
+    assert asyncio.run(scenario()) == ({"run": 1}, {"run": 1}, {"run": 2})
+
+
+def test_failures_reach_every_caller_and_are_not_cached():
+    flight = SingleFlight(result_ttl_seconds=60)
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database down")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.run("baby_1", ("stats",), failing) for _ in range(3)),
+                                       return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flight.run("baby_1", ("stats",), failing)
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(calls) == 2
+
+
+def test_a_disconnected_caller_does_not_cancel_the_others():
+    flight, compute = SingleFlight(), Counter()
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.run("baby_1", ("stats",), compute))
+        second = asyncio.ensure_future(flight.run("baby_1", ("stats",), compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == {"run": 1}
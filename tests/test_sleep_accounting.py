@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from event_store import EventStore
+from sleep_accounting import CONTEXT, MAX_SLEEP_DURATION, SLEEP_PROJECTION, account_sleep, merge_intervals
+
+DAY = datetime(2025, 1, 1)
+NOW = datetime(2025, 2, 1)
+
+
+def sleep(start: datetime, end=None, sleep_id="s"):
+    return {"sleep_id": sleep_id, "baby_id": "baby_1", "start_time": start, "end_time": end}
+
+
+def test_night_sleep_is_split_across_midnight():
+    days = account_sleep([sleep(DAY.replace(hour=20), DAY + timedelta(days=1, hours=6))], DAY, 2, now=NOW)
+
+    assert [d["night_minutes"] for d in days] == [240, 360]
+    assert [d["day_minutes"] for d in days] == [0, 0]
+    # Counted on the day it started, its stretch on the day it ended
+    assert [d["sleep_count"] for d in days] == [1, 0]
+    assert [d["longest_stretch_minutes"] for d in days] == [0, 600]
+
+
+def test_day_and_night_split_at_night_start():
+    [day] = account_sleep([sleep(DAY.replace(hour=18), DAY.replace(hour=20))], DAY, 1, now=NOW)
+    assert (day["day_minutes"], day["night_minutes"]) == (60, 60)
+
+
+def test_overlapping_records_are_counted_once():
+    records = [
+        sleep(DAY.replace(hour=13), DAY.replace(hour=14), "a"),
+        sleep(DAY.replace(hour=13, minute=30), DAY.replace(hour=14, minute=30), "b"),
+    ]
+    [day] = account_sleep(records, DAY, 1, now=NOW)
+    assert day["total_minutes"] == 90
+    assert day["sleep_count"] == 2
+
+
+def test_back_to_back_intervals_merge():
+    a, b, c = DAY, DAY + timedelta(hours=1), DAY + timedelta(hours=2)
+    assert merge_intervals([(b, c), (a, b)]) == [(a, c)]
+
+
+def test_wake_windows():
+    records = [
+        sleep(DAY.replace(hour=9), DAY.replace(hour=10), "a"),
+        sleep(DAY.replace(hour=12), DAY.replace(hour=13), "b"),
+        sleep(DAY.replace(hour=15), DAY.replace(hour=16), "c"),
+    ]
+    [day] = account_sleep(records, DAY, 1, now=NOW)
+    assert day["wake_windows"] == {"count": 2, "mean_minutes": 120, "max_minutes": 120}
+
+
+def test_local_days_follow_the_utc_offset():
+    # 22:00-23:00 UTC is 00:00-01:00 the next day at UTC+2
+    record = sleep(DAY.replace(hour=22), DAY.replace(hour=23))
+    days = account_sleep([record], DAY, 2, now=NOW, utc_offset_minutes=120)
+    assert [d["total_minutes"] for d in days] == [0, 60]
+    assert days[1]["night_minutes"] == 60
+
+
+def test_ongoing_sleep_counts_until_now():
+    [day] = account_sleep([sleep(DAY.replace(hour=10))], DAY, 1, now=DAY.replace(hour=10, minute=30))
+    assert day["total_minutes"] == 30
+
+
+def test_segments():
+    [day] = account_sleep([sleep(DAY.replace(hour=18), DAY.replace(hour=20))], DAY, 1, now=NOW,
+                          include_segments=True)
+    assert day["segments"] == [
+        {"start_minute": 18 * 60, "end_minute": 19 * 60, "night": False},
+        {"start_minute": 19 * 60, "end_minute": 20 * 60, "night": True},
+    ]
+
+
+def test_overlap_query_feeds_the_sweep(db):
+    async def scenario():
+        await db.sleep_records.insert_many([
+            # Started the evening before the window and still counts
+            sleep(DAY - timedelta(hours=3), DAY + timedelta(hours=6), "night"),
+            sleep(DAY.replace(hour=13), DAY.replace(hour=14), "nap"),
+            # Long over before the window
+            sleep(DAY - timedelta(days=5), DAY - timedelta(days=5) + timedelta(hours=1), "old"),
+        ])
+        store = EventStore(db)
+        window_end = DAY + timedelta(days=1)
+        records = await store.find_overlapping(
+            "sleep", ["baby_1"], DAY - CONTEXT, window_end, MAX_SLEEP_DURATION, SLEEP_PROJECTION
+        ).to_list(None)
+        return records, account_sleep(records, DAY, 1, now=NOW)
+
+    records, [day] = asyncio.run(scenario())
+    assert {r["sleep_id"] for r in records} == {"night", "nap"}
+    assert (day["night_minutes"], day["day_minutes"]) == (360, 60)
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import visit_report
+from visit_report import RendererBusy, ReportRenderer, data_version
+
+
+def test_data_version_follows_the_content():
+    data = {"baby": {"name": "A"}, "days": [{"feeds": 8}]}
+    assert data_version(data) == data_version({"days": [{"feeds": 8}], "baby": {"name": "A"}})
+    assert data_version(data) != data_version({**data, "days": [{"feeds": 9}]})
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    """A renderer on threads, rendering slowly and counting renders"""
+    renders = []
+
+    def slow_render(data, fmt):
+        renders.append(data)
+        time.sleep(0.05)
+        return f"{fmt}:{data['n']}".encode()
+
+    monkeypatch.setattr(visit_report, "render", slow_render)
+    renderer = ReportRenderer(max_workers=1, max_queued=1)
+    executor = ThreadPoolExecutor(1)
+    monkeypatch.setattr(renderer, "_pool", lambda: executor)
+    renderer.renders = renders
+    yield renderer
+    executor.shutdown()
+
+
+def test_identical_renders_run_once_and_are_cached(renderer):
+    async def scenario():
+        together = await asyncio.gather(*(renderer.render(("k", 1), {"n": 1}, "pdf") for _ in range(3)))
+        return together, await renderer.render(("k", 1), {"n": 1}, "pdf")
+
+    together, later = asyncio.run(scenario())
+    assert together == [b"pdf:1"] * 3 and later == b"pdf:1"
+    assert len(renderer.renders) == 1
+
+
+def test_too_many_renders_are_turned_away(renderer):
+    async def scenario():
+        return await asyncio.gather(*(renderer.render(("k", n), {"n": n}, "pdf") for n in range(3)),
+                                    return_exceptions=True)
+
+    first, second, third = asyncio.run(scenario())
+    assert (first, second) == (b"pdf:0", b"pdf:1")
+    assert isinstance(third, RendererBusy)
+
+
+def test_report_endpoint_renders_html_and_pdf(api, sign_up, add_baby):
+    headers = sign_up()
+    baby_id = add_baby(headers, name="Robin")
+    api.post("/api/feeding", json={"baby_id": baby_id, "feeding_type": "bottle", "amount_ml": 120,
+                                   "start_time": "2025-06-01T08:00:00"}, headers=headers)
+    api.post("/api/diaper", json={"baby_id": baby_id, "diaper_type": "wet", "time": "2025-06-02T09:00:00"},
+             headers=headers)
+    period = {"start": "2025-06-01", "end": "2025-06-02"}
+
+    page = api.get(f"/api/report/{baby_id}", params={**period, "format": "html"}, headers=headers)
+    assert page.status_code == 200 and page.headers["content-type"].startswith("text/html")
+    assert "Visit summary: Robin" in page.text and "2025-06-01 to 2025-06-02 (2 days)" in page.text
+
+    pdf = api.get(f"/api/report/{baby_id}", params=period, headers=headers)
+    assert pdf.status_code == 200 and pdf.content.startswith(b"%PDF")
+    assert 'filename="visit-summary-2025-06-01-2025-06-02.pdf"' in pdf.headers["content-disposition"]
+
+    stranger = sign_up()
+    assert api.get(f"/api/report/{baby_id}", params=period, headers=stranger).status_code == 403
@@ -0,0 +1,71 @@
+import asyncio
+
+from pymongo.errors import WriteError
+
+from write_buffer import WriteBuffer
+
+
+class CountingCollection:
+    """Wraps a collection and records the size of each batched insert"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        self.batches = []
+
+    async def insert_one(self, doc):
+        self.batches.append(1)
+        return await self.collection.insert_one(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        self.batches.append(len(docs))
+        return await self.collection.insert_many(docs, ordered=ordered)
+
+
+def test_concurrent_inserts_share_one_batch(db):
+    buffer = WriteBuffer(window_ms=20, max_batch=4)
+    collection = CountingCollection(db.diaper_records)
+
+    async def scenario():
+        await asyncio.gather(*(buffer.insert(collection, {"diaper_id": f"d{n}"}) for n in range(6)))
+        return await db.diaper_records.count_documents({})
+
+    # Full batches go out at once, the rest when the window closes
+    assert asyncio.run(scenario()) == 6
+    assert collection.batches == [4, 2]
+
+
+def test_a_failed_document_fails_only_its_caller(db):
+    buffer = WriteBuffer(window_ms=20)
+
+    async def scenario():
+        await db.diaper_records.create_index("diaper_id", unique=True, name="diaper_id_unique")
+        await db.diaper_records.insert_one({"diaper_id": "taken"})
+        return await asyncio.gather(
+            *(buffer.insert(db.diaper_records, {"diaper_id": name}) for name in ("a", "taken", "b")),
+            return_exceptions=True
+        )
+
+    first, duplicate, last = asyncio.run(scenario())
+    assert first is None and last is None
+    assert isinstance(duplicate, WriteError) and duplicate.code == 11000
+
+
+def test_close_flushes_pending_inserts(db):
+    buffer = WriteBuffer(window_ms=60_000)
+
+    async def scenario():
+        pending = asyncio.ensure_future(buffer.insert(db.diaper_records, {"diaper_id": "late"}))
+        await asyncio.sleep(0)
+        await buffer.close()
+        await pending
+        return await db.diaper_records.count_documents({})
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_disabled_buffer_inserts_directly(db):
+    buffer = WriteBuffer()
+    collection = CountingCollection(db.diaper_records)
+    asyncio.run(buffer.insert(collection, {"diaper_id": "d"}))
+    assert not buffer.enabled and collection.batches == [1]